@@ -11,6 +11,7 @@ import json
 
 #third party
 from libcomcat import comcat
+from libcomcat.mirror import Mirror
 from neicmap import distance
 import numpy as np
 
@@ -82,7 +83,7 @@ def getInputParams(params):
         pass
     return (time,lat,lon)
 
-def getEventInfo(time,lat,lon,twindow,radius):
+def getEventInfo(time,lat,lon,twindow,radius,mirror=None):
     url = comcat.URLBASE
     params = {'format':'geojson'}
     #set time thresholds
@@ -93,18 +94,22 @@ def getEventInfo(time,lat,lon,twindow,radius):
     params['latitude'] = lat
     params['longitude'] = lon
     params['maxradiuskm'] = radius
-    
-    urlparams = urllib.urlencode(params)
-    url = comcat.URLBASE % urlparams
-    data = None
-    try:
-        fh = comcat.getURLHandle(url)
-        data = fh.read()
-        fh.close()
-    except urllib2.URLError,msg:
-        raise Exception('Could not open search url %s.  "%s"' % (url,str(msg)))
-        
-    jdict = json.loads(data)
+
+    if mirror is not None:
+        #the local mirror returns the same (basic) features as the search feed
+        features = mirror.getFeatures(starttime=starttime,endtime=endtime,radius=(lat,lon,radius))
+        jdict = {'features':features}
+    else:
+        urlparams = urllib.urlencode(params)
+        url = comcat.URLBASE % urlparams
+        data = None
+        try:
+            fh = comcat.getURLHandle(url)
+            data = fh.read()
+            fh.close()
+        except urllib2.URLError,msg:
+            raise Exception('Could not open search url %s.  "%s"' % (url,str(msg)))
+        jdict = json.loads(data)
     if len(jdict['features']):
         eventids,url,dmin,tmin,azim = getClosest(lat,lon,time,jdict['features'])
     else:
@@ -125,6 +130,9 @@ def main(args):
     radius = RADIUS
     if args.radius:
         radius = args.radius
+    mirror = None
+    if args.local:
+        mirror = Mirror(args.local)
     if args.params:
         time,lat,lon = getInputParams(args.params)
         if time is None or lat is None or lon is None:
@@ -133,7 +141,7 @@ def main(args):
             integers or floats.  Exiting.'''
             print fmt % (' '.join(args.params),TIMEFMT)
             sys.exit(1)
-        eventids,url,dmin,tmin,azim = getEventInfo(time,lat,lon,radius,twindow)
+        eventids,url,dmin,tmin,azim = getEventInfo(time,lat,lon,radius,twindow,mirror=mirror)
         if args.printAll:
             print ' '.join(eventids)
         else:
@@ -169,7 +177,7 @@ def main(args):
             time = getTime(parts[0])
             lat = float(parts[1])
             lon = float(parts[2])
-            eid,url,dmin,tmin,azim = getEventInfo(time,lat,lon,twindow,radius)
+            eid,url,dmin,tmin,azim = getEventInfo(time,lat,lon,twindow,radius,mirror=mirror)
             if args.printURL:
                 newline = ','.join([eid[0],url] + parts)
             else:
@@ -217,6 +225,7 @@ if __name__ == '__main__':
      would be confused by the space between the date and the time, whereas in the csv file the input files are being split
      by commas.
      - Supplying the -a option with the -f option has no effect.
+     - To search a local mirror of ComCat made with syncmirror.py, instead of ComCat itself, add --local DIR.
     '''
 
     filehelp = """Parse time,lat,lon from input csv file, which can have a header row but must have time,lat,lon as first
@@ -241,6 +250,8 @@ if __name__ == '__main__':
                         help='Print URL associated with event.')
     parser.add_argument('-v','--verbose',action='store_true',
                         help='Print time/distance deltas, and azimuth from input parameters to event.')
+    parser.add_argument('--local', dest='local', metavar='DIR',
+                        help='Search the local mirror in this directory (see syncmirror.py) instead of ComCat.')
     
     pargs = parser.parse_args()
 
@@ -7,7 +7,9 @@ import os
 import sys
 
 #third party
-from libcomcat.comcat import getContents
+from libcomcat.comcat import getContents,getContentHandle
+from libcomcat.download import Downloader
+from libcomcat import session
 
 TIMEFMT = '%Y-%m-%dT%H:%M:%S'
 DATEFMT = '%Y-%m-%d'
@@ -32,14 +34,21 @@ def makedict(dictstring):
         raise Exception,'Could not create a single key dictionary out of %s' % dictstring
 
 def main(args):
+    downloader = Downloader(maxWorkers=args.maxWorkers,getHandle=getContentHandle)
     files = getContents(args.product,args.contents,outfolder=args.outputFolder,bounds=args.bounds,
                         starttime=args.startTime,endtime=args.endTime,magrange=args.magRange,
                         catalog=args.catalog,contributor=args.contributor,eventid=args.eventid,
                         listURL=args.listURL,eventProperties=args.eventProperties,
                         productProperties=args.productProperties,since=args.after,
-                        getAll=args.getAll)
+                        getAll=args.getAll,maxWorkers=args.maxWorkers,downloader=downloader)
     print
     print '%i files were downloaded to %s' % (len(files),args.outputFolder)
+    stats = downloader.stats()
+    if stats['files']:
+        fmt = '%.1f MB downloaded in %.1f seconds (%.2f MB/s).\n'
+        sys.stderr.write(fmt % (stats['bytes']/1e6,stats['seconds'],stats['rate']/1e6))
+    if args.maxWorkers is None:
+        sys.stderr.write('Ended with %i requests at a time.\n' % session.getSession().stats()['concurrency'])
     
 if __name__ == '__main__':
     desc = '''Download product content files from USGS ComCat.
@@ -91,11 +100,13 @@ if __name__ == '__main__':
     parser.add_argument('-p','--product-property', dest='productProperties', type=makedict,
                         help='Product property (reviewstatus:approved).')
     parser.add_argument('-t','--event-property', dest='eventProperties', 
-                        help='Event property (alert:yellow, status:REVIEWED, etc.).',type=makedict)
+                        help='Event property (alert:yellow, status:REVIEWED, minsig:600, etc.).  alert, status, type and minsig are filtered by ComCat itself.',type=makedict)
     parser.add_argument('-l','--list-url', dest='listURL', action='store_true',
                         help='Only list urls for contents in events that match criteria.')
     parser.add_argument('-g','--get-all-versions', dest='getAll', action='store_true',
                         help='Get products for every version of every event.')
+    parser.add_argument('-w','--workers', dest='maxWorkers', type=int, default=None,
+                        help='Number of events (and files) to download at the same time.  By default this adapts to how well ComCat is keeping up.')
     
     pargs = parser.parse_args()
 
@@ -3,43 +3,139 @@
 #stdlib
 import argparse
 from datetime import datetime,timedelta
-from collections import OrderedDict
 import os
 import sys
-import re
+import tempfile
+import cPickle
 
 #third party
 from libcomcat import comcat
+from libcomcat.table import EventTable,TableWriter
+from libcomcat.checkpoint import Checkpoint
+from libcomcat.mirror import Mirror
 
 TIMEFMT1 = '%Y-%m-%dT%H:%M:%S'
 TIMEFMT2 = '%Y-%m-%dT%H:%M:%S.%f'
 DATEFMT = '%Y-%m-%d'
 
-def getNewEvent(event,maxmags):
-    ibigmag = -1
-    bigmag = 0
-    for key in event.keys():
-        if re.search('mag[0-9]*-type',key):
-            ibigmag = event.keys().index(key)
-            bigmag = int(re.findall('\d+',key)[0])
-    #we can only get away with this because this is an ordereddict
-    keys = event.keys()
-    values = event.values()
-    idx = ibigmag + 1
-    for i in range(bigmag+1,maxmags+1):
-        magkey = 'mag%i' % i
-        srckey = 'mag%i-source' % i
-        typekey = 'mag%i-type' % i
-        keys.insert(idx,magkey)
-        keys.insert(idx+1,srckey)
-        keys.insert(idx+2,typekey)
-        values.insert(idx,(float('nan'),'%.1f'))
-        values.insert(idx+1,('NA','%s'))
-        values.insert(idx+2,('NA','%s'))
-        idx += 3
-    
-    newevent = OrderedDict(zip(keys,values))
-    return newevent
+def iterTables(results):
+    #convert each segment's events to a (much smaller) columnar table as soon as it arrives
+    for teventlist,tmaxmags in results:
+        yield EventTable.fromEvents(teventlist)
+
+def spillTables(tables):
+    #we can't print the header until we know the largest number of magnitudes for any event,
+    #so on the first pass we save the tables to a temporary file, and read them back on the second.
+    spill = tempfile.TemporaryFile()
+    maxmags = 0
+    for table in tables:
+        cPickle.dump(table,spill,cPickle.HIGHEST_PROTOCOL)
+        if table.getMagnitudeCount() > maxmags:
+            maxmags = table.getMagnitudeCount()
+    spill.seek(0)
+    return (readSpill(spill),maxmags)
+
+def readSpill(spill):
+    while True:
+        try:
+            table = cPickle.load(spill)
+        except EOFError:
+            break
+        yield table
+    spill.close()
+
+def writeEvents(tables,maxmags,sep):
+    #the output columns (including the number of magnitude columns) are worked out from the first
+    #table with any events in it, and then every table is written with the same format.
+    nevents = 0
+    writer = None
+    truncated = False
+    for table in tables:
+        if not len(table):
+            continue
+        nevents += len(table)
+        if writer is None:
+            writer = TableWriter(sys.stdout,table.columns.items(),maxmags=maxmags,sep=sep)
+            writer.writeHeader()
+        if not truncated and table.getMagnitudeCount() > maxmags:
+            sys.stderr.write('Some events have more than %i magnitudes, extra magnitudes will not be written.\n' % maxmags)
+            truncated = True
+        writer.write(table)
+        #get each segment's events to downstream programs as soon as possible
+        sys.stdout.flush()
+    return nevents
+
+def getQuery(args):
+    #the search parameters that must match when a checkpointed search is resumed
+    query = {}
+    for key in ['bounds','radius','magRange','catalog','contributor','getComponents',
+                'getAngles','getAllMags','limitType','debug']:
+        query[key] = getattr(args,key)
+    for key in ['startTime','endTime']:
+        query[key] = None
+        if getattr(args,key) is not None:
+            query[key] = getattr(args,key).strftime(TIMEFMT2)
+    return query
+
+def getCheckpointTables(args,stime,etime):
+    #search only the segments that aren't already in the checkpoint directory, saving each one as it completes,
+    #then read back all of the segments in time order.
+    checkpoint = Checkpoint(args.checkpoint)
+    query = getQuery(args)
+    if args.resume and checkpoint.exists():
+        checkpoint.load(query)
+    else:
+        if checkpoint.exists():
+            print 'Checkpoint directory %s is already in use.  Use --resume to continue that search.' % args.checkpoint
+            sys.exit(1)
+        segments = comcat.getAdaptiveTimeSegments(stime,etime,bounds=args.bounds,radius=args.radius,
+                                                  magrange=args.magRange,catalog=args.catalog,
+                                                  contributor=args.contributor,devServer=args.debug,
+                                                  maxWorkers=args.maxSegments)
+        checkpoint.create(query,segments)
+    pending = checkpoint.getPending()
+    sys.stderr.write('Breaking request into %i segments (%i already complete).\n' % (len(checkpoint.segments),
+                                                                                      len(checkpoint.segments)-len(pending)))
+    segments = []
+    for idx in pending:
+        stime,etime = checkpoint.segments[idx]
+        segments.append((comcat.getUTCTimeStamp(stime),comcat.getUTCTimeStamp(etime)))
+    results = comcat.getSegmentedEventData(segments,maxSegments=args.maxSegments,
+                                           bounds=args.bounds,radius=args.radius,
+                                           magrange=args.magRange,catalog=args.catalog,
+                                           contributor=args.contributor,getComponents=args.getComponents,
+                                           getAngles=args.getAngles,limitType=args.limitType,getAllMags=args.getAllMags,
+                                           devServer=args.debug,maxWorkers=args.maxWorkers)
+    #save each segment as soon as it arrives, so an interrupted search keeps what it has done
+    for i,table in enumerate(iterTables(results)):
+        idx = pending[i]
+        checkpoint.save(idx,table)
+        if args.verbose:
+            sys.stderr.write('Completed segment %i of %i (%i events).\n' % (idx+1,len(checkpoint.segments),len(table)))
+    maxmags = 0
+    if args.getAllMags:
+        maxmags = args.maxMags
+        if maxmags is None:
+            maxmags = checkpoint.getMagnitudeCount()
+    return (checkpoint.iterTables(),maxmags)
+
+def getLocalTables(args,stime,etime):
+    #search a local mirror (see syncmirror.py) instead of ComCat
+    mirror = Mirror(args.local)
+    if not mirror.isLoaded():
+        print 'Mirror in %s has not been loaded (or loading did not finish).  Load it with syncmirror.py.' % args.local
+        sys.exit(1)
+    if args.startTime is None:
+        #start where the mirror does, rather than in 1900
+        stime = comcat.getUTCTimeStamp(mirror.getQuery()['starttime'])
+    eventlist,maxmags = mirror.getEventData(bounds=args.bounds,radius=args.radius,starttime=stime,endtime=etime,
+                                            magrange=args.magRange,catalog=args.catalog,contributor=args.contributor,
+                                            getComponents=args.getComponents,getAngles=args.getAngles,
+                                            getAllMags=args.getAllMags,limitType=args.limitType)
+    mirror.close()
+    if args.getAllMags and args.maxMags is not None:
+        maxmags = args.maxMags
+    return ([EventTable.fromEvents(eventlist)],maxmags)
 
 def maketime(timestring):
     outtime = None
@@ -68,7 +164,7 @@ def main(args):
     if args.limitType and not args.getComponents:
         print 'To limit your search to specific moment tensor types, specify both -o and -l options.'
         sys.exit(1)
-    if args.getCount:
+    if args.getCount and not args.local:
         nevents,maxevents = comcat.getEventCount(bounds=args.bounds,radius=args.radius,
                                           starttime=args.startTime,endtime=args.endTime,
                                           magrange=args.magRange,catalog=args.catalog,
@@ -84,59 +180,59 @@ def main(args):
     if args.endTime:
         etime = args.endTime
 
+    if args.local and args.checkpoint:
+        print 'A search of a local mirror (--local) cannot be checkpointed.'
+        sys.exit(1)
+    if args.resume and not args.checkpoint:
+        print 'To resume a search, specify the checkpoint directory with --checkpoint.'
+        sys.exit(1)
+
     if stime >= etime:
         stimestr = stime.strftime(TIMEFMT2)
         etimestr = etime.strftime(TIMEFMT2)
         print 'End time must be greater than start time.  Your inputs: Start %s End %s' % (stimestr,etimestr)
         sys.exit(1)
 
-    #we used to do a count of how many events would be returned, 
-    #but it turns out that doing the count takes almost as much time 
-    #as a query that actually returns the data.  So, here we're just 
-    #going to split the time segment up into one-week chunks and assume
-    #that no individual segment will return more than the 20,000 event limit.
-    segments = comcat.getTimeSegments2(stime,etime)
-    eventlist = []
-    maxmags = 0
-    sys.stderr.write('Breaking request into %i segments.\n' % len(segments))
-    for stime,etime in segments:
-        #sys.stderr.write('%s - Getting data for %s => %s\n' % (comcat.ShakeDateTime.now(),stime,etime))
-        teventlist,tmaxmags = comcat.getEventData(bounds=args.bounds,radius=args.radius,starttime=stime,endtime=etime,
+    if args.local:
+        tables,maxmags = getLocalTables(args,stime,etime)
+        if args.getCount:
+            print '%i %i' % (len(tables[0]),comcat.SEARCHLIMIT)
+            sys.exit(0)
+    elif args.checkpoint:
+        tables,maxmags = getCheckpointTables(args,stime,etime)
+    else:
+        #we used to split the time segment up into one-week chunks and assume
+        #that no individual segment would return more than the 20,000 event limit.
+        #Now we ask for event counts (several at a time) and size the segments to 
+        #the density of events, so sparse searches need far fewer queries.  
+        #Any segment that still turns out to be too big is split again.
+        segments = comcat.getAdaptiveTimeSegments(stime,etime,bounds=args.bounds,radius=args.radius,
                                                   magrange=args.magRange,catalog=args.catalog,
-                                                  contributor=args.contributor,getComponents=args.getComponents,
-                                                  getAngles=args.getAngles,limitType=args.limitType,getAllMags=args.getAllMags,
-                                                  devServer=args.debug)
-        eventlist += teventlist
-        if tmaxmags > maxmags:
-            maxmags = tmaxmags
-
-    if not len(eventlist):
+                                                  contributor=args.contributor,devServer=args.debug,
+                                                  maxWorkers=args.maxSegments)
+        sys.stderr.write('Breaking request into %i segments.\n' % len(segments))
+        results = comcat.getSegmentedEventData(segments,maxSegments=args.maxSegments,
+                                               bounds=args.bounds,radius=args.radius,
+                                               magrange=args.magRange,catalog=args.catalog,
+                                               contributor=args.contributor,getComponents=args.getComponents,
+                                               getAngles=args.getAngles,limitType=args.limitType,getAllMags=args.getAllMags,
+                                               devServer=args.debug,maxWorkers=args.maxWorkers)
+        #events are written as each segment arrives, unless we have to find out how many magnitude columns there are first
+        tables = iterTables(results)
+        if args.getAllMags and args.maxMags is None:
+            tables,maxmags = spillTables(tables)
+        else:
+            maxmags = 0
+            if args.getAllMags:
+                maxmags = args.maxMags
+
+    sep = ','
+    if args.format == 'tab':
+        sep = '\t'
+    nevents = writeEvents(tables,maxmags,sep)
+    if not nevents:
         sys.stderr.write('No events found.  Exiting.\n')
         sys.exit(0)
-
-    #eventlist is a list of ordereddict objects
-    #the dict keys collectively provide the header
-    #the dict values contain (value,fmt) where value is magnitude, latitude, etc. and fmt is the formatting string
-    #print the header
-    tmpevent = getNewEvent(eventlist[0],maxmags)
-    hdrlist = tmpevent.keys()
-    print ','.join(hdrlist)
-    #get the formatting string for each line
-    fnuggets = [v[1] for v in tmpevent.values()]
-    fmt = ','.join(fnuggets)
-    for event in eventlist:
-        if args.limitType is not None and event['type'][0].lower() != args.limitType:
-            continue
-        event['time'][0] = event['time'][0].strftime(TIMEFMT2)[0:-3]
-        newevent = getNewEvent(event,maxmags)
-        tpl = tuple([v[0] for v in newevent.values()])
-        try:
-            print fmt % tpl
-        except:
-            sys.stderr.write('Could not write event %s\n' % event['id'])
-            for i in range(0,len(fnuggets)):
-                print fnuggets[i],tpl[i]
-            break
             
 
 if __name__ == '__main__':
@@ -181,6 +277,11 @@ if __name__ == '__main__':
     parameters, nodal plane angles, or moment tensor type, it must open a URL for EACH event and parse the data it finds.  
     If these parameters are not requested, then the same request will return in much less time (~10 minutes or less for a 
     20,000 event query).
+
+    Event URLs are downloaded several at a time - use the -w option to change how many.
+    To protect a long download against interruption, add --checkpoint DIR.  Each time segment is saved in DIR as it is
+    completed, and running the same command again with --resume downloads only the segments that are missing.
+    To search a local mirror of ComCat made with syncmirror.py, instead of ComCat itself, add --local DIR.
     '''
     parser = argparse.ArgumentParser(description=desc,formatter_class=argparse.RawDescriptionHelpFormatter)
     #optional arguments
@@ -208,6 +309,10 @@ if __name__ == '__main__':
                         help='Also extract focal-mechanism angles (strike,dip,rake) where available.')
     parser.add_argument('-g','--get-all-magnitudes', dest='getAllMags', action='store_true',
                         help='Extract all magnitudes (with sources),authoritative listed first.')
+    parser.add_argument('-k','--max-mags', dest='maxMags', type=int,
+                        help='Number of magnitude columns to write with -g.  Rows are then written as they are downloaded, and '
+                        'magnitudes beyond this number are dropped.  Without this option, rows are held in a temporary file '
+                        'until the largest number of magnitudes is known.')
     parser.add_argument('-f','--format', dest='format', choices=['csv','tab'], default='csv',
                         help='Output format')
     parser.add_argument('-x','--count', dest='getCount', action='store_true',
@@ -216,6 +321,17 @@ if __name__ == '__main__':
                         help='Print progress')
     parser.add_argument('-d','--debug', dest='debug', action='store_true',
                         help='Check the USGS development server (only valid inside USGS network).')
+    parser.add_argument('-w','--workers', dest='maxWorkers', type=int, default=None,
+                        help='Number of event details to download at the same time (with -o, -a or -g).  By default this adapts to how well ComCat is keeping up.')
+    parser.add_argument('--local', dest='local', metavar='DIR',
+                        help='Search the local mirror in this directory (see syncmirror.py) instead of ComCat.')
+    parser.add_argument('--checkpoint', dest='checkpoint', metavar='DIR',
+                        help='Save the results of each time segment in this directory as it is completed, '
+                        'so that an interrupted search can be resumed with --resume.')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Resume the search saved in the --checkpoint directory, skipping segments that are already complete.')
+    parser.add_argument('-p','--parallel-segments', dest='maxSegments', type=int, default=comcat.SEGMENTWORKERS,
+                        help='Number of time segments to search at the same time.')
     
     pargs = parser.parse_args()
 
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 
-import urllib2
 import json
 import sys
 from datetime import datetime
 import argparse
 
+from libcomcat import session
+
 if __name__ == '__main__':
     usage = '''
     Return the eventid,origin time,lat,lon,depth,magnitude,impact text for a given input event ID.
@@ -26,7 +27,7 @@ if __name__ == '__main__':
     
     eventid = args.eventID
     url = 'http://earthquake.usgs.gov/earthquakes/feed/v1.0/detail/%s.geojson' % eventid
-    fh = urllib2.urlopen(url)
+    fh = session.getSession().get(url)
     data = fh.read()
     fh.close()
     jdict = json.loads(data)
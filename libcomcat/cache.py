@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import sqlite3
+import threading
+import time
+import zlib
+import json
+import hashlib
+import tempfile
+import urlparse
+
+#local imports
+import session
+import stream
+
+CACHEVAR = 'COMCAT_CACHE_DIR' #environment variable which, when set, turns on the detail cache
+CACHEFILE = 'details.db'
+MAXBYTES = 500*1024*1024 #maximum size of compressed detail documents held in the cache
+TTL = 86400 #seconds before a cached detail of an older event must be revalidated
+YOUNGTTL = 600 #seconds before a cached detail of a young event must be revalidated
+YOUNGAGE = 30*86400 #events younger than this (seconds) are still likely to be changing
+MEMOTTL = 86400 #seconds before a memoized value (list of catalogs, etc.) must be fetched again
+MEMOFOLDER = 'memo'
+COMPRESSLEVEL = 6
+
+CREATE = '''CREATE TABLE IF NOT EXISTS detail (
+host TEXT,
+eventid TEXT,
+superseded INTEGER,
+updated INTEGER,
+eventtime INTEGER,
+etag TEXT,
+lastmodified TEXT,
+fetched REAL,
+accessed REAL,
+size INTEGER,
+data BLOB,
+PRIMARY KEY (host,eventid,superseded))'''
+
+class DetailCache(object):
+    """
+    Persistent, size-capped cache of ComCat event detail GeoJSON documents.
+
+    Entries are keyed by server host and event ID, and record the "updated" time of the event so that a cached
+    document can be compared against the update time reported in a search feed.  When no update
+    time is available, entries expire after a time-to-live which is shorter for young events, and
+    are then revalidated with the server using ETag/If-Modified-Since.  Documents are stored
+    zlib-compressed, and the least recently used entries are evicted when the cache grows past
+    its size limit.
+    """
+    def __init__(self,folder,maxBytes=MAXBYTES,ttl=TTL,youngTTL=YOUNGTTL,youngAge=YOUNGAGE):
+        """
+        Create (or open) a detail cache.
+        @param folder: Directory where the cache database is kept (created if necessary).
+        @keyword maxBytes: Maximum size (bytes) of compressed documents held in the cache.
+        @keyword ttl: Seconds before a cached detail of an older event must be revalidated.
+        @keyword youngTTL: Seconds before a cached detail of a young event must be revalidated.
+        @keyword youngAge: Events whose origin time is less than this many seconds ago are considered young.
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.youngTTL = youngTTL
+        self.youngAge = youngAge
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(folder,CACHEFILE),check_same_thread=False)
+        self._db.text_factory = str
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(detail)')]
+        if len(columns) and 'host' not in columns:
+            #cache written by an older version, not keyed by host - start over
+            self._db.execute('DROP TABLE detail')
+        self._db.execute(CREATE)
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size),0) FROM detail').fetchone()[0]
+        self._stats = {'hits':0,'misses':0,'revalidated':0,'evicted':0}
+
+    def getDetail(self,eventid,url,updated=None,superseded=False):
+        """
+        Return the JSON text of an event detail document, from the cache if possible.
+        @param eventid: Event ID.
+        @param url: URL of the detail document, used when the cached copy is missing or out of date.
+        @keyword updated: Update time (milliseconds) of the event as reported by a search feed, or None.
+        @keyword superseded: Boolean indicating whether url includes superseded products.
+        @return: JSON text of the event detail document.
+        """
+        key = (urlparse.urlparse(url).netloc,eventid,int(superseded))
+        entry = self._getEntry(key)
+        headers = {}
+        if entry is not None:
+            eupdated,eventtime,etag,lastmodified,fetched,data = entry
+            if updated is not None:
+                isfresh = eupdated is not None and eupdated >= updated
+            else:
+                isfresh = time.time() - fetched < self._getTTL(eventtime)
+            if isfresh:
+                self._touch(key,fetched)
+                self._count('hits')
+                return zlib.decompress(data)
+            if updated is None or (eupdated is not None and eupdated >= updated):
+                if etag is not None:
+                    headers['If-None-Match'] = etag
+                if lastmodified is not None:
+                    headers['If-Modified-Since'] = lastmodified
+        fh = session.getSession().get(url,headers=headers,hedge=True)
+        try:
+            if fh.getcode() == 304:
+                fh.read()
+                self._touch(key,time.time())
+                self._count('revalidated')
+                return zlib.decompress(entry[-1])
+            text = fh.read()
+            etag = fh.info().getheader('ETag')
+            lastmodified = fh.info().getheader('Last-Modified')
+        finally:
+            fh.close()
+        self._count('misses')
+        self._putEntry(key,text,etag,lastmodified)
+        return text
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+        @return: Dictionary with fields:
+                 - hits Number of documents served from the cache without contacting the server.
+                 - misses Number of documents downloaded.
+                 - revalidated Number of cached documents the server confirmed were unchanged.
+                 - evicted Number of entries removed to keep the cache under its size limit.
+                 - size Total size (bytes) of compressed documents in the cache.
+        """
+        self._lock.acquire()
+        try:
+            stats = self._stats.copy()
+            stats['size'] = self._size
+        finally:
+            self._lock.release()
+        return stats
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self._lock.acquire()
+        try:
+            self._db.execute('DELETE FROM detail')
+            self._db.commit()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def _getTTL(self,eventtime):
+        if eventtime is not None and time.time() - eventtime/1000.0 < self.youngAge:
+            return self.youngTTL
+        return self.ttl
+
+    def _count(self,key):
+        self._lock.acquire()
+        try:
+            self._stats[key] += 1
+        finally:
+            self._lock.release()
+
+    def _getEntry(self,key):
+        self._lock.acquire()
+        try:
+            cursor = self._db.execute('''SELECT updated,eventtime,etag,lastmodified,fetched,data FROM detail
+                                         WHERE host=? AND eventid=? AND superseded=?''',key)
+            return cursor.fetchone()
+        finally:
+            self._lock.release()
+
+    def _touch(self,key,fetched):
+        self._lock.acquire()
+        try:
+            self._db.execute('UPDATE detail SET accessed=?,fetched=? WHERE host=? AND eventid=? AND superseded=?',
+                             (time.time(),fetched)+key)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def _putEntry(self,key,text,etag,lastmodified):
+        updated = None
+        eventtime = None
+        try:
+            #only these two members are needed, so the rest of the document isn't decoded
+            properties = stream.extractPaths(text,[('properties','updated'),('properties','time')])['properties']
+            updated = properties['updated']
+            eventtime = properties['time']
+        except:
+            pass
+        data = sqlite3.Binary(zlib.compress(text,COMPRESSLEVEL))
+        now = time.time()
+        self._lock.acquire()
+        try:
+            row = self._db.execute('SELECT size FROM detail WHERE host=? AND eventid=? AND superseded=?',
+                                   key).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._db.execute('INSERT OR REPLACE INTO detail VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                             key+(updated,eventtime,etag,lastmodified,now,now,len(data),data))
+            self._size += len(data)
+            self._evict()
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        #remove least recently used entries until we're back under the size limit (caller holds the lock)
+        if self._size <= self.maxBytes:
+            return
+        cursor = self._db.execute('SELECT host,eventid,superseded,size FROM detail ORDER BY accessed ASC')
+        victims = []
+        for host,eventid,superseded,size in cursor:
+            if self._size <= self.maxBytes:
+                break
+            victims.append((host,eventid,superseded))
+            self._size -= size
+        self._db.executemany('DELETE FROM detail WHERE host=? AND eventid=? AND superseded=?',victims)
+        self._stats['evicted'] += len(victims)
+
+class Memo(object):
+    """
+    Time-limited memo of small JSON-serializable values (lists of valid catalogs, etc.), held in
+    memory and optionally also in files so that they survive from one process to the next.
+    """
+    def __init__(self,folder=None,ttl=MEMOTTL):
+        """
+        Create a Memo object.
+        @keyword folder: Directory where memoized values are written, or None to keep them only in memory.
+        @keyword ttl: Default number of seconds a memoized value stays valid.
+        """
+        if folder is not None and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._values = {} #name => (time stored,value)
+
+    def get(self,name,ttl=None):
+        """
+        Return a memoized value.
+        @param name: Name of the value.
+        @keyword ttl: Number of seconds the value stays valid (defaults to the Memo's ttl).
+        @return: The memoized value, or None if it is missing or has expired.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self._lock.acquire()
+        try:
+            entry = self._values.get(name)
+        finally:
+            self._lock.release()
+        if entry is None and self.folder is not None:
+            try:
+                f = open(self._getFile(name),'rt')
+                entry = tuple(json.load(f))
+                f.close()
+            except (IOError,ValueError):
+                entry = None
+            if entry is not None:
+                self._lock.acquire()
+                try:
+                    self._values[name] = entry
+                finally:
+                    self._lock.release()
+        if entry is None or time.time() - entry[0] >= ttl:
+            return None
+        return entry[1]
+
+    def put(self,name,value):
+        """
+        Memoize a value.
+        @param name: Name of the value.
+        @param value: JSON-serializable value.
+        """
+        entry = (time.time(),value)
+        self._lock.acquire()
+        try:
+            self._values[name] = entry
+        finally:
+            self._lock.release()
+        if self.folder is not None:
+            #write to a temporary file and rename, so that readers never see a partial file
+            fd,tmpfile = tempfile.mkstemp(dir=self.folder)
+            f = os.fdopen(fd,'wt')
+            json.dump(entry,f)
+            f.close()
+            os.rename(tmpfile,self._getFile(name))
+
+    def clear(self,name=None):
+        """
+        Forget one (or all) memoized values.
+        @keyword name: Name of the value to forget, or None to forget everything.
+        """
+        self._lock.acquire()
+        try:
+            if name is None:
+                names = self._values.keys()
+                self._values = {}
+            else:
+                names = [name]
+                self._values.pop(name,None)
+        finally:
+            self._lock.release()
+        if self.folder is not None:
+            if name is None:
+                names = [os.path.join(self.folder,fname) for fname in os.listdir(self.folder)]
+            else:
+                names = [self._getFile(name)]
+            for fname in names:
+                if os.path.isfile(fname):
+                    os.remove(fname)
+
+    def _getFile(self,name):
+        return os.path.join(self.folder,hashlib.md5(name).hexdigest()+'.json')
+
+DETAILCACHE = None
+MEMO = Memo()
+if os.environ.get(CACHEVAR):
+    DETAILCACHE = DetailCache(os.environ[CACHEVAR])
+    MEMO = Memo(folder=os.path.join(os.environ[CACHEVAR],MEMOFOLDER))
+
+def getDetailCache():
+    """
+    Return the detail cache shared by all of the functions in libcomcat.
+    @return: DetailCache object, or None if caching has not been turned on.
+    """
+    return DETAILCACHE
+
+def setDetailCache(detailcache):
+    """
+    Set (or, with None, turn off) the detail cache shared by all of the functions in libcomcat.
+
+    The cache can also be turned on by setting the COMCAT_CACHE_DIR environment variable to a directory.
+    @param detailcache: DetailCache object, or None.
+    """
+    global DETAILCACHE
+    DETAILCACHE = detailcache
+
+def getMemo():
+    """
+    Return the Memo shared by all of the functions in libcomcat.
+
+    Memoized values are kept only in memory, unless the COMCAT_CACHE_DIR environment variable is set.
+    @return: Memo object.
+    """
+    return MEMO
+
+def setMemo(memo):
+    """
+    Set the Memo shared by all of the functions in libcomcat.
+    @param memo: Memo object.
+    """
+    global MEMO
+    MEMO = memo
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+import tempfile
+import cPickle
+import calendar
+
+MANIFEST = 'manifest.json'
+SEGMENTFILE = 'segment%06i.pkl' #file holding the (pickled) results of one completed segment
+
+class Checkpoint(object):
+    """
+    Directory of completed time segments from a long, segmented search, so that an interrupted
+    search can be resumed without repeating the segments that were already finished.
+
+    The directory holds a manifest (JSON) describing the query and the list of time segments, and
+    recording which segments are complete, plus one file per completed segment holding its results.
+    Both are written to a temporary file and renamed, so a search killed at any point leaves the
+    checkpoint readable.
+    """
+    def __init__(self,folder):
+        """
+        Open a checkpoint directory (which need not exist yet).
+        @param folder: Checkpoint directory.
+        """
+        self.folder = folder
+        self.query = None
+        self.segments = []
+        self._completed = {} #segment index => (nevents,nmags)
+
+    def exists(self):
+        """
+        Return True if the checkpoint directory already contains a manifest.
+        """
+        return os.path.isfile(os.path.join(self.folder,MANIFEST))
+
+    def create(self,query,segments):
+        """
+        Start a new checkpoint, discarding any completed segments from a previous search.
+        @param query: JSON-serializable dictionary describing the search parameters.
+        @param segments: List of (start,end) datetime tuples, in time order.
+        """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        for fname in os.listdir(self.folder):
+            if fname.startswith('segment') and fname.endswith('.pkl'):
+                os.remove(os.path.join(self.folder,fname))
+        self.query = query
+        self.segments = list(segments)
+        self._completed = {}
+        self._writeManifest()
+
+    def load(self,query=None):
+        """
+        Read the manifest of an existing checkpoint.
+        @keyword query: Dictionary describing the search parameters of the search being resumed, or None.
+                        If given, it must match the query the checkpoint was created with.
+        @return: List of (start,end) segment tuples (as milliseconds since the epoch).
+        """
+        f = open(os.path.join(self.folder,MANIFEST),'rt')
+        manifest = json.load(f)
+        f.close()
+        if query is not None and json.loads(json.dumps(query)) != manifest['query']:
+            raise Exception,'Search parameters do not match those of the checkpoint in %s' % self.folder
+        self.query = manifest['query']
+        self.segments = [tuple(segment) for segment in manifest['segments']]
+        self._completed = {}
+        for idx,(nevents,nmags) in manifest['completed'].iteritems():
+            #a segment listed in the manifest without its file is treated as unfinished
+            if os.path.isfile(self._getFile(int(idx))):
+                self._completed[int(idx)] = (nevents,nmags)
+        return self.segments
+
+    def isComplete(self,idx):
+        """
+        Return True if the given segment has been completed.
+        @param idx: Segment index.
+        """
+        return idx in self._completed
+
+    def getPending(self):
+        """
+        Return the indices of the segments that have not been completed, in time order.
+        """
+        return [idx for idx in range(0,len(self.segments)) if idx not in self._completed]
+
+    def getMagnitudeCount(self):
+        """
+        Return the largest number of magnitude columns in any completed segment.
+        """
+        return max([0] + [nmags for nevents,nmags in self._completed.values()])
+
+    def save(self,idx,table):
+        """
+        Store the results of one segment and mark it as complete.
+        @param idx: Segment index.
+        @param table: Results of the segment (EventTable object).
+        """
+        fd,tmpfile = tempfile.mkstemp(dir=self.folder)
+        f = os.fdopen(fd,'wb')
+        cPickle.dump(table,f,cPickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(tmpfile,self._getFile(idx))
+        self._completed[idx] = (len(table),table.getMagnitudeCount())
+        self._writeManifest()
+
+    def iterTables(self):
+        """
+        Read back the results of the completed segments, in time order.
+
+        Events which also appear in the previous segment (adjacent segments share a boundary) are dropped.
+        @return: Generator of EventTable objects, one per completed segment.
+        """
+        lastids = set()
+        for idx in sorted(self._completed.keys()):
+            f = open(self._getFile(idx),'rb')
+            table = cPickle.load(f)
+            f.close()
+            if len(lastids) and len(table):
+                keep = [eid not in lastids for eid in table['id'].tolist()]
+                table = table[keep]
+            lastids = set(table['id'].tolist()) if len(table) else set()
+            yield table
+
+    def _getFile(self,idx):
+        return os.path.join(self.folder,SEGMENTFILE % idx)
+
+    def _writeManifest(self):
+        segments = []
+        for stime,etime in self.segments:
+            segments.append((getTimeStamp(stime),getTimeStamp(etime)))
+        self.segments = segments
+        completed = dict([(str(idx),value) for idx,value in self._completed.iteritems()])
+        manifest = {'query':self.query,'segments':segments,'completed':completed}
+        fd,tmpfile = tempfile.mkstemp(dir=self.folder)
+        f = os.fdopen(fd,'wt')
+        json.dump(manifest,f,indent=2)
+        f.close()
+        os.rename(tmpfile,os.path.join(self.folder,MANIFEST))
+
+def getTimeStamp(dtime):
+    """
+    Return a datetime as milliseconds since the epoch (values which are already numbers are returned unchanged).
+    @param dtime: datetime object (can be before 1900), or milliseconds since the epoch.
+    @return: Milliseconds since the epoch.
+    """
+    if isinstance(dtime,(int,long,float)):
+        return dtime
+    return calendar.timegm(dtime.timetuple())*1000 + dtime.microsecond//1000
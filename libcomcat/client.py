@@ -0,0 +1,842 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import asyncore
+import socket
+import ssl
+import select
+import sys
+import os.path
+import tempfile
+import time
+import heapq
+import json
+import zlib
+import urllib2
+import urlparse
+import mimetools
+from datetime import timedelta
+from collections import deque
+from StringIO import StringIO
+
+#local imports
+import session
+import comcat
+import stream
+import download
+
+MAXCONCURRENT = 16 #maximum number of requests in flight at once
+TIMEOUT = 60.0 #seconds a request may go without sending or receiving any data before it fails
+CHUNKSIZE = 64*1024 #number of bytes read from a socket at a time
+POLLSECS = 1.0 #longest time the event loop waits for socket activity before checking timers and timeouts
+
+class Future(object):
+    """
+    Result of a request (or chain of requests) made through an AsyncClient, which may not have arrived yet.
+
+    Calling result() runs the client's event loop until the result is available.  Callbacks added with
+    addCallback() or then() are called from the event loop as soon as the result arrives, so that a
+    follow-up request (the detail of an event found in a search, say) can be started without waiting
+    for any other request to finish.
+    """
+    def __init__(self,client):
+        """
+        Create a Future.
+        @param client: AsyncClient whose event loop will produce the result.
+        """
+        self.client = client
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        Return True if the result (or an error) is available.
+        """
+        return self._done
+
+    def result(self):
+        """
+        Return the result, running the client's event loop until it is available.
+        @return: Result of the request(s).
+        @raise Exception: The error the request(s) failed with, if any.
+        """
+        if not self._done:
+            self.client.run(self)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def addCallback(self,func):
+        """
+        Call a function (with this Future as its only argument) when the result is available.
+        @param func: Function taking a Future.
+        """
+        if self._done:
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def then(self,func):
+        """
+        Chain a function to the result.
+        @param func: Function taking the result, and returning either a value or another Future.
+        @return: Future of the function's return value (or of the result of the Future it returns).
+                 Errors, including those raised by func, are passed along to this Future.
+        """
+        future = Future(self.client)
+        def onDone(done):
+            if done._error is not None:
+                future.setError(done._error)
+                return
+            try:
+                value = func(done._result)
+            except Exception,error:
+                future.setError(error)
+                return
+            if isinstance(value,Future):
+                value.addCallback(future._copy)
+            else:
+                future.setResult(value)
+        self.addCallback(onDone)
+        return future
+
+    def setResult(self,value):
+        """
+        Make the result available, and call any callbacks.
+        @param value: Result.
+        """
+        self._finish(value,None)
+
+    def setError(self,error):
+        """
+        Fail with an error, and call any callbacks.
+        @param error: Exception object.
+        """
+        self._finish(None,error)
+
+    def _copy(self,other):
+        self._finish(other._result,other._error)
+
+    def _finish(self,value,error):
+        if self._done:
+            return
+        self._done = True
+        self._result = value
+        self._error = error
+        callbacks = self._callbacks
+        self._callbacks = []
+        for func in callbacks:
+            func(self)
+
+class _Request(object):
+    #one URL being fetched, possibly over several attempts and redirects
+    def __init__(self,url,outfile,headers,future):
+        self.url = url
+        self.outfile = outfile
+        self.headers = headers
+        self.future = future
+        self.attempt = 0
+        self.redirects = 0
+        self.channel = None
+
+class _Channel(asyncore.dispatcher):
+    """
+    Non-blocking HTTP/1.0 GET of one URL (a new connection, closed by the server after the response).
+
+    The response body is decompressed (if it was sent gzipped) as it arrives, and either kept in memory
+    or written to a temporary file in the output directory.
+    """
+    def __init__(self,client,request):
+        asyncore.dispatcher.__init__(self,map=client._map)
+        self.client = client
+        self.request = request
+        parts = urlparse.urlsplit(request.url)
+        scheme = parts.scheme.lower()
+        if scheme not in ['http','https']:
+            raise urllib2.URLError('Unsupported URL scheme "%s"' % parts.scheme)
+        port = parts.port
+        if port is None:
+            port = {'http':80,'https':443}[scheme]
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        reqheaders = {'Host':parts.hostname,'User-Agent':client.userAgent,'Connection':'close'}
+        if client.compress:
+            reqheaders['Accept-Encoding'] = 'gzip'
+        if request.headers is not None:
+            reqheaders.update(request.headers)
+        lines = ['GET %s HTTP/1.0' % path] + ['%s: %s' % item for item in reqheaders.items()]
+        self.host = parts.hostname
+        self.secure = scheme == 'https'
+        self.handshaking = False
+        self._wantWrite = False
+        self.lastActivity = time.time()
+        self.code = None
+        self.msg = None
+        self.headers = None
+        self.tmpfile = None
+        self._out = '\r\n'.join(lines) + '\r\n\r\n'
+        self._head = ''
+        self._body = []
+        self._file = None
+        self._decoder = None
+        self._received = 0
+        self._decoded = 0
+        self._length = None
+        self._finished = False
+        self.create_socket(socket.AF_INET,socket.SOCK_STREAM)
+        try:
+            self.connect((self.host,port))
+        except:
+            self.close()
+            raise
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        if self.handshaking:
+            return self._wantWrite
+        return not self.connected or len(self._out) > 0
+
+    def handle_connect(self):
+        self.lastActivity = time.time()
+        if self.secure:
+            if hasattr(ssl,'create_default_context'):
+                context = ssl.create_default_context()
+                self.socket = context.wrap_socket(self.socket,server_hostname=self.host,
+                                                  do_handshake_on_connect=False)
+            else:
+                self.socket = ssl.wrap_socket(self.socket,do_handshake_on_connect=False)
+            self.handshaking = True
+            self._handshake()
+
+    def handle_write(self):
+        self.lastActivity = time.time()
+        if self.handshaking:
+            self._handshake()
+            return
+        if len(self._out):
+            try:
+                sent = self.send(self._out)
+            except ssl.SSLError,error:
+                if error.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                    return
+                raise
+            self._out = self._out[sent:]
+
+    def handle_read(self):
+        self.lastActivity = time.time()
+        if self.handshaking:
+            self._handshake()
+            return
+        while not self._finished:
+            try:
+                data = self.recv(CHUNKSIZE)
+            except ssl.SSLError,error:
+                if error.args[0] == ssl.SSL_ERROR_WANT_READ:
+                    return
+                raise
+            if not data:
+                #recv() has already called handle_close()
+                return
+            self._feed(data)
+            #decrypted data may be waiting in the SSL buffer without the socket becoming readable again
+            if not self.secure or not self.socket.pending():
+                break
+
+    def handle_close(self):
+        self.close()
+        if self._finished:
+            return
+        self._finished = True
+        if self.code is None:
+            self.abort()
+            self.client._onError(self.request,urllib2.URLError('Connection closed before a response was received'))
+            return
+        if self._length is not None and self._received < self._length:
+            self.abort()
+            self.client._onError(self.request,urllib2.URLError('Connection closed after %i of %i bytes' % (self._received,self._length)))
+            return
+        if self._decoder is not None:
+            self._write(self._decoder.flush())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.client._onResponse(self.request,self,''.join(self._body))
+
+    def handle_error(self):
+        etype,error,tb = sys.exc_info()
+        self.close()
+        if self._finished:
+            return
+        self._finished = True
+        self.abort()
+        if not isinstance(error,urllib2.URLError):
+            error = urllib2.URLError(error)
+        self.client._onError(self.request,error)
+
+    def timeout(self):
+        """
+        Fail the request because it has gone too long without any activity.
+        """
+        self.close()
+        if self._finished:
+            return
+        self._finished = True
+        self.abort()
+        self.client._onError(self.request,urllib2.URLError(socket.timeout('timed out')))
+
+    def abort(self):
+        """
+        Remove the temporary output file, if there is one.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tmpfile is not None and os.path.isfile(self.tmpfile):
+            os.remove(self.tmpfile)
+        self.tmpfile = None
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError,error:
+            if error.args[0] in [ssl.SSL_ERROR_WANT_READ,ssl.SSL_ERROR_WANT_WRITE]:
+                self._wantWrite = error.args[0] == ssl.SSL_ERROR_WANT_WRITE
+                return
+            raise
+        self.handshaking = False
+
+    def _feed(self,data):
+        if self.code is None:
+            self._head += data
+            idx = self._head.find('\r\n\r\n')
+            if idx < 0:
+                return
+            data = self._head[idx+4:]
+            self._parseHead(self._head[:idx])
+        self._received += len(data)
+        if self._decoder is not None:
+            data = self._decoder.decompress(data)
+        self._write(data)
+        if self._length is not None and self._received >= self._length:
+            self.handle_close()
+
+    def _parseHead(self,head):
+        statusline,sep,rest = head.partition('\r\n')
+        parts = statusline.split(None,2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise urllib2.URLError('Bad status line "%s"' % statusline)
+        self.code = int(parts[1])
+        self.msg = parts[2] if len(parts) > 2 else ''
+        self.headers = mimetools.Message(StringIO(rest + '\r\n'))
+        if self.headers.getheader('Content-Length','').strip().isdigit():
+            self._length = int(self.headers.getheader('Content-Length').strip())
+        if self.headers.getheader('Content-Encoding','').lower() == 'gzip':
+            self._decoder = zlib.decompressobj(16+zlib.MAX_WBITS)
+        #only the body of a successful response is written to the output file
+        if self.request.outfile is not None and self.code < 300:
+            outfolder = os.path.dirname(os.path.abspath(self.request.outfile))
+            fd,self.tmpfile = tempfile.mkstemp(dir=outfolder,prefix='.download')
+            self._file = os.fdopen(fd,'wb')
+            os.chmod(self.tmpfile,download.FILEMODE)
+
+    def _write(self,data):
+        self._decoded += len(data)
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._body.append(data)
+
+class AsyncClient(object):
+    """
+    Single-threaded, non-blocking client for ComCat searches, event details and product contents.
+
+    Many requests are in flight at once, driven by one event loop (asyncore) rather than a thread per
+    request.  No more than maxConcurrent requests are active at a time - the rest wait in a queue - and
+    every request takes a token from the rate limiter shared with the blocking functions in libcomcat
+    (see session.getSession()).  Transient failures are retried with the same backoff (and Retry-After
+    handling) as the session, without blocking the other requests.
+
+    The get*() methods mirror the blocking functions of the same names in comcat, but return Future
+    objects.  Start as many as needed, then call result() on each (or run() to finish them all):
+
+    client = AsyncClient()
+    futures = [client.getEventData(starttime=stime,endtime=etime) for stime,etime in segments]
+    results = [future.result() for future in futures]
+
+    Event details are always fetched from the server (the detail cache, see cache.setDetailCache(), is not
+    consulted), and catalog and contributor names are not checked before searching.
+    """
+    def __init__(self,maxConcurrent=MAXCONCURRENT,timeout=TIMEOUT,connectTimeout=session.CONNECTTIMEOUT,userAgent=session.USERAGENT,compress=True,
+                 maxRetries=session.MAXRETRIES,backoff=session.BACKOFF,maxBackoff=session.MAXBACKOFF,limiter=None):
+        """
+        Create an AsyncClient.
+        @keyword maxConcurrent: Maximum number of requests in flight at once.
+        @keyword timeout: Seconds a request may go without sending or receiving any data before it fails.
+        @keyword connectTimeout: Seconds to wait for a connection to be established.
+        @keyword userAgent: User-Agent header sent with every request.
+        @keyword compress: Boolean indicating whether to ask servers for gzip-compressed responses.
+        @keyword maxRetries: Number of times a request that fails with a transient error is tried again.
+        @keyword backoff: Seconds to wait before the first retry (doubled for each retry after that, and randomized).
+        @keyword maxBackoff: Longest wait (seconds) between retries, unless the server asks for more with Retry-After.
+        @keyword limiter: session.RateLimiter shared with other clients (defaults to that of the shared session).
+        """
+        self.maxConcurrent = maxConcurrent
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.userAgent = userAgent
+        self.compress = compress
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        if limiter is None:
+            limiter = session.getSession().limiter
+        self.limiter = limiter
+        self._map = {} #socket map for this client's channels only
+        self._queue = deque()
+        self._active = 0 #requests holding one of the maxConcurrent slots
+        self._timers = [] #heap of (time,sequence,function)
+        self._sequence = 0
+        self._inflight = {} #key => Future of a request in flight, for coalescing duplicates
+        self._stats = {'requests':0,'retries':0,'redirects':0,'received':0,'decoded':0,
+                       'waited':0.0,'peak':0,'coalesced':0}
+
+    def fetch(self,url,outfile=None,headers=None):
+        """
+        Start an HTTP GET request, following redirects and retrying transient failures.
+        @param url: URL to fetch.
+        @keyword outfile: Path of a file to write the response body to (replaced if it already exists), or
+                          None to keep it in memory.  The file only appears once the whole body has arrived.
+        @keyword headers: Dictionary of extra request headers.
+        @return: Future of the response body (string), or of outfile.  The Future fails with
+                 urllib2.HTTPError or urllib2.URLError (after any retries).  A request for the same URL
+                 (and outfile) as one still in flight shares its response rather than making another.
+        """
+        key = ('fetch',session.getCanonicalURL(url),outfile,tuple(sorted((headers or {}).items())))
+        def start():
+            future = Future(self)
+            self._queue.append(_Request(url,outfile,headers,future))
+            return future
+        return self._coalesce(key,start)
+
+    def gather(self,futures):
+        """
+        Combine a list of Futures into one.
+        @param futures: Sequence of Future objects.
+        @return: Future of the list of their results, in the same order.  It fails with the first error
+                 any of them fails with.
+        """
+        futures = list(futures)
+        future = Future(self)
+        results = [None]*len(futures)
+        remaining = [len(futures)]
+        def getCallback(idx):
+            def onDone(done):
+                if done._error is not None:
+                    future.setError(done._error)
+                    return
+                results[idx] = done._result
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    future.setResult(results)
+            return onDone
+        if not len(futures):
+            future.setResult(results)
+        for idx,item in enumerate(futures):
+            item.addCallback(getCallback(idx))
+        return future
+
+    def run(self,future=None):
+        """
+        Run the event loop.
+        @keyword future: Future to wait for, or None to wait until every request has finished.
+        @return: future.
+        """
+        while True:
+            self._startQueued()
+            if future is not None and future.done():
+                return future
+            if not len(self._queue) and not len(self._map) and not len(self._timers) and not self._active:
+                if future is not None:
+                    raise Exception,'No requests left to complete the result being waited for'
+                return future
+            timeout = POLLSECS
+            if len(self._timers):
+                timeout = max(0.0,min(timeout,self._timers[0][0] - time.time()))
+            if len(self._map):
+                asyncore.loop(timeout=timeout,use_poll=hasattr(select,'poll'),map=self._map,count=1)
+            elif timeout > 0:
+                time.sleep(timeout)
+            self._runTimers()
+            self._checkTimeouts()
+
+    def stats(self):
+        """
+        Return a dictionary of client statistics.
+        @return: Dictionary with fields:
+                 - requests Number of HTTP requests made.
+                 - retries Number of requests tried again after a transient error.
+                 - redirects Number of redirects followed.
+                 - received Number of response body bytes read from the network.
+                 - decoded Number of response body bytes after decompression.
+                 - saved Number of bytes compression kept off the network (decoded - received).
+                 - waited Total seconds requests spent waiting for the rate limiter.
+                 - peak Largest number of requests in flight at once.
+                 - active Number of requests in flight now.
+                 - queued Number of requests waiting for one of the maxConcurrent slots.
+                 - coalesced Number of requests that shared the response to an identical request in flight.
+        """
+        stats = self._stats.copy()
+        stats['saved'] = stats['decoded'] - stats['received']
+        stats['active'] = self._active
+        stats['queued'] = len(self._queue)
+        return stats
+
+    def getJSON(self,url):
+        """
+        Fetch and parse a JSON document.
+        @param url: URL of the document.
+        @return: Future of the parsed document (shared with any concurrent request for the same URL, so it must
+                 not be modified).
+        """
+        key = ('json',session.getCanonicalURL(url))
+        return self._coalesce(key,lambda: self.fetch(url).then(json.loads))
+
+    def getEventDetail(self,eventid,url=None,superseded=False):
+        """
+        Fetch the GeoJSON detail document for an event (see comcat.getEventDetail()).
+        @param eventid: Event ID.
+        @keyword url: URL of the detail document (defaults to comcat.EVENTURL, or comcat.ALLPRODURL if superseded is True).
+        @keyword superseded: Boolean indicating whether the document should include superseded products.
+        @return: Future of the dictionary parsed from the event detail GeoJSON.
+        """
+        if url is None:
+            if superseded:
+                url = comcat.ALLPRODURL.replace('[EVENTID]',eventid)
+            else:
+                url = comcat.EVENTURL.replace('[EVENTID]',eventid)
+        return self.getJSON(url)
+
+    def getEventData(self,bounds=None,radius=None,starttime=None,endtime=None,magrange=None,depthrange=None,
+                     catalog=None,contributor=None,getComponents=False,getAngles=False,limitType=None,
+                     getAllMags=False,devServer=False):
+        """
+        Search for events, fetching their details as needed (see comcat.getEventData() for the keywords).
+        @return: Future of a tuple of (list of event OrderedDicts, maximum number of magnitudes found for any one event).
+        """
+        if bounds is not None and radius is not None:
+            raise Exception,'Cannot choose bounds search AND radius search.'
+        producttype = None
+        if getComponents and limitType is not None:
+            producttype = 'moment-tensor'
+        url = comcat.getEventSearchURL(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                       magrange=magrange,depthrange=depthrange,catalog=catalog,
+                                       contributor=contributor,devServer=devServer,producttype=producttype)
+        #one QuakeML search gets the magnitudes of every event (see comcat.iterEventFeatures())
+        if getAllMags:
+            magurl = comcat.getEventSearchURL(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                              magrange=magrange,depthrange=depthrange,catalog=catalog,
+                                              contributor=contributor,devServer=devServer,producttype=producttype,
+                                              searchFormat='quakeml',includeAllMags=True)
+            magnitudes = self.getMagnitudes(magurl)
+        else:
+            magnitudes = Future(self)
+            magnitudes.setResult(None)
+        def getEvent(feature,mdict):
+            eventmags = None
+            if getAllMags:
+                eventmags = comcat.findEventMagnitudes(feature,mdict)
+            if not comcat.needsEventDetail(feature,getComponents,getAngles,getAllMags and eventmags is None):
+                return comcat.getEventDict(feature,getComponents=getComponents,getAngles=getAngles,
+                                           getAllMags=getAllMags,limitType=limitType,magnitudes=eventmags)[0]
+            detail = self.getEventDetail(feature['id'],url=feature['properties']['detail'])
+            def getDict(edict,eventmags):
+                return comcat.getEventDict(feature,edict,getComponents=getComponents,getAngles=getAngles,
+                                           getAllMags=getAllMags,limitType=limitType,magnitudes=eventmags)[0]
+            def getDetailDict(edict):
+                if not getAllMags or eventmags is not None:
+                    return getDict(edict,eventmags)
+                #events missing from the QuakeML search have their magnitudes read from their origin products
+                origins = comcat.getMagnitudeProducts(edict)
+                return self.getAllMagnitudes(origins).then(lambda mags: getDict(edict,mags))
+            return detail.then(getDetailDict)
+        def getEvents(fdict):
+            def getAll(mdict):
+                futures = []
+                for feature in fdict['features']:
+                    future = Future(self)
+                    future.setResult(feature)
+                    futures.append(future.then(lambda feature: getEvent(feature,mdict)))
+                return self.gather(futures)
+            return magnitudes.then(getAll)
+        def getResult(eventlist):
+            eventlist = [eventdict for eventdict in eventlist if comcat.matchMomentType(eventdict,getComponents,limitType)]
+            maxmags = max([0] + [comcat.getMagnitudeCount(eventdict) for eventdict in eventlist])
+            return (eventlist,maxmags)
+        return self.getJSON(url).then(getEvents).then(getResult)
+
+    def getAllMagnitudes(self,origins):
+        """
+        Read every magnitude of an event from the QuakeML (or EQXML) files of its origin products.
+        @param origins: List of origin (or phase-data) product dictionaries (see comcat.getMagnitudeProducts()).
+        @return: Future of a tuple of (list of magnitudes,list of magnitude types,list of magnitude sources).
+                 Files which can't be fetched or parsed are skipped, as in comcat.getEventDict().
+        """
+        futures = []
+        for origin in origins:
+            if origin['contents'].has_key('quakeml.xml'):
+                url = origin['contents']['quakeml.xml']['url']
+                parse = comcat.parseQuakeMLData
+            elif origin['contents'].has_key('eqxml.xml'):
+                url = origin['contents']['eqxml.xml']['url']
+                parse = comcat.parseEQXMLData
+            else:
+                continue
+            futures.append(self._parseOrNone(self.fetch(url),parse))
+        def getResult(results):
+            mags = []
+            magtypes = []
+            magsources = []
+            for result in results:
+                if result is None:
+                    continue #something wasn't valid, so just move on to the next origin
+                mags += result[0]
+                magtypes += result[1]
+                magsources += result[2]
+            return (mags,magtypes,magsources)
+        return self.gather(futures).then(getResult)
+
+    def _parseOrNone(self,fetched,parse):
+        #Future of parse(body), or of None if the fetch or the parse fails
+        future = Future(self)
+        def onDone(done):
+            result = None
+            if done._error is None:
+                try:
+                    result = parse(done._result)
+                except Exception,msg:
+                    pass
+            future.setResult(result)
+        fetched.addCallback(onDone)
+        return future
+
+    def getMagnitudes(self,url):
+        """
+        Read the magnitudes of every event in a QuakeML search (see comcat.getSearchMagnitudes()).
+        @param url: URL of a QuakeML event search, with includeallmagnitudes set.
+        @return: Future of the dictionary of magnitudes keyed by event id.  If the search fails, the dictionary
+                 is empty (or holds what could be read), and never fails itself.
+        """
+        future = Future(self)
+        def onDone(done):
+            magnitudes = {}
+            if done._error is None:
+                try:
+                    for eventid,mags,magtypes,magsources in stream.MagnitudeReader(StringIO(done._result)):
+                        magnitudes[eventid] = (mags,magtypes,magsources)
+                except Exception,msg:
+                    pass #events we don't have magnitudes for are looked up one at a time instead
+            future.setResult(magnitudes)
+        self.fetch(url).addCallback(onDone)
+        return future
+
+    def getPhaseData(self,bounds=None,radius=None,starttime=None,endtime=None,magrange=None,
+                     catalog=None,contributor=None,eventid=None,verbose=False):
+        """
+        Fetch phase data for events (see comcat.getPhaseData() for the keywords and the data returned).
+        @return: Future of a list of fixed.PhaseML objects.  Events whose phase data cannot be read are
+                 left out (and reported on stderr if verbose is True).
+        """
+        if bounds is not None and radius is not None:
+            raise Exception,'Cannot choose bounds search AND radius search.'
+        def getPhase(eid):
+            future = self.getEventDetail(eid)
+            def getQuakeML(edict):
+                quakeurl = comcat.getPhaseURL(edict,eid)
+                return self.fetch(quakeurl).then(lambda data: comcat.parsePhaseData(data,quakeurl,eid))
+            phase = Future(self)
+            def onDone(done):
+                if done._error is not None:
+                    if verbose:
+                        sys.stderr.write('Could not retrieve data for eventid "%s" - error "%s"\n' % (eid,str(done._error)))
+                    phase.setResult(None)
+                else:
+                    phase.setResult(done._result)
+            future.then(getQuakeML).addCallback(onDone)
+            return phase
+        if eventid is not None:
+            return self.gather([getPhase(eventid)]).then(lambda phases: [p for p in phases if p is not None])
+        url = comcat.getProductSearchURL('phase-data',bounds=bounds,radius=radius,starttime=starttime,
+                                         endtime=endtime,magrange=magrange,catalog=catalog,contributor=contributor)
+        def getPhases(fdict):
+            futures = []
+            for feature in fdict['features']:
+                ptypes = feature['properties']['types'].strip(',').split(',')
+                if 'phase-data' in ptypes:
+                    futures.append(getPhase(feature['id']))
+            return self.gather(futures)
+        return self.getJSON(url).then(getPhases).then(lambda phases: [p for p in phases if p is not None])
+
+    def getContents(self,product,contentlist,outfolder=None,bounds=None,starttime=None,endtime=None,
+                    magrange=None,catalog=None,contributor=None,eventid=None,eventProperties=None,
+                    productProperties=None,radius=None,since=None):
+        """
+        Download product contents for event(s) (see comcat.getContents() for the keywords).
+        @return: Future of the list of output files.
+        """
+        if outfolder is None:
+            outfolder = os.getcwd()
+        if not os.path.isdir(outfolder):
+            os.makedirs(outfolder)
+        if bounds is not None and radius is not None:
+            raise Exception,"Choose one of bounds or radius, not both"
+        def getFiles(eid):
+            def download(edict):
+                jobs = comcat.getContentJobs(edict,product,contentlist,outfolder,eid,productProperties)
+                return self.gather([self.fetch(contenturl,outfile=outfile) for contenturl,outfile in jobs])
+            return self.getEventDetail(eid).then(download)
+        def getResult(filelists):
+            return [outfile for outfiles in filelists for outfile in outfiles]
+        if eventid is not None:
+            return self.gather([getFiles(eventid)]).then(getResult)
+        eventParams,eventProperties = comcat.planEventProperties(eventProperties)
+        url = comcat.getProductSearchURL(product,bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                         magrange=magrange,catalog=catalog,contributor=contributor,since=since,
+                                         eventParams=eventParams)
+        def getAllFiles(fdict):
+            return self.gather([getFiles(feature['id']) for feature in fdict['features']
+                                if comcat.matchEventProperties(feature,eventProperties)])
+        return self.getJSON(url).then(getAllFiles).then(getResult)
+
+    def associate(self,event,distancewindow=comcat.DISTWINDOW,timewindow=comcat.TIMEWINDOW,catalog=None):
+        """
+        Find possible matching events from ComCat for an input event (see comcat.associate()).
+        @return: Future of the list of origin dictionaries, closest first.
+        """
+        lat = event['lat']
+        lon = event['lon']
+        etime = event['time']
+        mintime = etime - timedelta(seconds=timewindow)
+        maxtime = etime + timedelta(seconds=timewindow)
+        future = self.getEventData(radius=(lat,lon,distancewindow),starttime=mintime,endtime=maxtime,catalog=catalog)
+        return future.then(lambda result: comcat.getOrigins(event,result[0],distancewindow=distancewindow,
+                                                            timewindow=timewindow))
+
+    def _coalesce(self,key,start):
+        #share the Future of an identical request in flight, or start a new one
+        if key in self._inflight:
+            self._stats['coalesced'] += 1
+            future = Future(self)
+            self._inflight[key].addCallback(future._copy)
+            return future
+        future = start()
+        if not future.done():
+            self._inflight[key] = future
+            future.addCallback(lambda done: self._inflight.pop(key,None))
+        return future
+
+    def _startQueued(self):
+        while len(self._queue) and self._active < self.maxConcurrent:
+            request = self._queue.popleft()
+            self._active += 1
+            self._stats['peak'] = max(self._stats['peak'],self._active)
+            wait = self.limiter.reserve()
+            if wait > 0:
+                self._stats['waited'] += wait
+                self._addTimer(wait,lambda request=request: self._connect(request))
+            else:
+                self._connect(request)
+
+    def _connect(self,request):
+        self._stats['requests'] += 1
+        try:
+            request.channel = _Channel(self,request)
+        except Exception,error:
+            if not isinstance(error,urllib2.URLError):
+                error = urllib2.URLError(error)
+            self._onError(request,error)
+
+    def _onResponse(self,request,channel,body):
+        request.channel = None
+        self._stats['received'] += channel._received
+        self._stats['decoded'] += channel._decoded
+        if channel.code in session.REDIRECTS:
+            location = channel.headers.getheader('Location')
+            if location is None:
+                self._fail(request,urllib2.HTTPError(request.url,channel.code,'Redirect with no location',channel.headers,None))
+            elif request.redirects >= session.MAXREDIRECTS:
+                self._fail(request,urllib2.HTTPError(request.url,channel.code,'Too many redirects',channel.headers,None))
+            else:
+                self._stats['redirects'] += 1
+                request.redirects += 1
+                request.url = urlparse.urljoin(request.url,location)
+                self._connect(request)
+            return
+        if channel.code >= 400:
+            error = urllib2.HTTPError(request.url,channel.code,channel.msg,channel.headers,StringIO(body))
+            if channel.code in session.RETRYCODES and request.attempt < self.maxRetries:
+                self._retry(request,channel.headers)
+            else:
+                self._fail(request,error)
+            return
+        if request.outfile is None:
+            self._release()
+            request.future.setResult(body)
+            return
+        try:
+            if os.path.isfile(request.outfile):
+                #os.rename() won't replace an existing file on Windows
+                os.remove(request.outfile)
+            os.rename(channel.tmpfile,request.outfile)
+        except Exception,error:
+            channel.abort()
+            self._fail(request,error)
+            return
+        self._release()
+        request.future.setResult(request.outfile)
+
+    def _onError(self,request,error):
+        request.channel = None
+        if request.attempt < self.maxRetries:
+            self._retry(request,None)
+        else:
+            self._fail(request,error)
+
+    def _retry(self,request,headers):
+        #give up the slot while waiting, and go to the front of the queue afterwards
+        delay = session.getRetryDelay(request.attempt,headers,backoff=self.backoff,maxBackoff=self.maxBackoff)
+        request.attempt += 1
+        self._stats['retries'] += 1
+        self._release()
+        self._addTimer(delay,lambda: self._queue.appendleft(request))
+
+    def _fail(self,request,error):
+        self._release()
+        request.future.setError(error)
+
+    def _release(self):
+        self._active -= 1
+
+    def _addTimer(self,delay,func):
+        self._sequence += 1
+        heapq.heappush(self._timers,(time.time() + delay,self._sequence,func))
+
+    def _runTimers(self):
+        now = time.time()
+        while len(self._timers) and self._timers[0][0] <= now:
+            when,sequence,func = heapq.heappop(self._timers)
+            func()
+
+    def _checkTimeouts(self):
+        now = time.time()
+        for channel in self._map.values():
+            if channel.connected:
+                timeout = self.timeout
+            else:
+                timeout = self.connectTimeout
+            if now - channel.lastActivity > timeout:
+                channel.timeout()
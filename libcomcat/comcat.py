@@ -12,12 +12,21 @@ import sys
 import shutil
 from collections import OrderedDict
 import calendar
+import math
 
 #third-party imports
 from neicmap import distance
 import fixed
 import numpy
 
+#local imports
+import pool
+import session
+import cache
+import stream
+import table
+import download
+
 DEVSERVER = 'dev-earthquake.cr' #comcat server name
 SERVER = 'earthquake' #comcat server name
 URLBASE = 'http://[SERVER].usgs.gov/fdsnws/event/1/query?%s'.replace('[SERVER]',SERVER)
@@ -32,6 +41,17 @@ KM2DEG = 1.0/111.191
 MTYPES = ['usmww','usmwb','usmwc','usmwr','gcmtmwc','cimwr','ncmwr']
 
 WEEKSECS = 86400*7
+SEGMENTWORKERS = 4 #number of time segments to search at the same time
+FILLRATIO = 0.5 #adaptive segments aim for this fraction of the maximum number of events ComCat allows in one search
+SEARCHLIMIT = 20000 #maximum number of events ComCat returns from one search
+MINSEGMENT = timedelta(seconds=1) #segments will not be split any smaller than this
+COUNTTTL = 7*86400 #seconds to remember event counts for time windows that are well in the past
+DETAILFLIGHTS = pool.SingleFlight() #coalesces concurrent requests for the same event detail document
+#event properties (from the search feed) that ComCat can filter on itself: property -> (search parameter,allowed values)
+EVENTPARAMS = {'alert':('alertlevel',['green','yellow','orange','red']),
+               'status':('reviewstatus',['automatic','reviewed']),
+               'type':('eventtype',None),
+               'minsig':('minsig',None)}
 
 TIMEWINDOW = 16
 DISTWINDOW = 100
@@ -89,28 +109,95 @@ def getUTCTimeStamp(timestamp):
     d = ShakeDateTime(d.year,d.month,d.day,d.hour,d.minute,d.second,d.microsecond)
     return d
 
-def getURLHandle(url):
+def getURLHandle(url,hedge=False):
+    """
+    Open a URL using the keep-alive connection pool shared by all of libcomcat (see session.getSession()).
+
+    Transient failures (including timeouts) are retried, with backoff, and requests are rate limited by the session.
+    @param url: URL to open.
+    @keyword hedge: Boolean indicating whether a duplicate request may be sent if this one is slow (see session.Session).
+    @return: File-like object - callers must close() it so that the connection can be re-used.
+    @raise Exception: When the URL could not be opened.
+    """
+    sess = session.getSession()
     try:
-        fh = urllib2.urlopen(url)
-    except:
+        fh = sess.get(url,hedge=hedge)
+    except urllib2.HTTPError,error:
+        #transient errors have already been retried by the session, but some servers refuse unknown user agents
+        if error.code in session.RETRYCODES:
+            raise Exception('Could not open url "%s"' % url)
         try:
-            req = urllib2.Request(url)
-            req.add_unredirected_header('User-Agent', 'Custom User-Agent')
-            fh = urllib2.urlopen(req)
+            fh = sess.get(url,headers={'User-Agent':'Custom User-Agent'},hedge=hedge)
         except:
             raise Exception('Could not open url "%s"' % url)
+    except:
+        raise Exception('Could not open url "%s"' % url)
     return fh
 
-def getAllVersions(eventid,productname,contentlist,folder=os.getcwd()):
-    url = ALLPRODURL.replace('[EVENTID]',eventid)
-    fh = getURLHandle(url)
-    data = fh.read()
-    fh.close()
-    jdict = json.loads(data)
+def getContentHandle(url):
+    """
+    Open the URL of a product content file, hedging the request if the session hedges slow requests.
+    @param url: URL to open.
+    @return: File-like object - callers must close() it so that the connection can be re-used.
+    @raise Exception: When the URL could not be opened.
+    """
+    return getURLHandle(url,hedge=True)
+
+def getEventDetail(eventid,url=None,updated=None,superseded=False,products=None):
+    """
+    Return the GeoJSON detail document for an event, from the detail cache when it is turned on (see cache.setDetailCache()).
+    @param eventid: Event ID.
+    @keyword url: URL of the detail document (defaults to EVENTURL, or ALLPRODURL if superseded is True).
+    @keyword updated: Update time (milliseconds) of the event as reported by a search feed, used to check whether a cached copy is current.
+    @keyword superseded: Boolean indicating whether the document should include superseded products.
+    @keyword products: Sequence of the product types (moment-tensor, origin, etc.) to read from the document, or None to
+                       read all of it.  The rest of the document is skipped over rather than decoded (see
+                       stream.extractPaths()), so the dictionary returned holds nothing but
+                       edict['properties']['products'][product] for each of these products the event has.
+    @return: Dictionary parsed from the event detail GeoJSON.  Concurrent requests for the same document (and products)
+             share one download and one dictionary (see DETAILFLIGHTS), so it must not be modified.
+    """
+    if url is None:
+        if superseded:
+            url = ALLPRODURL.replace('[EVENTID]',eventid)
+        else:
+            url = EVENTURL.replace('[EVENTID]',eventid)
+    key = session.getCanonicalURL(url)
+    if products is not None:
+        products = sorted(set(products))
+        key = (key,tuple(products))
+    #several threads (or code paths) often want the same detail at once - they share one request and parse
+    return DETAILFLIGHTS.do(key,__readEventDetail,eventid,url,updated,superseded,products)
+
+def __readEventDetail(eventid,url,updated,superseded,products):
+    detailcache = cache.getDetailCache()
+    if detailcache is not None:
+        data = detailcache.getDetail(eventid,url,updated=updated,superseded=superseded)
+    else:
+        fh = getURLHandle(url,hedge=True)
+        data = fh.read()
+        fh.close()
+    if products is None:
+        return json.loads(data)
+    return stream.extractPaths(data,[('properties','products',product) for product in products])
+
+def getAllVersions(eventid,productname,contentlist,folder=os.getcwd(),downloader=None):
+    """
+    Download contents for every version of a product for a given event.
+    @param eventid: Event ID.
+    @param productname: Name of desired product (i.e., shakemap).
+    @param contentlist: List of desired content file names.
+    @keyword folder: Local directory where output files should be written.
+    @keyword downloader: download.Downloader object used to fetch the files (a new one is created by default).
+    @return: List of downloaded files.
+    """
+    if downloader is None:
+        downloader = download.Downloader(getHandle=getContentHandle)
+    jdict = getEventDetail(eventid,superseded=True)
     if not jdict['properties']['products'].has_key(productname):
         raise Exception,"No %s product found for event %s" % (productname,eventid)
     products = jdict['properties']['products'][productname]
-    outfiles = []
+    jobs = []
     if not os.path.isdir(folder):
         os.makedirs(folder)
     for product in products:
@@ -127,16 +214,10 @@ def getAllVersions(eventid,productname,contentlist,folder=os.getcwd()):
             for content in contentlist:
                 if contentfile.lower() == content.lower():
                     contenturl = product['contents'][pkey]['url']
-                    fh = getURLHandle(contenturl)
-                    data = fh.read()
                     outfile = os.path.join(folder,'%s_%s_%i%s' % (eventid,contentbase,ptime,contentext))
-                    outfiles.append(outfile)
-                    f = open(outfile,'wb')
-                    f.write(data)
-                    f.close()
-                    fh.close()
+                    jobs.append((contenturl,outfile))
                 
-    return outfiles
+    return list(downloader.downloadAll(jobs))
 
 def getTimeSegments2(starttime,endtime):
     #startsecs = int(starttime.strftime('%s'))
@@ -155,6 +236,135 @@ def getTimeSegments2(starttime,endtime):
 
     return segments
 
+def getSegmentedEventData(segments,maxSegments=SEGMENTWORKERS,**kwargs):
+    """
+    Run getEventData() for a list of time segments, several segments at a time.
+
+    Results are yielded in segment order.  Because adjacent segments may share a boundary (or, see 
+    getTimeSegments2(), overlap slightly), any event already returned for the previous segment is dropped 
+    from the next one.  A segment containing more events than ComCat will return from one search is 
+    split in half and searched again.
+    @param segments: List of (start,end) ShakeDateTime tuples, in time order.
+    @keyword maxSegments: Maximum number of segments to search concurrently.
+    @keyword kwargs: Any other keywords accepted by getEventData() (except starttime and endtime).
+    @return: Generator of (eventlist,maxmags) tuples, one per segment, as returned by getEventData().
+    """
+    def getSegment(segment):
+        stime,etime = segment
+        return __getSegmentData(stime,etime,kwargs)
+    lastids = set()
+    for eventlist,maxmags in pool.mapOrdered(getSegment,segments,maxWorkers=maxSegments):
+        eventlist = [event for event in eventlist if event['id'][0] not in lastids]
+        lastids = set([event['id'][0] for event in eventlist])
+        yield (eventlist,maxmags)
+
+def __getSegmentData(stime,etime,kwargs):
+    countkeys = ['bounds','radius','magrange','depthrange','catalog','contributor','devServer']
+    countargs = dict([(key,kwargs[key]) for key in countkeys if key in kwargs])
+    eventlist = None
+    try:
+        eventlist,maxmags = getEventData(starttime=stime,endtime=etime,**kwargs)
+        truncated = len(eventlist) >= SEARCHLIMIT
+    except:
+        #ComCat refuses searches that would return too many events - check whether that's what happened
+        exc_info = sys.exc_info()
+        nevents,maxevents = getEventCount(starttime=stime,endtime=etime,**countargs)
+        if nevents < maxevents:
+            raise exc_info[0],exc_info[1],exc_info[2]
+        truncated = True
+    if not truncated:
+        return (eventlist,maxmags)
+    if etime - stime <= MINSEGMENT:
+        if eventlist is None:
+            raise Exception('Too many events between %s and %s, and the segment cannot be split further.' % (stime,etime))
+        sys.stderr.write('Warning: Search between %s and %s may be incomplete.\n' % (stime,etime))
+        return (eventlist,maxmags)
+    #split in half and try again
+    eventlist = []
+    maxmags = 0
+    for tstime,tetime in __splitSegment(stime,etime,2):
+        teventlist,tmaxmags = __getSegmentData(tstime,tetime,kwargs)
+        ids = set([event['id'][0] for event in eventlist])
+        eventlist += [event for event in teventlist if event['id'][0] not in ids]
+        maxmags = max(maxmags,tmaxmags)
+    return (eventlist,maxmags)
+
+def __splitSegment(stime,etime,nsegments):
+    step = (etime - stime)/nsegments
+    times = [stime]
+    for i in range(1,nsegments):
+        t = stime + step*i
+        #adding a timedelta returns a datetime object, not a ShakeDateTime object.
+        times.append(ShakeDateTime(t.year,t.month,t.day,t.hour,t.minute,t.second,t.microsecond))
+    times.append(etime)
+    return zip(times[0:-1],times[1:])
+
+def __getSegmentCount(stime,etime,bounds,radius,magrange,depthrange,catalog,contributor,devServer):
+    #counts for windows that ended long ago are not going to change much, so remember those
+    memo = cache.getMemo()
+    age = ShakeDateTime.utcnow() - etime
+    ispast = age.days*86400 + age.seconds > cache.YOUNGAGE
+    key = 'count:' + repr((stime.strftime(TIMEFMT+'.%f'),etime.strftime(TIMEFMT+'.%f'),bounds,radius,
+                           magrange,depthrange,catalog,contributor,devServer))
+    if ispast:
+        counts = memo.get(key,ttl=COUNTTTL)
+        if counts is not None:
+            return tuple(counts)
+    counts = getEventCount(bounds=bounds,radius=radius,starttime=stime,endtime=etime,magrange=magrange,
+                           depthrange=depthrange,catalog=catalog,contributor=contributor,devServer=devServer)
+    if ispast:
+        memo.put(key,counts)
+    return counts
+
+def getAdaptiveTimeSegments(starttime,endtime,bounds=None,radius=None,magrange=None,depthrange=None,
+                            catalog=None,contributor=None,devServer=False,
+                            fillRatio=FILLRATIO,maxWorkers=SEGMENTWORKERS):
+    """
+    Return a list of ShakeDateTime (start,end) tuples sized to the density of events matching a search.
+
+    Event counts are requested for several windows at a time, and any window holding more than
+    fillRatio times the maximum number of events ComCat allows in one search is split, in proportion to
+    its count, until every window fits.  Adjacent sparse windows are then merged back together, so that
+    dense periods get short segments and sparse ones get long segments.  Counts for windows that ended
+    more than a month ago are memoized (see cache.getMemo()).
+    @param starttime: ShakeDateTime of desired start time for search.
+    @param endtime: ShakeDateTime of desired end time for search.
+    @keyword bounds: (lonmin,lonmax,latmin,latmax) Bounding box of search. (dd)
+    @keyword radius: (centerlat,centerlon,maxradius) Radius search parameters (dd,dd,km,km)
+    @keyword magrange: (magmin,magmax) Magnitude range.
+    @keyword depthrange: (depthmin,depthmax) Depth range.
+    @keyword catalog: Name of contributing catalog (see checkCatalogs()).
+    @keyword contributor: Name of contributing catalog (see checkContributors()).
+    @keyword devServer: Use the USGS-internal development ComCat server (will fail for users outside USGS network.)
+    @keyword fillRatio: Target fraction (0-1) of the maximum number of events ComCat allows in one search.
+    @keyword maxWorkers: Maximum number of event counts to request concurrently.
+    @return: List of contiguous ShakeDateTime (start,end) tuples, in time order.
+    """
+    def getCount(segment):
+        stime,etime = segment
+        return __getSegmentCount(stime,etime,bounds,radius,magrange,depthrange,catalog,contributor,devServer)
+    pending = [(starttime,endtime)]
+    accepted = []
+    while len(pending):
+        counts = pool.mapOrdered(getCount,pending,maxWorkers=maxWorkers)
+        newpending = []
+        for (stime,etime),(nevents,maxevents) in zip(pending,counts):
+            target = max(int(maxevents*fillRatio),1)
+            if nevents <= target or etime - stime <= MINSEGMENT:
+                accepted.append((stime,etime,nevents,target))
+                continue
+            nsegments = int(math.ceil(float(nevents)/target))
+            newpending += __splitSegment(stime,etime,nsegments)
+        pending = newpending
+    accepted.sort()
+    segments = []
+    for stime,etime,nevents,target in accepted:
+        if len(segments) and segments[-1][2] + nevents <= target:
+            segments[-1] = (segments[-1][0],etime,segments[-1][2] + nevents)
+        else:
+            segments.append((stime,etime,nevents))
+    return [(stime,etime) for stime,etime,nevents in segments]
+
 def getTimeSegments(segments,bounds,radius,starttime,endtime,magrange,catalog,contributor):
     """
     Return a list of ShakeDateTime (start,end) tuples which will result in searches less than 20,000 events.
@@ -235,15 +445,30 @@ def associate(event,distancewindow=DISTWINDOW,timewindow=TIMEWINDOW,catalog=None
     mintime = etime - timedelta(seconds=timewindow)
     maxtime = etime + timedelta(seconds=timewindow)
 
-    eventlist = getEventData(radius=(lat,lon,distancewindow),starttime=mintime,endtime=maxtime,catalog=catalog)
+    eventlist,maxmags = getEventData(radius=(lat,lon,distancewindow),starttime=mintime,endtime=maxtime,catalog=catalog)
+    return getOrigins(event,eventlist,distancewindow=distancewindow,timewindow=timewindow)
+
+def getOrigins(event,eventlist,distancewindow=DISTWINDOW,timewindow=TIMEWINDOW):
+    """
+    Rank a list of candidate events by their closeness to an input event (see associate()).
+    @param event: Dictionary containing fields ['lat','lon','time']
+    @param eventlist: List of event dictionaries (of [value,fmt] lists) as returned by getEventData().
+    @keyword distancewindow: Search distance in km.
+    @keyword timewindow: Time search delta in seconds.
+    @return: List of origin dictionaries (see associate()), closest first.
+    """
+    lat = event['lat']
+    lon = event['lon']
+    etime = event['time']
     origins = []
     for e in eventlist:
-        euclid,ddist,tdist = __getEuclidean(lat,lon,etime,e['lat'],e['lon'],e['time'],
+        origin = dict([(key,value[0]) for key,value in e.iteritems()])
+        euclid,ddist,tdist = __getEuclidean(lat,lon,etime,origin['lat'],origin['lon'],origin['time'],
                                                    dwindow=distancewindow,twindow=timewindow)
-        e['euclidean'] = euclid
-        e['timedelta'] = tdist
-        e['distance'] = ddist
-        origins.append(e.copy())
+        origin['euclidean'] = euclid
+        origin['timedelta'] = tdist
+        origin['distance'] = ddist
+        origins.append(origin)
 
     origins = sorted(origins,key=lambda origin: origin['euclidean'])
     return origins
@@ -252,6 +477,14 @@ def parseEQXML(equrl):
     fh = getURLHandle(equrl)
     data = fh.read()
     fh.close()
+    return parseEQXMLData(data)
+
+def parseEQXMLData(data):
+    """
+    Read the magnitude of an event from an EQXML document.
+    @param data: String containing the EQXML document.
+    @return: Tuple of ([magnitude],[magnitude type],[magnitude source]).
+    """
     root = minidom.parseString(data)
     magel = root.getElementsByTagName('Event')[0].getElementsByTagName('Origin')[0].getElementsByTagName('Magnitude')[0]
     magval = float(magel.getElementsByTagName('Value')[0].firstChild.data)
@@ -261,12 +494,20 @@ def parseEQXML(equrl):
     return ([magval],[magtype],[magsrc])
 
 def parseQuakeML(quakeurl):
-    mags = []
-    magtypes = []
-    magsources = []
     fh = getURLHandle(quakeurl)
     data = fh.read()
     fh.close()
+    return parseQuakeMLData(data)
+
+def parseQuakeMLData(data):
+    """
+    Read the magnitudes of the first event in a QuakeML document.
+    @param data: String containing the QuakeML document.
+    @return: Tuple of (list of magnitudes,list of magnitude types,list of magnitude sources).
+    """
+    mags = []
+    magtypes = []
+    magsources = []
     root = minidom.parseString(data)
     event = root.getElementsByTagName('event')[0]
     magels = event.getElementsByTagName('magnitude')
@@ -308,6 +549,16 @@ def __getAllMagnitudes(origins):
         
     return (mags,magtypes,magsources)
 
+def getMagnitudeProducts(edict):
+    """
+    Return the products of an event whose QuakeML (or EQXML) files list its magnitudes.
+    @param edict: Event detail dictionary (see getEventDetail()).
+    @return: List of phase-data products if the event has any, otherwise of origin products.
+    """
+    if edict['properties']['products'].has_key('phase-data'):
+        return edict['properties']['products']['phase-data']
+    return edict['properties']['products']['origin']
+
 def __getMomentComponents(edict,momentType):
     mrr = float('nan')
     mtt = float('nan')
@@ -419,53 +670,52 @@ def __getMomentType(tensor):
     return mtype
         
 
-def checkCatalogs():
+def checkCatalogs(refresh=False):
     """
     Return the list of valid ComCat catalogs.
+
+    The list is memoized (see cache.getMemo()), so ComCat is only asked for it again once the memo expires.
+    @keyword refresh: Boolean indicating whether to ignore any memoized list and ask ComCat again.
     @return: List of valid ComCat catalog strings.
     """
-    url = CHECKBASE % 'catalogs'
-    catalogs = []
-    try:
-        fh = getURLHandle(url)
-        #fh = urllib2.urlopen(url)
-        data = fh.read()
-        dom = minidom.parseString(data)
-        fh.close()
-        catalog_elements = dom.getElementsByTagName('Catalog')
-        for catel in catalog_elements:
-            if catel.firstChild is None:
-                continue
-            catalog = catel.firstChild.data.strip()
-            if len(catalog):
-                catalogs.append(str(catalog))
-    except:
-        raise Exception,"Could not open %s to search for list of catalogs" % url
-    return catalogs    
+    return __getCheckList('catalogs','Catalog',refresh)
 
-def checkContributors():
+def checkContributors(refresh=False):
     """
     Return the list of valid ComCat contributors.
+
+    The list is memoized (see cache.getMemo()), so ComCat is only asked for it again once the memo expires.
+    @keyword refresh: Boolean indicating whether to ignore any memoized list and ask ComCat again.
     @return: List of valid ComCat contributor strings.
     """
-    url = CHECKBASE % 'contributors'
-    contributors = []
+    return __getCheckList('contributors','Contributor',refresh)
+
+def __getCheckList(listname,tagname,refresh):
+    memo = cache.getMemo()
+    if not refresh:
+        values = memo.get(listname)
+        if values is not None:
+            return [str(value) for value in values]
+    url = CHECKBASE % listname
+    values = []
     try:
         fh = getURLHandle(url)
         #fh = urllib2.urlopen(url)
         data = fh.read()
         dom = minidom.parseString(data)
         fh.close()
-        contributor_elements = dom.getElementsByTagName('Contributor')
-        for catel in contributor_elements:
-            if catel.firstChild is None:
+        elements = dom.getElementsByTagName(tagname)
+        for element in elements:
+            if element.firstChild is None:
                 continue
-            contributor = catel.firstChild.data.strip()
-            if len(contributor):
-                contributors.append(str(contributor))
+            value = element.firstChild.data.strip()
+            if len(value):
+                values.append(str(value))
+        dom.unlink()
     except:
-        raise Exception,"Could not open %s to search for list of contributors" % url
-    return contributors    
+        raise Exception,"Could not open %s to search for list of %s" % (url,listname)
+    memo.put(listname,values)
+    return values
 
 def getEventParams(bounds,radius,starttime,endtime,magrange,depthrange,
                    catalog,contributor):
@@ -518,7 +768,23 @@ def getEventParams(bounds,radius,starttime,endtime,magrange,depthrange,
     return urlparams
 
 def getEventCount(bounds = None,radius=None,starttime = None,endtime = None,magrange = None,
-                 catalog = None,contributor = None,devServer=False):
+                 catalog = None,contributor = None,devServer=False,depthrange=None,updatedafter=None,
+                 includeDeleted=False):
+    """
+    Return the number of events matching search parameters, and the maximum number ComCat will return from one search.
+    @keyword bounds: (lonmin,lonmax,latmin,latmax) Bounding box of search. (dd)
+    @keyword radius: (centerlat,centerlon,maxradius) Radius search parameters (dd,dd,km,km)
+    @keyword starttime: Start time of search (ShakeDateTime)
+    @keyword endtime: End  time of search (ShakeDateTime)
+    @keyword magrange: (magmin,magmax) Magnitude range.
+    @keyword catalog: Name of contributing catalog (see checkCatalogs()).
+    @keyword contributor: Name of contributing catalog (see checkContributors()).
+    @keyword devServer: Use the USGS-internal development ComCat server (will fail for users outside USGS network.)
+    @keyword depthrange: (depthmin,depthmax) Depth range.
+    @keyword updatedafter: Only count events updated after this time (datetime), or None.
+    @keyword includeDeleted: Boolean indicating whether to count events which have been deleted.
+    @return: Tuple of (number of matching events, maximum number of events allowed in one search).
+    """
     if catalog is not None and catalog not in checkCatalogs():
         raise Exception,'Unknown catalog %s' % catalog
     if contributor is not None and contributor not in checkContributors():
@@ -528,8 +794,12 @@ def getEventCount(bounds = None,radius=None,starttime = None,endtime = None,magr
     if bounds is not None and radius is not None:
         raise Exception,'Cannot choose bounds search AND radius search.'
 
-    urlparams = getEventParams(bounds,radius,starttime,endtime,magrange,
+    urlparams = getEventParams(bounds,radius,starttime,endtime,magrange,depthrange,
                                catalog,contributor)
+    if updatedafter is not None:
+        urlparams['updatedafter'] = updatedafter.strftime(TIMEFMT) + '.%03i' % (updatedafter.microsecond//1000)
+    if includeDeleted:
+        urlparams['includedeleted'] = 'true'
     urlparams['format'] = 'geojson'
     params = urllib.urlencode(urlparams)
     if devServer:
@@ -550,7 +820,7 @@ def getEventCount(bounds = None,radius=None,starttime = None,endtime = None,magr
 def getEventData(bounds = None,radius=None,starttime = None,endtime = None,magrange = None,depthrange=None,
                  catalog = None,contributor = None,getComponents=False,
                  getAngles=False,verbose=False,limitType=None,getAllMags=False,
-                 devServer=False):
+                 devServer=False,maxWorkers=None):
     """Download a list of event dictionaries that could be represented in csv or tab separated format.
 
     The data will include, but not be limited to:
@@ -588,8 +858,111 @@ def getEventData(bounds = None,radius=None,starttime = None,endtime = None,magra
     @keyword getComponents: Boolean indicating whether to retrieve moment tensor components, type, and derived hypocenter (if available).
     @keyword getAngles: Boolean indicating whether to retrieve nodal plane angles (if available).
     @keyword verbose: Boolean indicating whether to print message to stderr for every event being retrieved. 
-    @keyword limitType: Limit moment tensor retrieved to those of a particular source/type (comcat.MTYPES)
+    @keyword getAllMags: Boolean indicating whether to retrieve every magnitude of each event.  These are read from
+                         one QuakeML search covering all of the events, and only events missing from it have their
+                         magnitudes read from their own origin products.
+    @keyword limitType: Limit moment tensor retrieved to those of a particular source/type (comcat.MTYPES).  With
+                        getComponents, only events with a moment tensor of this type are returned (and only
+                        events with a moment tensor are searched for).
     @keyword devServer: Use the USGS-internal development ComCat server (will fail for users outside USGS network.)
+    @keyword maxWorkers: Maximum number of event detail documents to fetch and parse concurrently 
+             (only used with getComponents, getAngles or getAllMags).  Events are returned in time-ascending order regardless.
+             By default (None) the number adapts to how well the server is keeping up (see session.Session).
+    @return: Tuple of (list of event OrderedDicts, maximum number of magnitudes found for any one event).  
+             The values of each event OrderedDict are [value,fmt] lists.
+    """
+    eventlist = []
+    maxmags = 0
+    for eventdict in iterEventData(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                   magrange=magrange,depthrange=depthrange,catalog=catalog,
+                                   contributor=contributor,getComponents=getComponents,getAngles=getAngles,
+                                   verbose=verbose,limitType=limitType,getAllMags=getAllMags,
+                                   devServer=devServer,maxWorkers=maxWorkers):
+        nmags = getMagnitudeCount(eventdict)
+        if nmags > maxmags:
+            maxmags = nmags
+        eventlist.append(eventdict)
+    return (eventlist,maxmags)
+
+def getEventTable(bounds = None,radius=None,starttime = None,endtime = None,magrange = None,depthrange=None,
+                  catalog = None,contributor = None,getComponents=False,
+                  getAngles=False,verbose=False,limitType=None,getAllMags=False,
+                  devServer=False,maxWorkers=None):
+    """Download event data into a columnar table.
+
+    This returns the same data as getEventData() (see that function for a description of the data
+    returned and of the keywords), but as a table.EventTable, which holds each field in a numpy array
+    and takes far less memory per event than a list of dictionaries.
+    @return: table.EventTable object.
+    """
+    events = iterEventData(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                           magrange=magrange,depthrange=depthrange,catalog=catalog,
+                           contributor=contributor,getComponents=getComponents,getAngles=getAngles,
+                           verbose=verbose,limitType=limitType,getAllMags=getAllMags,
+                           devServer=devServer,maxWorkers=maxWorkers)
+    return table.EventTable.fromEvents(events)
+
+def getMagnitudeCount(eventdict):
+    """
+    Return the number of magnitudes (mag1, mag2, etc.) in an event dictionary retrieved with getAllMags.
+    @param eventdict: Event OrderedDict (see getEventData()).
+    @return: Number of magnitudes.
+    """
+    nmags = 0
+    while eventdict.has_key('mag%i' % (nmags+1)):
+        nmags += 1
+    return nmags
+
+def iterEventData(bounds = None,radius=None,starttime = None,endtime = None,magrange = None,depthrange=None,
+                  catalog = None,contributor = None,getComponents=False,
+                  getAngles=False,verbose=False,limitType=None,getAllMags=False,
+                  devServer=False,maxWorkers=None):
+    """Generate event dictionaries one at a time, as they are downloaded.
+
+    This is the generator version of getEventData() (see that function for a description of the
+    data returned and of the keywords), which holds only a few events in memory at once.
+    @return: Generator of event OrderedDicts, in time-ascending order.  The values of each OrderedDict are [value,fmt] lists.
+    """
+    #only events with a moment tensor can match limitType, so only those are searched for
+    producttype = None
+    if getComponents and limitType is not None:
+        producttype = 'moment-tensor'
+    features = iterEventFeatures(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                 magrange=magrange,depthrange=depthrange,catalog=catalog,
+                                 contributor=contributor,getComponents=getComponents,getAngles=getAngles,
+                                 verbose=verbose,limitType=limitType,getAllMags=getAllMags,
+                                 devServer=devServer,maxWorkers=maxWorkers,producttype=producttype)
+    for feature,eventdict in features:
+        if matchMomentType(eventdict,getComponents,limitType):
+            yield eventdict
+
+def matchMomentType(eventdict,getComponents,limitType):
+    """
+    Check whether an event dictionary has the moment tensor type asked for.
+    @param eventdict: Event OrderedDict (of [value,fmt] lists), as returned by getEventData().
+    @param getComponents: Boolean indicating whether moment tensor components were retrieved.
+    @param limitType: Moment tensor source/type wanted (comcat.MTYPES), or None.
+    @return: True if the event's moment tensor type is limitType, or if no particular type was asked for.
+    """
+    if not getComponents or limitType is None:
+        return True
+    return eventdict['type'][0].lower() == limitType.lower()
+
+def iterEventFeatures(bounds = None,radius=None,starttime = None,endtime = None,magrange = None,depthrange=None,
+                      catalog = None,contributor = None,getComponents=False,
+                      getAngles=False,verbose=False,limitType=None,getAllMags=False,
+                      devServer=False,maxWorkers=None,updatedafter=None,includeDeleted=False,producttype=None):
+    """Generate the GeoJSON feature for each event in a search, along with its event dictionary.
+
+    This is the same as iterEventData() (see getEventData() for a description of the data returned and of
+    the keywords), except that the search feed feature (with the event's list of ids, update time, status, etc.)
+    is returned along with each event dictionary.
+    @keyword updatedafter: Only return events updated after this time (datetime), or None.
+    @keyword includeDeleted: Boolean indicating whether to include events which have been deleted.  Deleted
+                             events have a status property of "deleted", and no event dictionary.
+    @keyword producttype: Only return events having a product of this type (moment-tensor, say), or None.
+    @return: Generator of (feature,eventdict) tuples, in time-ascending order.  eventdict is None for deleted events.
+             Unlike iterEventData(), events whose moment tensor does not match limitType are not left out.
     """
     if catalog is not None and catalog not in checkCatalogs():
         raise Exception,'Unknown catalog %s' % catalog
@@ -600,131 +973,290 @@ def getEventData(bounds = None,radius=None,starttime = None,endtime = None,magra
     if bounds is not None and radius is not None:
         raise Exception,'Cannot choose bounds search AND radius search.'
     
+    url = getEventSearchURL(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                            magrange=magrange,depthrange=depthrange,catalog=catalog,contributor=contributor,
+                            devServer=devServer,updatedafter=updatedafter,includeDeleted=includeDeleted,
+                            producttype=producttype)
+    #one QuakeML search gets the magnitudes of every event, instead of one or more documents per event
+    magnitudes = None
+    if getAllMags:
+        magurl = getEventSearchURL(bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                                   magrange=magrange,depthrange=depthrange,catalog=catalog,contributor=contributor,
+                                   devServer=devServer,updatedafter=updatedafter,producttype=producttype,
+                                   searchFormat='quakeml',includeAllMags=True)
+        magnitudes = getSearchMagnitudes(magurl)
+    fh = getURLHandle(url)
+    #fh = urllib2.urlopen(url)
+    #features are parsed one at a time as the feed downloads
+    features = stream.FeatureReader(fh)
+    def getDetails(feature):
+        if feature['properties'].get('status') == 'deleted':
+            return (feature,None)
+        eventdict,nmags = __getEventDetails(feature,getComponents,getAngles,getAllMags,limitType,verbose,magnitudes)
+        return (feature,eventdict)
+    try:
+        nworkers,controller = __getWorkers(maxWorkers)
+        for feature,eventdict in pool.mapOrdered(getDetails,features,maxWorkers=nworkers,controller=controller):
+            yield (feature,eventdict)
+    finally:
+        fh.close()
+
+def __getWorkers(maxWorkers):
+    #no fixed number of workers means the number adapts to how the server is coping (see session.Session)
+    if maxWorkers is None:
+        controller = session.getSession().controller
+        return (controller.maxLimit,controller)
+    return (maxWorkers,None)
+
+def getEventSearchURL(bounds=None,radius=None,starttime=None,endtime=None,magrange=None,depthrange=None,
+                      catalog=None,contributor=None,devServer=False,updatedafter=None,includeDeleted=False,
+                      producttype=None,searchFormat='geojson',includeAllMags=False):
+    """
+    Return the URL of the GeoJSON search feed for events matching search parameters (see iterEventFeatures()).
+    @keyword searchFormat: Format of the search results (geojson, or quakeml).
+    @keyword includeAllMags: Boolean indicating whether QuakeML results should include every magnitude of each event.
+    @return: Search URL.
+    """
     #start creating the url parameters
     urlparams = getEventParams(bounds,radius,starttime,endtime,magrange,depthrange,
                                catalog,contributor)
+    if updatedafter is not None:
+        urlparams['updatedafter'] = updatedafter.strftime(TIMEFMT) + '.%03i' % (updatedafter.microsecond//1000)
+    if includeDeleted:
+        urlparams['includedeleted'] = 'true'
+    if producttype is not None:
+        urlparams['producttype'] = producttype
+    if includeAllMags:
+        urlparams['includeallmagnitudes'] = 'true'
 
     #search parameters we're not making available to the user (yet)
     urlparams['orderby'] = 'time-asc'
-    urlparams['format'] = 'geojson'
+    urlparams['format'] = searchFormat
     params = urllib.urlencode(urlparams)
-    eventlist = []
     if devServer:
         urlbase = URLBASE.replace(SERVER,DEVSERVER)
     else:
         urlbase = URLBASE
-    url = urlbase % params
-    fh = getURLHandle(url)
-    #fh = urllib2.urlopen(url)
-    feed_data = fh.read()
-    fh.close()
-    fdict = json.loads(feed_data)
-    maxmags = 0
-    for feature in fdict['features']:
-        eventdict = OrderedDict()
-        eventdict['id'] = [feature['id'],'%s']
-        #eventdict['idlist'] = (feature['properties']['ids'].strip(',').split(','),'%s')
-        if verbose:
-            sys.stderr.write('Fetching data for event %s...\n' % eventdict['id'])
-        eventdict['time'] = [getUTCTimeStamp(feature['properties']['time']),'%s']
-        eventdict['lat'] = [feature['geometry']['coordinates'][1],'%.4f']
-        eventdict['lon'] = [feature['geometry']['coordinates'][0],'%.4f']
-        depth = feature['geometry']['coordinates'][2]
-        mag = feature['properties']['mag']
-        if mag is None:
-            mag = float('nan')
-        if depth is None:
-            depth = float('nan')
-        eventdict['depth'] = [depth,'%.1f']
-        eventdict['mag'] = [mag,'%g']
-        eventdict['event-type'] = [feature['properties']['type'],'%s']
-                
-        if not getComponents and not getAngles and not getAllMags:
-            eventlist.append(eventdict.copy())
-            continue
-        eurl = feature['properties']['detail']
-        #eventdict['url'] = [eurl,'%s']
-        fh = getURLHandle(eurl)
-        #fh = urllib2.urlopen(eurl)
-        data = fh.read()
-        fh.close()
-        #sys.stderr.write('%s - After reading %s\n' % (ShakeDateTime.now(),url))
-        edict = json.loads(data)
-        #sometimes you find when you actually open the json for the event that it doesn't
-        #REALLY have a moment tensor or focal mechanism, just delete messages for some that USED to be
-        #there.  Double-checking below.
-        if edict['properties']['products'].has_key('moment-tensor'):
-            hasMoment = edict['properties']['products']['moment-tensor'][0]['status'] != 'DELETE'
+    return urlbase % params
+
+def getSearchMagnitudes(url):
+    """
+    Read the magnitudes of every event in a QuakeML search (see getEventSearchURL()).
+
+    The search results are parsed as they download, so that only the magnitudes are kept in memory.
+    If the search fails part way through, the magnitudes read up to that point are returned.
+    @param url: URL of a QuakeML event search, with includeallmagnitudes set.
+    @return: Dictionary of (list of magnitudes,list of magnitude types,list of magnitude sources) tuples, keyed by event id.
+    """
+    magnitudes = {}
+    try:
+        fh = getURLHandle(url)
+        try:
+            for eventid,mags,magtypes,magsources in stream.MagnitudeReader(fh):
+                magnitudes[eventid] = (mags,magtypes,magsources)
+        finally:
+            fh.close()
+    except Exception,msg:
+        pass #events we don't have magnitudes for are looked up one at a time instead
+    return magnitudes
+
+def findEventMagnitudes(feature,magnitudes):
+    """
+    Find the magnitudes of an event from a search feed among those read by getSearchMagnitudes().
+    @param feature: GeoJSON feature dictionary from the ComCat search feed.
+    @param magnitudes: Dictionary returned by getSearchMagnitudes(), or None.
+    @return: Tuple of (list of magnitudes,list of magnitude types,list of magnitude sources), or None if there are
+             none for the event (under its preferred id or any of its other ids).
+    """
+    if not magnitudes:
+        return None
+    eventids = [feature['id']] + (feature['properties'].get('ids') or '').strip(',').split(',')
+    for eventid in eventids:
+        if magnitudes.has_key(eventid) and len(magnitudes[eventid][0]):
+            return magnitudes[eventid]
+    return None
+
+def __getEventDetails(feature,getComponents,getAngles,getAllMags,limitType,verbose,magnitudes=None):
+    """
+    Build the event dictionary for one feature of a GeoJSON feed, fetching the event detail if necessary.
+    @param feature: GeoJSON feature dictionary from the ComCat search feed.
+    @param getComponents: Boolean indicating whether to retrieve moment tensor components.
+    @param getAngles: Boolean indicating whether to retrieve nodal plane angles.
+    @param getAllMags: Boolean indicating whether to retrieve all magnitudes.
+    @param limitType: Limit moment tensor retrieved to those of a particular source/type (comcat.MTYPES)
+    @param verbose: Boolean indicating whether to print message to stderr for every event being retrieved.
+    @keyword magnitudes: Dictionary of magnitudes read from a QuakeML search (see getSearchMagnitudes()), or None.
+                         Events missing from it have their magnitudes read from their origin products instead.
+    @return: Tuple of (OrderedDict of [value,fmt] lists, number of magnitudes found).
+    """
+    if verbose:
+        sys.stderr.write('Fetching data for event %s...\n' % feature['id'])
+    eventmags = None
+    if getAllMags:
+        eventmags = findEventMagnitudes(feature,magnitudes)
+    edict = None
+    if needsEventDetail(feature,getComponents,getAngles,getAllMags and eventmags is None):
+        edict = getEventDetail(feature['id'],url=feature['properties']['detail'],
+                               updated=feature['properties'].get('updated'),
+                               products=getDetailProducts(getComponents,getAngles,getAllMags and eventmags is None))
+    return getEventDict(feature,edict,getComponents=getComponents,getAngles=getAngles,
+                        getAllMags=getAllMags,limitType=limitType,magnitudes=eventmags)
+
+def getDetailProducts(getComponents=False,getAngles=False,getAllMags=False):
+    """
+    Return the product types getEventDict() reads from an event detail document.
+    @keyword getComponents: Boolean indicating whether moment tensor components are wanted.
+    @keyword getAngles: Boolean indicating whether nodal plane angles are wanted.
+    @keyword getAllMags: Boolean indicating whether all magnitudes are to be read from the event's origin products.
+    @return: List of product types (see getEventDetail()).
+    """
+    products = []
+    if getComponents or getAngles:
+        products.append('moment-tensor')
+    if getAngles:
+        products.append('focal-mechanism')
+    if getAllMags:
+        products += ['phase-data','origin']
+    return products
+
+def needsEventDetail(feature,getComponents=False,getAngles=False,getAllMags=False):
+    """
+    Decide from a search feed feature whether its event detail document is needed.
+
+    The feed lists the types of product each event has, so events without a moment tensor or focal
+    mechanism need not be fetched to find that out - their columns are simply filled with NaN.
+    @param feature: GeoJSON feature dictionary from the ComCat search feed.
+    @keyword getComponents: Boolean indicating whether moment tensor components are wanted.
+    @keyword getAngles: Boolean indicating whether nodal plane angles are wanted.
+    @keyword getAllMags: Boolean indicating whether all magnitudes are wanted.
+    @return: True if the event detail document must be fetched.
+    """
+    if getAllMags:
+        return True
+    if not getComponents and not getAngles:
+        return False
+    types = feature['properties'].get('types')
+    if types is None:
+        return True
+    ptypes = types.strip(',').split(',')
+    if getComponents and 'moment-tensor' in ptypes:
+        return True
+    if getAngles and ('moment-tensor' in ptypes or 'focal-mechanism' in ptypes):
+        return True
+    return False
+
+def getEventDict(feature,edict=None,getComponents=False,getAngles=False,getAllMags=False,limitType=None,
+                 magnitudes=None):
+    """
+    Build the event dictionary (as returned by getEventData()) for one feature of a GeoJSON search feed.
+    @param feature: GeoJSON feature dictionary from the ComCat search feed.
+    @keyword edict: Event detail dictionary (see getEventDetail()), required for getAllMags (unless magnitudes are
+                    given), and for getComponents and getAngles unless needsEventDetail() says the event has no
+                    products to read them from.
+    @keyword getComponents: Boolean indicating whether to include moment tensor components.
+    @keyword getAngles: Boolean indicating whether to include nodal plane angles.
+    @keyword getAllMags: Boolean indicating whether to include all magnitudes.
+    @keyword limitType: Limit moment tensor retrieved to those of a particular source/type (comcat.MTYPES)
+    @keyword magnitudes: Tuple of (list of magnitudes,list of magnitude types,list of magnitude sources) for getAllMags
+                         (see findEventMagnitudes()), or None to read them from the event's origin products.
+    @return: Tuple of (OrderedDict of [value,fmt] lists, number of magnitudes found).
+    """
+    eventdict = OrderedDict()
+    eventdict['id'] = [feature['id'],'%s']
+    #eventdict['idlist'] = (feature['properties']['ids'].strip(',').split(','),'%s')
+    eventdict['time'] = [getUTCTimeStamp(feature['properties']['time']),'%s']
+    eventdict['lat'] = [feature['geometry']['coordinates'][1],'%.4f']
+    eventdict['lon'] = [feature['geometry']['coordinates'][0],'%.4f']
+    depth = feature['geometry']['coordinates'][2]
+    mag = feature['properties']['mag']
+    if mag is None:
+        mag = float('nan')
+    if depth is None:
+        depth = float('nan')
+    eventdict['depth'] = [depth,'%.1f']
+    eventdict['mag'] = [mag,'%g']
+    eventdict['event-type'] = [feature['properties']['type'],'%s']
+            
+    if not getComponents and not getAngles and not getAllMags:
+        return (eventdict,0)
+    nmags = 0
+    #sometimes you find when you actually open the json for the event that it doesn't
+    #REALLY have a moment tensor or focal mechanism, just delete messages for some that USED to be
+    #there.  Double-checking below.
+    if edict is not None:
+        products = edict['properties']['products']
+    else:
+        products = {}
+    if products.has_key('moment-tensor'):
+        hasMoment = products['moment-tensor'][0]['status'] != 'DELETE'
+    else:
+        hasMoment = False
+    if products.has_key('focal-mechanism'):
+        hasFocal = products['focal-mechanism'][0]['status'] != 'DELETE'
+    else:
+        hasFocal = False
+    if getAllMags and magnitudes is not None:
+        mags,magtypes,magsources = magnitudes
+    elif getAllMags:
+        mags,magtypes,magsources = __getAllMagnitudes(getMagnitudeProducts(edict))
+    if getAllMags:
+        i = 1
+        nmags = len(mags)
+        for mag,magtype,magsource in zip(mags,magtypes,magsources):
+            eventdict['mag%i' % i] = [mag,'%.1f']
+            eventdict['mag%i-source' % i] = [magsource,'%s']
+            eventdict['mag%i-type' % i] = [magtype,'%s']
+            #sys.stderr.write('Getting mag %i from event %s\n' % (i,feature['id']))
+            i += 1
+    if getComponents:
+        if hasMoment:
+            mrr,mtt,mpp,mrt,mrp,mtp,mtype,mlat,mlon,mdepth,mduration = __getMomentComponents(edict,limitType)
+            eventdict['mrr'] = [mrr,'%g']
+            eventdict['mtt'] = [mtt,'%g']
+            eventdict['mpp'] = [mpp,'%g']
+            eventdict['mrt'] = [mrt,'%g']
+            eventdict['mrp'] = [mrp,'%g']
+            eventdict['mtp'] = [mtp,'%g']
+            eventdict['type'] = [mtype,'%s']
+            eventdict['moment-lat'] = [mlat,'%.4f']
+            eventdict['moment-lon'] = [mlon,'%.4f']
+            eventdict['moment-depth'] = [mdepth,'%.1f']
+            eventdict['moment-duration'] = [mduration,'%.1f']
         else:
-            hasMoment = False
-        if edict['properties']['products'].has_key('focal-mechanism'):
-            hasFocal = edict['properties']['products']['focal-mechanism'][0]['status'] != 'DELETE'
+            eventdict['mrr'] = [NAN,'%g']
+            eventdict['mtt'] = [NAN,'%g']
+            eventdict['mpp'] = [NAN,'%g']
+            eventdict['mrt'] = [NAN,'%g']
+            eventdict['mrp'] = [NAN,'%g']
+            eventdict['mtp'] = [NAN,'%g']
+            eventdict['type'] = ['NA','%s']
+            eventdict['moment-lat'] = [NAN,'%.4f']
+            eventdict['moment-lon'] = [NAN,'%.4f']
+            eventdict['moment-depth'] = [NAN,'%.1f']
+            eventdict['moment-duration'] = [NAN,'%.1f']
+    if getAngles:
+        #sometimes there are delete products instead of real ones, fooling you into
+        #thinking that there is really a moment tensor.  Trapping for that here.
+        if hasFocal or hasMoment:
+            strike1,dip1,rake1,strike2,dip2,rake2 = __getFocalAngles(edict)
+            eventdict['strike1'] = [strike1,'%.0f']
+            eventdict['dip1'] = [dip1,'%.0f']
+            eventdict['rake1'] = [rake1,'%.0f']
+            eventdict['strike2'] = [strike2,'%.0f']
+            eventdict['dip2'] = [dip2,'%.0f']
+            eventdict['rake2'] = [rake2,'%.0f']
         else:
-            hasFocal = False
-        if getAllMags:
-            if edict['properties']['products'].has_key('phase-data'):
-                mags,magtypes,magsources = __getAllMagnitudes(edict['properties']['products']['phase-data'])
-            else:
-                mags,magtypes,magsources = __getAllMagnitudes(edict['properties']['products']['origin'])
-            i = 1
-            if len(mags) > maxmags:
-                maxmags = len(mags)
-            for mag,magtype,magsource in zip(mags,magtypes,magsources):
-                eventdict['mag%i' % i] = [mag,'%.1f']
-                eventdict['mag%i-source' % i] = [magsource,'%s']
-                eventdict['mag%i-type' % i] = [magtype,'%s']
-                #sys.stderr.write('Getting mag %i from event %s\n' % (i,feature['id']))
-                i += 1
-        if getComponents:
-            if hasMoment:
-                mrr,mtt,mpp,mrt,mrp,mtp,mtype,mlat,mlon,mdepth,mduration = __getMomentComponents(edict,limitType)
-                eventdict['mrr'] = [mrr,'%g']
-                eventdict['mtt'] = [mtt,'%g']
-                eventdict['mpp'] = [mpp,'%g']
-                eventdict['mrt'] = [mrt,'%g']
-                eventdict['mrp'] = [mrp,'%g']
-                eventdict['mtp'] = [mtp,'%g']
-                eventdict['type'] = [mtype,'%s']
-                eventdict['moment-lat'] = [mlat,'%.4f']
-                eventdict['moment-lon'] = [mlon,'%.4f']
-                eventdict['moment-depth'] = [mdepth,'%.1f']
-                eventdict['moment-duration'] = [mduration,'%.1f']
-            else:
-                eventdict['mrr'] = [NAN,'%g']
-                eventdict['mtt'] = [NAN,'%g']
-                eventdict['mpp'] = [NAN,'%g']
-                eventdict['mrt'] = [NAN,'%g']
-                eventdict['mrp'] = [NAN,'%g']
-                eventdict['mtp'] = [NAN,'%g']
-                eventdict['type'] = ['NA','%s']
-                eventdict['moment-lat'] = [NAN,'%.4f']
-                eventdict['moment-lon'] = [NAN,'%.4f']
-                eventdict['moment-depth'] = [NAN,'%.1f']
-                eventdict['moment-duration'] = [NAN,'%.1f']
-        if getAngles:
-            #sometimes there are delete products instead of real ones, fooling you into
-            #thinking that there is really a moment tensor.  Trapping for that here.
-            if hasFocal or hasMoment:
-                strike1,dip1,rake1,strike2,dip2,rake2 = __getFocalAngles(edict)
-                eventdict['strike1'] = [strike1,'%.0f']
-                eventdict['dip1'] = [dip1,'%.0f']
-                eventdict['rake1'] = [rake1,'%.0f']
-                eventdict['strike2'] = [strike2,'%.0f']
-                eventdict['dip2'] = [dip2,'%.0f']
-                eventdict['rake2'] = [rake2,'%.0f']
-            else:
-                eventdict['strike1'] = [NAN,'%.0f']
-                eventdict['dip1'] = [NAN,'%.0f']
-                eventdict['rake1'] = [NAN,'%.0f']
-                eventdict['strike2'] = [NAN,'%.0f']
-                eventdict['dip2'] = [NAN,'%.0f']
-                eventdict['rake2'] = [NAN,'%.0f']
-        eventlist.append(eventdict.copy())
-    return (eventlist,maxmags)
+            eventdict['strike1'] = [NAN,'%.0f']
+            eventdict['dip1'] = [NAN,'%.0f']
+            eventdict['rake1'] = [NAN,'%.0f']
+            eventdict['strike2'] = [NAN,'%.0f']
+            eventdict['dip2'] = [NAN,'%.0f']
+            eventdict['rake2'] = [NAN,'%.0f']
+    return (eventdict,nmags)
 
 def getPhaseData(bounds = None,radius=None,starttime = None,endtime = None,
                  magrange = None,catalog = None,contributor = None,
-                 eventid = None,eventProperties=None,productProperties=None,verbose=False):
+                 eventid = None,eventProperties=None,productProperties=None,verbose=False,maxWorkers=None):
     """Fetch origin, moment tensor and phase data for earthquakes matching input parameters.
 
     @keyword bounds: Sequence of (lonmin,lonmax,latmin,latmax)
@@ -737,6 +1269,8 @@ def getPhaseData(bounds = None,radius=None,starttime = None,endtime = None,
     @keyword eventid: Event id to search for - restricts search to a single event (usb000ifva)
     @keyword eventProperties: Dictionary of event properties to match. {'reviewstatus':'approved'}
     @keyword productProperties: Dictionary of event properties to match. {'alert':'yellow'}
+    @keyword maxWorkers: Maximum number of events whose phase data is fetched at the same time (by default
+             the number adapts to how well the server is keeping up).
     @return: List of dictionaries, where the fields are:
              - eventcode (usually) 10 character event code
              - magerr Magnitude uncertainty
@@ -830,9 +1364,60 @@ def getPhaseData(bounds = None,radius=None,starttime = None,endtime = None,
             sys.stderr.write('Could not retrieve phase data for eventid "%s" - error "%s"\n' % (eventid,str(msg)))
             return None
 
+    url = getProductSearchURL('phase-data',bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                              magrange=magrange,catalog=catalog,contributor=contributor)
+    fh = getURLHandle(url)
+    #fh = urllib2.urlopen(url)
+    #features are parsed one at a time as the feed downloads
+    features = stream.FeatureReader(fh)
+    outfiles = []
+    eqlist = []
+    ic = 0
+    def getPhase(feature):
+        eid = feature['id']
+        ptypes = feature['properties']['types'].strip(',').split(',')
+        if 'phase-data' not in ptypes:
+            return (feature,None)
+        try:
+            return (feature,__getEventPhase(eid))
+        except Exception,msg:
+            if verbose:
+                sys.stderr.write('Could not retrieve data for eventid "%s" - error "%s"\n' % (eid,str(msg)))
+            return (feature,None)
+    #several events are fetched at once, but they are still returned in time order
+    nworkers,controller = __getWorkers(maxWorkers)
+    try:
+        for feature,phaseml in pool.mapOrdered(getPhase,features,maxWorkers=nworkers,controller=controller):
+            #REMOVE
+            sys.stderr.write('Fetching event %s (%i of %i)\n' % (feature['id'],ic+1,features.metadata.get('count',0)))
+            if phaseml is not None:
+                eqlist.append(phaseml)
+            ic += 1
+    finally:
+        fh.close()
+    return eqlist
+
+def getProductSearchURL(product,bounds=None,radius=None,starttime=None,endtime=None,magrange=None,
+                        catalog=None,contributor=None,since=None,eventParams=None):
+    """
+    Return the URL of the GeoJSON search feed for events having a given product type.
+    @param product: Name of desired product (i.e., shakemap).
+    @keyword bounds: Sequence of (lonmin,lonmax,latmin,latmax)
+    @keyword radius: Sequence of (lat,lon,maxradius)
+    @keyword starttime: Start time for search (defaults to ~30 days ago).
+    @keyword endtime: End time for search (defaults to now).
+    @keyword magrange: Sequence of (minmag,maxmag)
+    @keyword catalog: Product catalog to use to constrain the search (centennial,nc, etc.).
+    @keyword contributor: Product contributor, or who sent the product to ComCat (us,nc,etc.).
+    @keyword since: Limit to events updated after the specified time (ShakeDateTime).
+    @keyword eventParams: Dictionary of additional search parameters, as returned by planEventProperties().
+    @return: Search URL.
+    """
     #start creating the url parameters
     urlparams = {}
-    urlparams['producttype'] = 'phase-data'
+    if eventParams is not None:
+        urlparams.update(eventParams)
+    urlparams['producttype'] = product
     if starttime is not None:
         urlparams['starttime'] = starttime.strftime(TIMEFMT)
         if endtime is None:
@@ -842,6 +1427,10 @@ def getPhaseData(bounds = None,radius=None,starttime = None,endtime = None,
         if starttime is None:
             urlparams['starttime'] = ShakeDateTime(1900,1,1,0,0,0).strftime(TIMEFMT)
 
+    #if specified, only get events updated after a particular time
+    if since is not None:
+        urlparams['updatedafter'] = since.strftime(TIMEFMT)
+
     #we're using a rectangle search here
     if bounds is not None:
         urlparams['minlongitude'] = bounds[0]
@@ -873,60 +1462,53 @@ def getPhaseData(bounds = None,radius=None,starttime = None,endtime = None,
     urlparams['orderby'] = 'time-asc'
     urlparams['format'] = 'geojson'
     params = urllib.urlencode(urlparams)
-    url = URLBASE % params
-    fh = getURLHandle(url)
-    #fh = urllib2.urlopen(url)
-    feed_data = fh.read()
-    fh.close()
-
-    fdict = json.loads(feed_data)
-    outfiles = []
-    eqlist = []
-    ic = 0
-    for feature in fdict['features']:
-        eid = feature['id']
-        #REMOVE
-        sys.stderr.write('Fetching event %s (%i of %i)\n' % (eid,ic+1,len(fdict['features'])))
-        location = feature['properties']['place']
-        ptypes = feature['properties']['types'].strip(',').split(',')
-        if 'phase-data' not in ptypes:
-            continue
-        try:
-            phaseml = __getEventPhase(eid)
-            eqlist.append(phaseml)
-        except Exception,msg:
-            if verbose:
-                sys.stderr.write('Could not retrieve data for eventid "%s" - error "%s"\n' % (eid,str(msg)))
-        ic += 1
-    return eqlist
+    return URLBASE % params
 
 def __getEventPhase(eventid):
     url = EVENTURL.replace('[EVENTID]',eventid)
     try:
-        fh = getURLHandle(url)
-        event_data = fh.read()
-        fh.close()
-        edict = json.loads(event_data)
-        if not edict['properties']['products']['phase-data'][0]['contents'].has_key('quakeml.xml'):
-            raise LookupError,'Event %s does not have a phase data quakeml file' % eventid
-        quakeurl = edict['properties']['products']['phase-data'][0]['contents']['quakeml.xml']['url']
-        fh = getURLHandle(quakeurl)
+        edict = getEventDetail(eventid,url=url,products=['phase-data'])
+        quakeurl = getPhaseURL(edict,eventid)
+        fh = getContentHandle(quakeurl)
         quakedata = fh.read()
         fh.close()
-        try:
-            phaseml = fixed.PhaseML()
-            phaseml.readFromString(quakedata,url=quakeurl)
-        except Exception,ex:
-            raise Exception('Could not parse phase data for event %s - error "%s"\n' % (eventid,str(ex)))
+        phaseml = parsePhaseData(quakedata,quakeurl,eventid)
     except Exception,msg:
         raise Exception('Could not parse phase data for event %s - error "%s"\n' % (eventid,str(msg)))
     return phaseml    
 
+def getPhaseURL(edict,eventid):
+    """
+    Return the URL of the phase data QuakeML file of an event.
+    @param edict: Event detail dictionary (see getEventDetail()).
+    @param eventid: Event ID (used in error messages).
+    @return: URL of the quakeml.xml file of the event's phase-data product.
+    @raise LookupError: When the event has no phase data QuakeML file.
+    """
+    if not edict['properties']['products']['phase-data'][0]['contents'].has_key('quakeml.xml'):
+        raise LookupError,'Event %s does not have a phase data quakeml file' % eventid
+    return edict['properties']['products']['phase-data'][0]['contents']['quakeml.xml']['url']
+
+def parsePhaseData(quakedata,quakeurl,eventid):
+    """
+    Parse a phase data QuakeML document.
+    @param quakedata: Contents of the QuakeML file (string).
+    @param quakeurl: URL the QuakeML file was read from.
+    @param eventid: Event ID (used in error messages).
+    @return: fixed.PhaseML object.
+    """
+    try:
+        phaseml = fixed.PhaseML()
+        phaseml.readFromString(quakedata,url=quakeurl)
+    except Exception,ex:
+        raise Exception('Could not parse phase data for event %s - error "%s"\n' % (eventid,str(ex)))
+    return phaseml
+
 def getContents(product,contentlist,outfolder=None,bounds = None,
                 starttime = None,endtime = None,magrange = None,
                 catalog = None,contributor = None,eventid = None,
                 eventProperties=None,productProperties=None,radius=None,
-                listURL=False,since=None,getAll=False):
+                listURL=False,since=None,getAll=False,maxWorkers=None,downloader=None):
     """
     Download product contents for event(s) from ComCat, given a product type and list of content files for that product.
 
@@ -954,12 +1536,18 @@ def getContents(product,contentlist,outfolder=None,bounds = None,
     @keyword catalog: Product catalog to use to constrain the search (centennial,nc, etc.).
     @keyword contributor: Product contributor, or who sent the product to ComCat (us,nc,etc.).
     @keyword eventid: Event id to search for - restricts search to a single event (usb000ifva)
-    @keyword eventProperties: Dictionary of event properties to match. {'reviewstatus':'approved'}
-    @keyword productProperties: Dictionary of event properties to match. {'alert':'yellow'}
+    @keyword eventProperties: Dictionary of event properties to match. {'alert':'yellow'}  Properties ComCat
+             can search on (alert, status, type and minsig) are passed to the search (see planEventProperties()),
+             the rest are checked against each event in the search feed.
+    @keyword productProperties: Dictionary of product properties to match. {'reviewstatus':'approved'}
     @keyword radius: Sequence of (lat,lon,maxradius)
     @keyword listURL: Boolean indicating whether URL for each product source should be printed to stdout.
     @keyword since: Limit to events after the specified time (ShakeDateTime). 
     @keyword getAll: Get all versions of a product (only works when eventid keyword is set).
+    @keyword maxWorkers: Maximum number of event details (and files) to download at the same time.  By default
+             (None) the number adapts to how well the server is keeping up (see session.Session).
+    @keyword downloader: download.Downloader object used to fetch the files (a new one is created by default).  
+                         Pass one in to get download statistics (throughput, etc.) afterwards.
     @return: List of output files.
     @raise Exception: When:
       - Input catalog is invalid.
@@ -974,6 +1562,8 @@ def getContents(product,contentlist,outfolder=None,bounds = None,
 
     if outfolder is None:
         outfolder = os.getcwd()
+    if downloader is None:
+        downloader = download.Downloader(maxWorkers=maxWorkers,getHandle=getContentHandle)
 
     #make the output folder if it doesn't already exist
     if not os.path.isdir(outfolder):
@@ -983,94 +1573,93 @@ def getContents(product,contentlist,outfolder=None,bounds = None,
     #below, and just parse the event json
     if eventid is not None:
         try:
-            outfiles = readEventURL(product,contentlist,outfolder,eventid,listURL=listURL,getAll=getAll)
+            outfiles = readEventURL(product,contentlist,outfolder,eventid,listURL=listURL,getAll=getAll,
+                                    downloader=downloader)
             return outfiles
         except Exception,errobj:
             raise Exception,'Could not retrieve data for eventid "%s" due to "%s"' % (eventid,str(errobj))
     
-    #start creating the url parameters
-    urlparams = {}
-    urlparams['producttype'] = product
-    if starttime is not None:
-        urlparams['starttime'] = starttime.strftime(TIMEFMT)
-        if endtime is None:
-            urlparams['endtime'] = ShakeDateTime.utcnow().strftime(TIMEFMT)
-    if endtime is not None:
-        urlparams['endtime'] = endtime.strftime(TIMEFMT)
-        if starttime is None:
-            urlparams['starttime'] = ShakeDateTime(1900,1,1,0,0,0).strftime(TIMEFMT)
-
-    #if specified, only get events updated after a particular time
-    if since is not None:
-        urlparams['updatedafter'] = since.strftime(TIMEFMT)
-
     if bounds is not None and radius is not None:
         raise Exception,"Choose one of bounds or radius, not both"
-        
-    #we're using a rectangle search here
-    if bounds is not None:
-        urlparams['minlongitude'] = bounds[0]
-        urlparams['maxlongitude'] = bounds[1]
-        urlparams['minlatitude'] = bounds[2]
-        urlparams['maxlatitude'] = bounds[3]
-
-        #fix possible issues with 180 meridian crossings
-        minwest = urlparams['minlongitude'] > 0 and urlparams['minlongitude'] < 180
-        maxeast = urlparams['maxlongitude'] < 0 and urlparams['maxlongitude'] > -180
-        if minwest and maxeast:
-            urlparams['maxlongitude'] += 360
-
-    if radius is not None:
-        urlparams['latitude'] = radius[0]
-        urlparams['longitude'] = radius[1]
-        urlparams['maxradiuskm'] = radius[2]
-
-    if magrange is not None:
-        urlparams['minmagnitude'] = magrange[0]
-        urlparams['maxmagnitude'] = magrange[1]
-    
-    if catalog is not None:
-        urlparams['catalog'] = catalog
-    if contributor is not None:
-        urlparams['contributor'] = contributor
-
-    #search parameters we're not making available to the user (yet)
-    urlparams['orderby'] = 'time-asc'
-    urlparams['format'] = 'geojson'
-    params = urllib.urlencode(urlparams)
-    url = URLBASE % params
-    #fh = urllib2.urlopen(url)
+    #let ComCat filter on the event properties it can, and check the rest here
+    eventParams,eventProperties = planEventProperties(eventProperties)
+    url = getProductSearchURL(product,bounds=bounds,radius=radius,starttime=starttime,endtime=endtime,
+                              magrange=magrange,catalog=catalog,contributor=contributor,since=since,
+                              eventParams=eventParams)
     fh = getURLHandle(url)
-    feed_data = fh.read()
-    fh.close()
-    fdict = json.loads(feed_data)
-    outfiles = []
-    for feature in fdict['features']:
-        if eventProperties is not None:
-            skip=False
-            for key,value in eventProperties.iteritems():
-                if not feature['properties'].has_key(key):
-                    skip=True
-                    break
-                else:
-                    fvalue = feature['properties'][key]
-                    if fvalue is None:
-                        skip=True
-                        break
-                    if fvalue.lower() != value.lower():
-                        skip=True
-                        break
-            if skip:
-                continue
-        eid = feature['id']
-        lat,lon,depth = feature['geometry']['coordinates']
-        mag = feature['properties']['mag']
-        efiles = readEventURL(product,contentlist,outfolder,eid,listURL=listURL,productProperties=productProperties)
-        outfiles += efiles
+    #features are parsed one at a time as the feed downloads
+    features = stream.FeatureReader(fh)
+    def getMatches():
+        for feature in features:
+            if matchEventProperties(feature,eventProperties):
+                yield feature
+    def getJobs(feature):
+        return __getContentJobs(product,contentlist,outfolder,feature['id'],productProperties)
+    #event details are read several at a time, and each event's files are queued for download as soon as it is read
+    try:
+        nworkers,controller = __getWorkers(maxWorkers)
+        joblists = pool.mapOrdered(getJobs,getMatches(),maxWorkers=nworkers,controller=controller)
+        if listURL:
+            for jobs in joblists:
+                for contenturl,outfile in jobs:
+                    print contenturl
+            outfiles = []
+        else:
+            outfiles = list(downloader.downloadAll(job for jobs in joblists for job in jobs))
+    finally:
+        fh.close()
 
     return outfiles
 
-def readEventURL(product,contentlist,outfolder,eid,listURL=False,productProperties=None,getAll=False):
+def planEventProperties(eventProperties):
+    """
+    Split event properties into those ComCat can filter on in the search itself, and those that have to be
+    checked against each event in the search feed (with matchEventProperties()).
+    @param eventProperties: Dictionary of event properties to match ({'alert':'yellow','status':'reviewed'}), or None.
+             The key 'minsig' limits the search to events with at least the given significance.
+    @return: Tuple of (dictionary of search parameters,dictionary of remaining event properties or None).
+    """
+    if eventProperties is None:
+        return ({},None)
+    eventParams = {}
+    remaining = {}
+    for key,value in eventProperties.iteritems():
+        if not EVENTPARAMS.has_key(key):
+            remaining[key] = value
+            continue
+        param,allowed = EVENTPARAMS[key]
+        if key == 'minsig':
+            eventParams[param] = int(value)
+            continue
+        #values the search doesn't accept are left to the client side check (which matches them case insensitively)
+        if allowed is not None and value.lower() not in allowed:
+            remaining[key] = value
+            continue
+        eventParams[param] = value.lower()
+    if not len(remaining):
+        remaining = None
+    return (eventParams,remaining)
+
+def matchEventProperties(feature,eventProperties):
+    """
+    Check whether an event from a GeoJSON search feed has the given property values.
+    @param feature: GeoJSON feature dictionary from the ComCat search feed.
+    @param eventProperties: Dictionary of event properties to match ({'reviewstatus':'approved'}), or None.
+    @return: True if every property is present and matches (case insensitive), or if eventProperties is None.
+    """
+    if eventProperties is None:
+        return True
+    for key,value in eventProperties.iteritems():
+        if not feature['properties'].has_key(key):
+            return False
+        fvalue = feature['properties'][key]
+        if fvalue is None:
+            return False
+        if fvalue.lower() != value.lower():
+            return False
+    return True
+
+def readEventURL(product,contentlist,outfolder,eid,listURL=False,productProperties=None,getAll=False,downloader=None):
     """
     Download contents for a given event.
 
@@ -1080,55 +1669,75 @@ def readEventURL(product,contentlist,outfolder,eid,listURL=False,productProperti
     @param eid: Event ID to search for.
     @param listURL: Boolean indicating whether URL for each product source should be printed to stdout.
     @param productProperties: Dictionary of event properties to match. {'alert':'yellow'}
+    @keyword getAll: Get all versions of the product.
+    @keyword downloader: download.Downloader object used to fetch the files (a new one is created by default).
     @returns: List of downloaded files.
     @raise Exception: When eventid URL could not be parsed.
     """
+    if downloader is None:
+        downloader = download.Downloader(getHandle=getContentHandle)
     if getAll:
-        return getAllVersions(eid,product,contentlist,folder=outfolder)
-    outfiles = []
+        return getAllVersions(eid,product,contentlist,folder=outfolder,downloader=downloader)
+    jobs = __getContentJobs(product,contentlist,outfolder,eid,productProperties)
+    if listURL:
+        for contenturl,outfile in jobs:
+            print contenturl
+        return []
+    return list(downloader.downloadAll(jobs))
+
+def __getContentJobs(product,contentlist,outfolder,eid,productProperties):
+    """
+    Find the content files of an event's product matching a list of desired contents.
+    @param product: Name of desired product (i.e., shakemap).
+    @param contentlist: List of desired contents.
+    @param outfolder: Local directory where output files should be written.
+    @param eid: Event ID.
+    @param productProperties: Dictionary of event properties to match, or None.
+    @return: List of (content url,output file) tuples.
+    @raise Exception: When eventid URL could not be parsed.
+    """
     furl = EVENTURL.replace('[EVENTID]',eid)
     try:
-        fh = getURLHandle(furl)
-        #fh = urllib2.urlopen(furl)
-        event_data = fh.read()
-        fh.close()
-        edict = json.loads(event_data)
-        pdict = edict['properties']['products'][product][0]
-
-        skip = False
-        if productProperties is not None:
-            for key,value in productProperties.iteritems():
-                if pdict['properties'].has_key(key) and pdict['properties'][key] is not None:
-                    if value.lower() != pdict['properties'][key].lower():
-                        skip=True
-                        break
-                
-        if skip:
-            return outfiles
-        if pdict['status'].lower() == 'delete':
-            return []
-        for content in contentlist:
-            for contentkey in pdict['contents'].keys():
-                path,contentfile = os.path.split(contentkey)
-                match = re.search(content.lower(),contentfile.lower())
-                if match is not None:
-                    contenturl = pdict['contents'][contentkey]['url']
-                    if listURL:
-                        print contenturl
-                        continue
-                    fh = getURLHandle(contenturl)
-                    #fh = urllib2.urlopen(contenturl)
-                    #print 'Downloading %s...' % contenturl
-                    data = fh.read()
-                    fh.close()
-                    outfile = os.path.join(outfolder,'%s_%s' % (eid,contentfile))
-                    f = open(outfile,'w')
-                    f.write(data)
-                    f.close()
-                    outfiles.append(outfile)
+        edict = getEventDetail(eid,url=furl,products=[product])
+        return getContentJobs(edict,product,contentlist,outfolder,eid,productProperties)
     except Exception,msg:
         raise Exception,'Could not parse event information from "%s". Error: "%s"' % (furl,str(msg))
-    return outfiles
+
+def getContentJobs(edict,product,contentlist,outfolder,eid,productProperties=None):
+    """
+    Find the content files of a product in an event detail dictionary matching a list of desired contents.
+    @param edict: Event detail dictionary (see getEventDetail()).
+    @param product: Name of desired product (i.e., shakemap).
+    @param contentlist: List of desired contents (regular expressions matched against file names).
+    @param outfolder: Local directory where output files should be written.
+    @param eid: Event ID (used to name the output files).
+    @keyword productProperties: Dictionary of event properties to match, or None.
+    @return: List of (content url,output file) tuples.
+    """
+    jobs = []
+    pdict = edict['properties']['products'][product][0]
+
+    skip = False
+    if productProperties is not None:
+        for key,value in productProperties.iteritems():
+            if pdict['properties'].has_key(key) and pdict['properties'][key] is not None:
+                if value.lower() != pdict['properties'][key].lower():
+                    skip=True
+                    break
+            
+    if skip:
+        return jobs
+    if pdict['status'].lower() == 'delete':
+        return []
+    for content in contentlist:
+        for contentkey in pdict['contents'].keys():
+            path,contentfile = os.path.split(contentkey)
+            match = re.search(content.lower(),contentfile.lower())
+            if match is not None:
+                contenturl = pdict['contents'][contentkey]['url']
+                outfile = os.path.join(outfolder,'%s_%s' % (eid,contentfile))
+                jobs.append((contenturl,outfile))
+    return jobs
 
 if __name__ == '__main__':
     #test associate functionality
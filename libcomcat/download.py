@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import tempfile
+import threading
+import time
+
+#local imports
+import pool
+import session
+
+MAXDOWNLOADS = 4 #default number of files downloaded at the same time
+CHUNKSIZE = 256*1024 #number of bytes read from the network and written to disk at a time
+
+def __getFileMode():
+    #os.umask() can only be read by setting it, so do that once, before any threads are writing files
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+FILEMODE = __getFileMode() #permissions open() would give a new file (tempfile.mkstemp() makes them owner-only)
+
+class Downloader(object):
+    """
+    Download manager for product content files (ShakeMap grids, finite-fault bundles, etc.).
+
+    Files are downloaded a few at a time, and streamed to disk in chunks, so that large files are
+    never held in memory.  Each file is written (in binary mode) to a temporary file in the output
+    directory, which is renamed to the output file only when the download is complete, so an
+    interrupted download never leaves a partial file behind.  The number of files and bytes
+    downloaded, and the throughput, are available from stats().
+    """
+    def __init__(self,maxWorkers=MAXDOWNLOADS,chunksize=CHUNKSIZE,getHandle=None):
+        """
+        Create a Downloader.
+        @keyword maxWorkers: Maximum number of files to download at the same time, or None to let the number
+                 adapt to how well the server is keeping up (see session.Session).
+        @keyword chunksize: Number of bytes to read and write at a time.
+        @keyword getHandle: Function taking a URL and returning a file-like object (defaults to the shared session.getSession().get, with hedging).
+        """
+        self.maxWorkers = maxWorkers
+        self.chunksize = chunksize
+        if getHandle is None:
+            getHandle = lambda url: session.getSession().get(url,hedge=True)
+        self._getHandle = getHandle
+        self._lock = threading.Lock()
+        self._nfiles = 0
+        self._nbytes = 0
+        self._start = None
+        self._end = None
+
+    def download(self,url,outfile):
+        """
+        Download one file.
+        @param url: URL of the file.
+        @param outfile: Path of the output file (replaced if it already exists).
+        @return: outfile.
+        """
+        self._lock.acquire()
+        try:
+            if self._start is None:
+                self._start = time.time()
+        finally:
+            self._lock.release()
+        outfolder = os.path.dirname(os.path.abspath(outfile))
+        fd,tmpfile = tempfile.mkstemp(dir=outfolder,prefix='.download')
+        nbytes = 0
+        try:
+            os.chmod(tmpfile,FILEMODE)
+            f = os.fdopen(fd,'wb')
+            try:
+                fh = self._getHandle(url)
+                try:
+                    while True:
+                        chunk = fh.read(self.chunksize)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        nbytes += len(chunk)
+                finally:
+                    fh.close()
+            finally:
+                f.close()
+            if os.path.isfile(outfile):
+                #os.rename() won't replace an existing file on Windows
+                os.remove(outfile)
+            os.rename(tmpfile,outfile)
+        except:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+            raise
+        self._lock.acquire()
+        try:
+            self._nfiles += 1
+            self._nbytes += nbytes
+            self._end = time.time()
+        finally:
+            self._lock.release()
+        return outfile
+
+    def downloadAll(self,jobs):
+        """
+        Download a number of files, several at a time.
+        @param jobs: Sequence (or iterator) of (url,outfile) tuples.
+        @return: Generator of output files, in the same order as jobs.
+        """
+        def getJob(job):
+            url,outfile = job
+            return self.download(url,outfile)
+        if self.maxWorkers is None:
+            controller = session.getSession().controller
+            return pool.mapOrdered(getJob,jobs,maxWorkers=controller.maxLimit,controller=controller)
+        return pool.mapOrdered(getJob,jobs,maxWorkers=self.maxWorkers)
+
+    def stats(self):
+        """
+        Return a dictionary of download statistics.
+        @return: Dictionary with fields:
+                 - files Number of files downloaded.
+                 - bytes Number of bytes downloaded.
+                 - seconds Time from the start of the first download to the end of the last.
+                 - rate Throughput (bytes per second).
+        """
+        self._lock.acquire()
+        try:
+            seconds = 0.0
+            if self._start is not None and self._end is not None:
+                seconds = self._end - self._start
+            rate = 0.0
+            if seconds > 0:
+                rate = self._nbytes/seconds
+            return {'files':self._nfiles,'bytes':self._nbytes,'seconds':seconds,'rate':rate}
+        finally:
+            self._lock.release()
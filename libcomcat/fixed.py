@@ -5,7 +5,6 @@ from xml.dom.minidom import parseString
 import sys
 import datetime
 import math
-import urllib2
 import copy
 
 #third party imports
@@ -14,6 +13,7 @@ from neicio import fixed
 
 #local imports
 import ellipse
+import session
 
 ORIGINHDR = [((4,7),'a4'),
              ((15,18),'a4'),
@@ -701,7 +701,7 @@ class PhaseML(object):
         locnum = float('nan')
         locstr = '%.4f,%.4f' % (lat,lon)
         try:
-            fh = urllib2.urlopen(url)
+            fh = session.getSession().get(url)
             regstr = fh.read()
             fh.close()
             parts = regstr.split('|')
@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import sqlite3
+import json
+import time
+import sys
+import math
+import re
+from collections import OrderedDict
+
+#local imports
+import comcat
+import pool
+from checkpoint import getTimeStamp
+
+MIRRORFILE = 'mirror.db'
+SYNCMARGIN = 300 #seconds of overlap between syncs, to allow for clock skew and slow updates
+FORMATVERSION = 2
+GRIDSIZE = 1.0 #size (degrees) of the cells of the spatial index
+MAXCELLS = 1000 #searches covering more cells than this use only the time index
+EARTHRADIUS = 6371.0 #km
+COMPONENTS = ['mrr','mtt','mpp','mrt','mrp','mtp','type','moment-lat','moment-lon','moment-depth','moment-duration']
+ANGLES = ['strike1','dip1','rake1','strike2','dip2','rake2']
+MAGPATTERN = re.compile(r'^mag\d+')
+
+CREATE = ['''CREATE TABLE IF NOT EXISTS event (
+eventid TEXT PRIMARY KEY,
+time INTEGER,
+lat REAL,
+lon REAL,
+depth REAL,
+mag REAL,
+updated INTEGER,
+ids TEXT,
+url TEXT,
+sources TEXT,
+cell INTEGER,
+nmags INTEGER,
+data TEXT)''',
+          'CREATE INDEX IF NOT EXISTS event_time ON event (time)',
+          'CREATE INDEX IF NOT EXISTS event_cell ON event (cell,time)',
+          '''CREATE TABLE IF NOT EXISTS alias (
+id TEXT PRIMARY KEY,
+eventid TEXT)''',
+          'CREATE INDEX IF NOT EXISTS alias_eventid ON alias (eventid)',
+          'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)']
+
+class Mirror(object):
+    """
+    Local copy of the part of the ComCat catalog matching a search, kept up to date incrementally.
+
+    The mirror is first filled with load(), which searches the whole time range in adaptive segments
+    (see comcat.getAdaptiveTimeSegments()).  Afterwards, sync() asks ComCat only for events updated since
+    the last load or sync (the "high-water mark"), and inserts or replaces them in the mirror.  Deleted
+    events are removed, and an event whose preferred id has changed replaces the entry stored under its
+    old id.  Events are stored in a SQLite database, as the same rows returned by comcat.getEventData().
+
+    getEventData() and getFeatures() search the mirror without contacting ComCat, using an index on event time
+    and an index on a grid of GRIDSIZE degree cells.
+    """
+    def __init__(self,folder):
+        """
+        Open (or create) a mirror.
+        @param folder: Directory where the mirror database is kept (created if necessary).
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+        self._db = sqlite3.connect(os.path.join(folder,MIRRORFILE))
+        for statement in CREATE:
+            self._db.execute(statement)
+        self._db.commit()
+        version = self._getMeta('version')
+        if version is not None and version != FORMATVERSION:
+            raise Exception,'Mirror in %s was made by a different version of libcomcat, and must be loaded again.' % folder
+
+    def isLoaded(self):
+        """
+        Return True if the mirror has been loaded (and the load finished).
+        """
+        return self._getMeta('query') is not None and self._getMeta('highwater') is not None
+
+    def isPartial(self):
+        """
+        Return True if a load of the mirror was started, but did not finish.
+        """
+        return self._getMeta('query') is not None and self._getMeta('highwater') is None
+
+    def getQuery(self):
+        """
+        Return the search parameters the mirror was loaded with.
+        @return: Dictionary of comcat.getEventData() keywords (times as milliseconds since the epoch), or None.
+        """
+        return self._getMeta('query')
+
+    def getHighWater(self):
+        """
+        Return the time (milliseconds since the epoch) up to which the mirror is known to be up to date, or None.
+        """
+        return self._getMeta('highwater')
+
+    def load(self,starttime=None,endtime=None,bounds=None,radius=None,magrange=None,depthrange=None,
+             catalog=None,contributor=None,getComponents=False,getAngles=False,getAllMags=False,
+             limitType=None,devServer=False,maxWorkers=None,maxSegments=comcat.SEGMENTWORKERS,
+             verbose=False):
+        """
+        Fill the mirror with all events matching a search, replacing anything already in it.
+        @keyword starttime: Start time of the mirror (ShakeDateTime), or None for 1900-01-01.
+        @keyword endtime: End time of the mirror (ShakeDateTime), or None to keep mirroring new events as they occur.
+        @keyword bounds: (lonmin,lonmax,latmin,latmax) Bounding box of search. (dd)
+        @keyword radius: (centerlat,centerlon,maxradius) Radius search parameters (dd,dd,km,km)
+        @keyword magrange: (magmin,magmax) Magnitude range.
+        @keyword depthrange: (depthmin,depthmax) Depth range.
+        @keyword catalog: Name of contributing catalog (see comcat.checkCatalogs()).
+        @keyword contributor: Name of contributing catalog (see comcat.checkContributors()).
+        @keyword getComponents: Boolean indicating whether to store moment tensor components, type, and derived hypocenter.
+        @keyword getAngles: Boolean indicating whether to store nodal plane angles.
+        @keyword getAllMags: Boolean indicating whether to store all magnitudes.
+        @keyword limitType: Limit moment tensors stored to those of a particular source/type (comcat.MTYPES)
+        @keyword devServer: Use the USGS-internal development ComCat server (will fail for users outside USGS network.)
+        @keyword maxWorkers: Maximum number of event detail documents to fetch concurrently (None to adapt to the server).
+        @keyword maxSegments: Maximum number of time segments to search concurrently.
+        @keyword verbose: Boolean indicating whether to print progress to stderr.
+        @return: Number of events in the mirror.
+        """
+        if starttime is None:
+            starttime = comcat.ShakeDateTime(1900,1,1)
+        query = {'starttime':getTimeStamp(starttime),'endtime':None,'bounds':bounds,'radius':radius,
+                 'magrange':magrange,'depthrange':depthrange,'catalog':catalog,'contributor':contributor,
+                 'getComponents':getComponents,'getAngles':getAngles,'getAllMags':getAllMags,
+                 'limitType':limitType,'devServer':devServer}
+        if endtime is not None:
+            query['endtime'] = getTimeStamp(endtime)
+        #anything updated after the load starts will be picked up by the next sync
+        highwater = int((time.time() - SYNCMARGIN)*1000)
+        self._db.execute('DELETE FROM event')
+        self._db.execute('DELETE FROM alias')
+        self._db.execute('DELETE FROM meta')
+        self._putMeta('version',FORMATVERSION)
+        #the high-water mark is only stored once the load is complete (see isLoaded())
+        self._putMeta('query',query)
+        self._db.commit()
+        stime,etime = self._getWindow(query)
+        segments = comcat.getAdaptiveTimeSegments(stime,etime,bounds=bounds,radius=radius,magrange=magrange,
+                                                  depthrange=depthrange,catalog=catalog,contributor=contributor,
+                                                  devServer=devServer,maxWorkers=maxSegments)
+        if verbose:
+            sys.stderr.write('Loading mirror in %i segments.\n' % len(segments))
+        self._update(segments,query,None,maxWorkers,maxSegments,verbose)
+        self._putMeta('highwater',highwater)
+        self._db.commit()
+        return self.getCount()
+
+    def sync(self,maxWorkers=None,maxSegments=comcat.SEGMENTWORKERS,verbose=False):
+        """
+        Bring the mirror up to date with events that were added, changed or deleted since the last load or sync.
+        @keyword maxWorkers: Maximum number of event detail documents to fetch concurrently (None to adapt to the server).
+        @keyword maxSegments: Maximum number of time segments to search concurrently.
+        @keyword verbose: Boolean indicating whether to print progress to stderr.
+        @return: Tuple of (number of events added or changed, number of events removed).
+        """
+        query = self.getQuery()
+        if query is None:
+            raise Exception,'Mirror in %s has not been loaded.' % self.folder
+        highwater = self.getHighWater()
+        if highwater is None:
+            raise Exception,'Loading of the mirror in %s did not finish, so it must be loaded again.' % self.folder
+        updatedafter = comcat.getUTCTimeStamp(highwater - SYNCMARGIN*1000)
+        stime,etime = self._getWindow(query)
+        nchanged,nremoved,newhighwater = self._update([(stime,etime)],query,updatedafter,maxWorkers,maxSegments,verbose)
+        self._putMeta('highwater',max(highwater,newhighwater))
+        self._db.commit()
+        return (nchanged,nremoved)
+
+    def getCount(self):
+        """
+        Return the number of events in the mirror.
+        """
+        return self._db.execute('SELECT COUNT(*) FROM event').fetchone()[0]
+
+    def getEventData(self,bounds=None,radius=None,starttime=None,endtime=None,magrange=None,depthrange=None,
+                     catalog=None,contributor=None,getComponents=False,getAngles=False,getAllMags=False,
+                     limitType=None):
+        """
+        Search the mirror, returning the same data as comcat.getEventData().
+
+        The search keywords are the same as for comcat.getEventData(), and must ask for a subset of what the
+        mirror was loaded with.  Catalog and contributor are matched against the sources (contributing networks)
+        of each event.
+        @keyword bounds: (lonmin,lonmax,latmin,latmax) Bounding box of search. (dd)
+        @keyword radius: (centerlat,centerlon,maxradius) Radius search parameters (dd,dd,km,km)
+        @keyword starttime: Start time of search (ShakeDateTime)
+        @keyword endtime: End  time of search (ShakeDateTime)
+        @keyword magrange: (magmin,magmax) Magnitude range.
+        @keyword depthrange: (depthmin,depthmax) Depth range.
+        @keyword catalog: Name of contributing catalog.
+        @keyword contributor: Name of contributing network.
+        @keyword getComponents: Boolean indicating whether to include moment tensor components, type, and derived hypocenter.
+        @keyword getAngles: Boolean indicating whether to include nodal plane angles.
+        @keyword getAllMags: Boolean indicating whether to include all magnitudes.
+        @keyword limitType: Limit moment tensors to those of a particular source/type (comcat.MTYPES).  With
+                            getComponents, only events with a moment tensor of this type are returned.
+        @return: Tuple of (list of event OrderedDicts, maximum number of magnitudes found for any one event).
+        """
+        query = self._checkQuery(starttime,endtime)
+        for key,value in [('getComponents',getComponents),('getAngles',getAngles),('getAllMags',getAllMags)]:
+            if value and not query[key]:
+                raise Exception,'Mirror in %s was not loaded with %s.' % (self.folder,key)
+        if getComponents and query['limitType'] is not None and query['limitType'] != limitType:
+            raise Exception,'Mirror in %s only holds %s moment tensors.' % (self.folder,query['limitType'])
+        drop = set()
+        if not getComponents:
+            drop.update(COMPONENTS)
+        if not getAngles:
+            drop.update(ANGLES)
+        eventlist = []
+        maxmags = 0
+        rows = self._select('nmags,data',bounds,radius,starttime,endtime,magrange,depthrange,catalog,contributor)
+        for nmags,data in rows:
+            eventdict = OrderedDict()
+            for key,value,fmt in json.loads(data):
+                if key in drop or (not getAllMags and MAGPATTERN.match(key) is not None):
+                    continue
+                if key == 'time':
+                    value = comcat.getUTCTimeStamp(value)
+                eventdict[str(key)] = [value,str(fmt)]
+            if not comcat.matchMomentType(eventdict,getComponents,limitType):
+                continue
+            if getAllMags:
+                maxmags = max(maxmags,nmags)
+            eventlist.append(eventdict)
+        return (eventlist,maxmags)
+
+    def getFeatures(self,bounds=None,radius=None,starttime=None,endtime=None,magrange=None,depthrange=None,
+                    catalog=None,contributor=None):
+        """
+        Search the mirror, returning a basic GeoJSON feature for each event (like those in the ComCat search feed).
+
+        See getEventData() for a description of the keywords.
+        @return: List of GeoJSON feature dictionaries, in time order, with id, geometry, and time, mag, updated, ids,
+                 url and sources properties.
+        """
+        self._checkQuery(starttime,endtime)
+        features = []
+        rows = self._select('eventid,time,lat,lon,depth,mag,updated,ids,url,sources',
+                            bounds,radius,starttime,endtime,magrange,depthrange,catalog,contributor)
+        for eventid,etime,lat,lon,depth,mag,updated,ids,url,sources in rows:
+            properties = {'time':etime,'mag':mag,'updated':updated,'ids':',%s,' % ids,'url':url,'sources':sources}
+            features.append({'type':'Feature','id':eventid,'properties':properties,
+                             'geometry':{'type':'Point','coordinates':[lon,lat,depth]}})
+        return features
+
+    def close(self):
+        """
+        Close the mirror database.
+        """
+        self._db.close()
+
+    def _checkQuery(self,starttime,endtime):
+        query = self.getQuery()
+        if query is None:
+            raise Exception,'Mirror in %s has not been loaded.' % self.folder
+        stime,etime = self._getTimeRange(starttime,endtime)
+        if stime < query['starttime'] or (query['endtime'] is not None and etime > query['endtime']):
+            raise Exception,'Search time range is outside of the time range of the mirror in %s.' % self.folder
+        return query
+
+    def _getTimeRange(self,starttime,endtime):
+        #same defaults as comcat.getEventParams()
+        if starttime is None and endtime is None:
+            starttime = comcat.ShakeDateTime.utcnow() - comcat.timedelta(days=30)
+        elif starttime is None:
+            starttime = comcat.ShakeDateTime(1900,1,1)
+        if endtime is None:
+            endtime = comcat.ShakeDateTime.utcnow()
+        return (getTimeStamp(starttime),getTimeStamp(endtime))
+
+    def _select(self,fields,bounds,radius,starttime,endtime,magrange,depthrange,catalog,contributor):
+        stime,etime = self._getTimeRange(starttime,endtime)
+        where = ['time >= ?','time <= ?']
+        params = [stime,etime]
+        if magrange is not None:
+            where.append('mag >= ? AND mag <= ?')
+            params += [magrange[0],magrange[1]]
+        if depthrange is not None:
+            where.append('depth >= ? AND depth <= ?')
+            params += [depthrange[0],depthrange[1]]
+        for source in [catalog,contributor]:
+            if source is not None:
+                #instr() rather than LIKE, so that '_' or '%' in a source code is not a wildcard
+                where.append('instr(sources,?) > 0')
+                params.append(',%s,' % source)
+        if bounds is not None and radius is not None:
+            raise Exception,'Cannot choose bounds search AND radius search.'
+        if bounds is not None:
+            lonmin,lonmax,latmin,latmax = bounds
+        elif radius is not None:
+            lonmin,lonmax,latmin,latmax = getRadiusBounds(radius[0],radius[1],radius[2])
+        if bounds is not None or radius is not None:
+            lonranges = getLongitudeRanges(lonmin,lonmax)
+            where.append('lat >= ? AND lat <= ?')
+            params += [latmin,latmax]
+            where.append('(%s)' % ' OR '.join(['(lon >= ? AND lon <= ?)']*len(lonranges)))
+            for lonrange in lonranges:
+                params += list(lonrange)
+            cells = getCells(latmin,latmax,lonranges)
+            if len(cells) <= MAXCELLS:
+                #cell numbers are integers we computed, so they can safely go straight into the statement
+                where.append('cell IN (%s)' % ','.join([str(cell) for cell in cells]))
+        if radius is not None:
+            fields = 'lat,lon,' + fields
+        sql = 'SELECT %s FROM event WHERE %s ORDER BY time ASC' % (fields,' AND '.join(where))
+        rows = self._db.execute(sql,params)
+        if radius is None:
+            return rows
+        #the bounding box of a circle also holds events outside of it
+        return [row[2:] for row in rows if getDistance(radius[0],radius[1],row[0],row[1]) <= radius[2]]
+
+    def _getWindow(self,query):
+        stime = comcat.getUTCTimeStamp(query['starttime'])
+        if query['endtime'] is None:
+            etime = comcat.ShakeDateTime.utcnow()
+        else:
+            etime = comcat.getUTCTimeStamp(query['endtime'])
+        return (stime,etime)
+
+    def _update(self,segments,query,updatedafter,maxWorkers,maxSegments,verbose):
+        #search segments several at a time, applying each one's results in the calling thread (sqlite wants one writer)
+        def getSegment(segment):
+            stime,etime = segment
+            return self._getSegmentFeatures(stime,etime,query,updatedafter,maxWorkers)
+        nchanged = 0
+        nremoved = 0
+        highwater = 0
+        for i,features in enumerate(pool.mapOrdered(getSegment,segments,maxWorkers=maxSegments)):
+            for feature,eventdict in features:
+                highwater = max(highwater,feature['properties'].get('updated') or 0)
+                if eventdict is None:
+                    nremoved += self._remove(feature)
+                elif self._upsert(feature,eventdict):
+                    nchanged += 1
+            self._db.commit()
+            if verbose:
+                sys.stderr.write('Completed segment %i of %i (%i events).\n' % (i+1,len(segments),len(features)))
+        return (nchanged,nremoved,highwater)
+
+    def _getSegmentFeatures(self,stime,etime,query,updatedafter,maxWorkers):
+        countkeys = ['bounds','radius','magrange','depthrange','catalog','contributor','devServer']
+        kwargs = dict([(key,query[key]) for key in countkeys + ['getComponents','getAngles','getAllMags','limitType']])
+        includeDeleted = updatedafter is not None
+        try:
+            features = list(comcat.iterEventFeatures(starttime=stime,endtime=etime,updatedafter=updatedafter,
+                                                     includeDeleted=includeDeleted,maxWorkers=maxWorkers,**kwargs))
+            truncated = len(features) >= comcat.SEARCHLIMIT
+        except:
+            #ComCat refuses searches that would return too many events - check whether that's what happened
+            exc_info = sys.exc_info()
+            countargs = dict([(key,query[key]) for key in countkeys])
+            nevents,maxevents = comcat.getEventCount(starttime=stime,endtime=etime,updatedafter=updatedafter,
+                                                     includeDeleted=includeDeleted,**countargs)
+            if nevents < maxevents or etime - stime <= comcat.MINSEGMENT:
+                raise exc_info[0],exc_info[1],exc_info[2]
+            truncated = True
+        if not truncated or etime - stime <= comcat.MINSEGMENT:
+            return features
+        #too many events for one search - split in half and try again
+        mtime = comcat.getUTCTimeStamp((getTimeStamp(stime) + getTimeStamp(etime))//2)
+        return (self._getSegmentFeatures(stime,mtime,query,updatedafter,maxWorkers) +
+                self._getSegmentFeatures(mtime,etime,query,updatedafter,maxWorkers))
+
+    def _getIds(self,feature):
+        ids = [eid for eid in feature['properties'].get('ids','').split(',') if eid]
+        if feature['id'] not in ids:
+            ids.append(feature['id'])
+        return ids
+
+    def _getEventIds(self,ids):
+        eventids = set()
+        for eid in ids:
+            for row in self._db.execute('SELECT eventid FROM alias WHERE id=?',(eid,)):
+                eventids.add(row[0])
+        return eventids
+
+    def _deleteEvent(self,eventid):
+        self._db.execute('DELETE FROM event WHERE eventid=?',(eventid,))
+        self._db.execute('DELETE FROM alias WHERE eventid=?',(eventid,))
+
+    def _remove(self,feature):
+        eventids = self._getEventIds(self._getIds(feature))
+        for eventid in eventids:
+            self._deleteEvent(eventid)
+        return len(eventids)
+
+    def _upsert(self,feature,eventdict):
+        eventid = feature['id']
+        updated = feature['properties'].get('updated')
+        row = self._db.execute('SELECT updated FROM event WHERE eventid=?',(eventid,)).fetchone()
+        if row is not None and row[0] is not None and updated is not None and row[0] > updated:
+            #we already have a newer version of this event
+            return False
+        ids = self._getIds(feature)
+        #entries stored under any of this event's ids (i.e., before its preferred id changed) are replaced
+        for oldid in self._getEventIds(ids):
+            self._deleteEvent(oldid)
+        rows = []
+        for key,(value,fmt) in eventdict.iteritems():
+            if key == 'time':
+                value = getTimeStamp(value)
+            rows.append([key,value,fmt])
+        lat = eventdict['lat'][0]
+        lon = eventdict['lon'][0]
+        self._db.execute('INSERT OR REPLACE INTO event VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                         (eventid,getTimeStamp(eventdict['time'][0]),lat,lon,
+                          eventdict['depth'][0],eventdict['mag'][0],updated,','.join(ids),
+                          feature['properties'].get('url'),feature['properties'].get('sources'),
+                          getCell(lat,lon),comcat.getMagnitudeCount(eventdict),json.dumps(rows)))
+        self._db.executemany('INSERT OR REPLACE INTO alias VALUES (?,?)',[(eid,eventid) for eid in ids])
+        return True
+
+    def _getMeta(self,name):
+        row = self._db.execute('SELECT value FROM meta WHERE name=?',(name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def _putMeta(self,name,value):
+        self._db.execute('INSERT OR REPLACE INTO meta VALUES (?,?)',(name,json.dumps(value)))
+
+def getCell(lat,lon):
+    """
+    Return the number of the spatial index cell holding a point.
+    @param lat: Latitude (dd).
+    @param lon: Longitude (dd).
+    @return: Cell number.
+    """
+    nlon = int(round(360/GRIDSIZE))
+    nlat = int(round(180/GRIDSIZE))
+    lon = (lon + 180) % 360 - 180
+    row = min(int(math.floor((lat + 90)/GRIDSIZE)),nlat-1)
+    col = min(int(math.floor((lon + 180)/GRIDSIZE)),nlon-1)
+    return row*nlon + col
+
+def getCells(latmin,latmax,lonranges):
+    """
+    Return the numbers of the spatial index cells overlapping a box.
+    @param latmin: Minimum latitude (dd).
+    @param latmax: Maximum latitude (dd).
+    @param lonranges: List of (lonmin,lonmax) longitude ranges (see getLongitudeRanges()).
+    @return: List of cell numbers.
+    """
+    nlon = int(round(360/GRIDSIZE))
+    rowmin = getCell(max(latmin,-90),0) // nlon
+    rowmax = getCell(min(latmax,90),0) // nlon
+    cols = set()
+    for lonmin,lonmax in lonranges:
+        colmin = max(int(math.floor((lonmin + 180)/GRIDSIZE)),0)
+        colmax = min(int(math.floor((lonmax + 180)/GRIDSIZE)),nlon-1)
+        cols.update(range(colmin,colmax+1))
+        if lonmax >= 180:
+            #points on the 180 meridian are stored in the same cells as those on -180
+            cols.add(0)
+    return [row*nlon + col for row in range(rowmin,rowmax+1) for col in sorted(cols)]
+
+def getLongitudeRanges(lonmin,lonmax):
+    """
+    Return the longitude ranges (in -180 to 180) covered by a box, which may cross the -180/180 meridian.
+    @param lonmin: Western edge of the box (dd).  As with ComCat searches, a box crossing the -180/180 meridian
+                   can be given as lonmin=179, lonmax=-179.
+    @param lonmax: Eastern edge of the box (dd).
+    @return: List of one or two (lonmin,lonmax) tuples.
+    """
+    if lonmax < lonmin:
+        lonmax += 360
+    if lonmax - lonmin >= 360:
+        return [(-180.0,180.0)]
+    shift = math.floor((lonmin + 180)/360)*360
+    lonmin -= shift
+    lonmax -= shift
+    if lonmax <= 180:
+        return [(lonmin,lonmax)]
+    return [(lonmin,180.0),(-180.0,lonmax-360)]
+
+def getRadiusBounds(lat,lon,rmax):
+    """
+    Return the bounding box of a circle.
+    @param lat: Latitude of the center of the circle (dd).
+    @param lon: Longitude of the center of the circle (dd).
+    @param rmax: Radius of the circle (km).
+    @return: (lonmin,lonmax,latmin,latmax) Bounding box (lonmin and lonmax may be outside of -180 to 180).
+    """
+    angle = rmax/EARTHRADIUS
+    latmin = lat - math.degrees(angle)
+    latmax = lat + math.degrees(angle)
+    if latmin <= -90 or latmax >= 90 or angle >= math.pi/2:
+        #the circle includes a pole
+        return (lon-180,lon+180,max(latmin,-90),min(latmax,90))
+    dlon = math.degrees(math.asin(min(math.sin(angle)/math.cos(math.radians(lat)),1.0)))
+    return (lon-dlon,lon+dlon,latmin,latmax)
+
+def getDistance(lat1,lon1,lat2,lon2):
+    """
+    Return the great circle distance between two points.
+    @param lat1: Latitude of first point (dd).
+    @param lon1: Longitude of first point (dd).
+    @param lat2: Latitude of second point (dd).
+    @param lon2: Longitude of second point (dd).
+    @return: Distance (km).
+    """
+    lat1,lon1,lat2,lon2 = [math.radians(x) for x in (lat1,lon1,lat2,lon2)]
+    a = math.sin((lat2-lat1)/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin((lon2-lon1)/2)**2
+    return 2*EARTHRADIUS*math.asin(min(math.sqrt(a),1.0))
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import threading
+import Queue
+import sys
+import time
+
+MAXWORKERS = 4 #default number of concurrent worker threads
+WAITSECS = 0.5 #how often a waiting thread wakes up (allows Ctrl-C to get through)
+WINDOW = 2 #number of items per worker that may be read ahead of the item being yielded
+MAXADAPTIVE = 16 #largest number of concurrent tasks an AIMDController will allow
+LATENCYFACTOR = 2.0 #recent latency this many times the long-run latency is taken as a sign of congestion
+DECREASEINTERVAL = 1.0 #minimum number of seconds between two cuts of the concurrency limit
+MINSAMPLES = 20 #number of latencies to see before latency spikes are acted on
+
+def mapOrdered(func,items,maxWorkers=MAXWORKERS,controller=None):
+    """
+    Apply a function to every item in a sequence using a bounded pool of worker threads.
+
+    Results are yielded in the same order as the input items, regardless of the order in which
+    the workers finish.  Items are read from the input lazily, no more than a few per worker ahead
+    of the result being yielded, so the input can be a generator that is itself streaming data.
+    An exception raised by func is re-raised in the calling thread when the result for the
+    offending item would have been yielded.
+    @param func: Function taking a single item as input.
+    @param items: Sequence (or iterator) of input items.
+    @keyword maxWorkers: Maximum number of concurrent worker threads.  With a value of 1 or less,
+             func is simply called serially in the calling thread.
+    @keyword controller: AIMDController limiting how many of the workers may call func at once (shared
+             with any other pools using the same controller), or None.
+    @return: Generator of func(item) results, in input order.
+    """
+    if controller is not None:
+        func = controller.wrap(func)
+    if maxWorkers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    items = iter(items)
+    inqueue = Queue.Queue()
+    results = {}
+    stopped = threading.Event()
+    cond = threading.Condition()
+    def worker():
+        while True:
+            task = inqueue.get()
+            if task is None or stopped.is_set():
+                return
+            i,item = task
+            try:
+                result = (True,func(item))
+            except:
+                result = (False,sys.exc_info())
+            cond.acquire()
+            try:
+                results[i] = result
+                cond.notify()
+            finally:
+                cond.release()
+    threads = []
+    for i in range(0,maxWorkers):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    nsubmitted = 0
+    nyielded = 0
+    exhausted = False
+    try:
+        while True:
+            #keep the workers supplied, without reading too far ahead of the caller
+            while not exhausted and nsubmitted - nyielded < maxWorkers*WINDOW:
+                try:
+                    item = items.next()
+                except StopIteration:
+                    exhausted = True
+                    break
+                inqueue.put((nsubmitted,item))
+                nsubmitted += 1
+            if exhausted and nyielded == nsubmitted:
+                #all of the workers are idle now, so they can be shut down cleanly
+                for i in range(0,maxWorkers):
+                    inqueue.put(None)
+                for t in threads:
+                    t.join()
+                break
+            cond.acquire()
+            try:
+                while nyielded not in results:
+                    cond.wait(WAITSECS)
+                success,value = results.pop(nyielded)
+            finally:
+                cond.release()
+            nyielded += 1
+            if not success:
+                raise value[0],value[1],value[2]
+            yield value
+    finally:
+        #if the caller stops early (or an error occurs), let the workers finish what they're doing and exit
+        stopped.set()
+        for i in range(0,maxWorkers):
+            inqueue.put(None)
+
+class AIMDController(object):
+    """
+    Adaptive limit on the number of tasks (HTTP requests, usually) running at once, shared by any number of pools.
+
+    The limit grows additively - by one for every limit tasks that complete with a healthy latency - and is
+    cut multiplicatively when the server pushes back (throttling responses, timeouts) or when the recent
+    latency climbs well above its long-run level.  Over time the limit settles just below the level at
+    which the server starts to struggle, rising and falling with the load on the server.
+    """
+    def __init__(self,initial=MAXWORKERS,minLimit=1,maxLimit=MAXADAPTIVE,decrease=0.5,latencyFactor=LATENCYFACTOR):
+        """
+        Create an AIMDController.
+        @keyword initial: Starting limit.
+        @keyword minLimit: Smallest limit.
+        @keyword maxLimit: Largest limit.
+        @keyword decrease: Factor the limit is multiplied by when it is cut.
+        @keyword latencyFactor: Recent latency this many times the long-run latency is treated as congestion.
+        """
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.decrease = decrease
+        self.latencyFactor = latencyFactor
+        self.limit = float(min(max(initial,minLimit),maxLimit))
+        self._cond = threading.Condition()
+        self._active = 0
+        self._fast = None #quickly-moving average of latency
+        self._slow = None #slowly-moving average of latency
+        self._samples = 0
+        self._lastDecrease = 0.0
+        self._stats = {'increases':0,'decreases':0}
+
+    def acquire(self):
+        """
+        Wait until the number of running tasks is below the limit, and count one more.
+        """
+        self._cond.acquire()
+        try:
+            while self._active >= int(self.limit):
+                self._cond.wait(WAITSECS)
+            self._active += 1
+        finally:
+            self._cond.release()
+
+    def release(self):
+        """
+        Count one task fewer.
+        """
+        self._cond.acquire()
+        try:
+            self._active -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def wrap(self,func):
+        """
+        Return a version of a function that holds one of the controller's slots while it runs.
+        @param func: Function.
+        @return: Wrapped function.
+        """
+        def wrapped(*args,**kwargs):
+            self.acquire()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                self.release()
+        return wrapped
+
+    def onSuccess(self,latency):
+        """
+        Report a request that completed normally, growing the limit unless its latency shows congestion.
+        @param latency: Request latency in seconds.
+        """
+        self._cond.acquire()
+        try:
+            self._samples += 1
+            if self._fast is None:
+                self._fast = self._slow = latency
+            else:
+                self._fast += 0.25*(latency - self._fast)
+                self._slow += 0.02*(latency - self._slow)
+            if self._samples >= MINSAMPLES and self._fast > self.latencyFactor*self._slow:
+                self._decrease()
+                return
+            old = int(self.limit)
+            self.limit = min(float(self.maxLimit),self.limit + 1.0/self.limit)
+            if int(self.limit) > old:
+                self._stats['increases'] += 1
+                self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def onThrottle(self):
+        """
+        Report that the server pushed back (a 429 or 503 response, or a timeout), cutting the limit.
+        """
+        self._cond.acquire()
+        try:
+            self._decrease()
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        """
+        Return a dictionary of statistics.
+        @return: Dictionary with fields:
+                 - limit Current limit on the number of tasks running at once.
+                 - active Number of tasks running now.
+                 - increases Number of times the limit has grown.
+                 - decreases Number of times the limit has been cut.
+        """
+        self._cond.acquire()
+        try:
+            stats = self._stats.copy()
+            stats['limit'] = int(self.limit)
+            stats['active'] = self._active
+        finally:
+            self._cond.release()
+        return stats
+
+    def _decrease(self):
+        #a burst of failures from requests that were all sent at the old limit only cuts the limit once
+        now = time.time()
+        if now - self._lastDecrease < DECREASEINTERVAL:
+            return
+        self._lastDecrease = now
+        self.limit = max(float(self.minLimit),self.limit*self.decrease)
+        self._stats['decreases'] += 1
+
+class SingleFlight(object):
+    """
+    Collapse concurrent calls for the same key into one.
+
+    The first thread to ask for a key runs the function; any other thread asking for the same
+    key while that call is still in progress waits for it and gets the same result (or the same
+    exception) instead of repeating the work.  Once the call finishes the key is forgotten, so a
+    later request runs the function again - this coalesces work that is in flight, it is not a cache.
+    Results are shared between callers, and must not be modified.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} #key => [finished event,success,value]
+        self._stats = {'calls':0,'coalesced':0}
+
+    def do(self,key,func,*args):
+        """
+        Call func(*args), unless a call for the same key is already in progress.
+        @param key: Hashable key identifying the work (a canonical URL, say).
+        @param func: Function to call.
+        @return: Return value of func.
+        """
+        self._lock.acquire()
+        try:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = [threading.Event(),False,None]
+                self._calls[key] = call
+            else:
+                self._stats['coalesced'] += 1
+        finally:
+            self._lock.release()
+        if leader:
+            try:
+                call[1:] = [True,func(*args)]
+            except:
+                call[1:] = [False,sys.exc_info()]
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call[0].set()
+        else:
+            #wake up now and then, so that Ctrl-C gets through
+            while not call[0].wait(WAITSECS):
+                pass
+        event,success,value = call
+        if not success:
+            raise value[0],value[1],value[2]
+        return value
+
+    def stats(self):
+        """
+        Return a dictionary of statistics.
+        @return: Dictionary with fields:
+                 - calls Number of calls made.
+                 - coalesced Number of calls that shared the result of a call already in progress.
+                 - inflight Number of calls in progress now.
+        """
+        self._lock.acquire()
+        try:
+            stats = self._stats.copy()
+            stats['inflight'] = len(self._calls)
+        finally:
+            self._lock.release()
+        return stats
@@ -0,0 +1,652 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import httplib
+import urllib2
+import urllib
+import urlparse
+import threading
+import Queue
+import sys
+import socket
+import zlib
+import time
+import random
+import email.utils
+import base64
+from StringIO import StringIO
+
+#local imports
+import pool
+
+MAXPERHOST = 8 #maximum number of simultaneous connections to any one host
+MAXREDIRECTS = 5
+USERAGENT = 'libcomcat'
+REDIRECTS = [301,302,303,307,308]
+CHUNKSIZE = 64*1024 #number of compressed bytes read from the network at a time
+MAXRETRIES = 4 #number of times a failed request is tried again
+BACKOFF = 0.5 #seconds to wait before the first retry (doubled for each retry after that)
+MAXBACKOFF = 30.0 #longest wait (seconds) between retries, unless the server asks for more with Retry-After
+MAXRETRYAFTER = 300.0 #longest Retry-After (seconds) we are willing to honor
+RETRYCODES = [408,429,500,502,503,504] #HTTP status codes worth trying again
+THROTTLECODES = [429,503] #HTTP status codes telling us to slow down
+RATE = 20.0 #default maximum sustained number of requests per second, across all threads
+BURST = 20 #number of requests that can be made at once before the rate limit applies
+CONNECTTIMEOUT = 15.0 #seconds to wait for a connection to be established
+READTIMEOUT = 120.0 #seconds to wait for the server to send anything (response headers or the next part of the body)
+LATENCYWINDOW = 1000 #number of recent request latencies used to work out latency percentiles
+MINLATENCIES = 20 #number of latencies that must be seen before requests are hedged
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the rate of requests made by any number of threads.
+
+    The bucket holds up to burst tokens and refills at rate tokens per second.  Every request
+    takes one token, waiting for the bucket to refill if it is empty, so short bursts go out
+    immediately while the sustained rate never exceeds rate.
+    """
+    def __init__(self,rate=RATE,burst=BURST):
+        """
+        Create a RateLimiter.
+        @keyword rate: Maximum sustained number of requests per second (None for no limit).
+        @keyword burst: Maximum number of requests that can be made at once.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available.
+        @return: Number of seconds spent waiting.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """
+        Take a token from the bucket without waiting for it.
+
+        If the bucket is empty the token is borrowed from the future, and the caller must
+        wait the returned number of seconds before making its request.
+        @return: Number of seconds to wait before the token may be used.
+        """
+        if not self.rate:
+            return 0.0
+        self._lock.acquire()
+        try:
+            now = time.time()
+            self._tokens = min(float(self.burst),self._tokens + (now - self._last)*self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens/self.rate
+        finally:
+            self._lock.release()
+
+class LatencyTracker(object):
+    """
+    Window of the most recent request latencies (time from sending a request to receiving the response
+    headers), from which percentiles can be read.
+    """
+    def __init__(self,window=LATENCYWINDOW):
+        """
+        Create a LatencyTracker.
+        @keyword window: Number of recent latencies to keep.
+        """
+        self.window = window
+        self._latencies = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def record(self,seconds):
+        """
+        Add a latency.
+        @param seconds: Latency in seconds.
+        """
+        self._lock.acquire()
+        try:
+            if len(self._latencies) < self.window:
+                self._latencies.append(seconds)
+            else:
+                self._latencies[self._next] = seconds
+                self._next = (self._next + 1) % self.window
+        finally:
+            self._lock.release()
+
+    def getPercentile(self,percentile,minCount=MINLATENCIES):
+        """
+        Return a percentile of the recorded latencies.
+        @param percentile: Percentile (0-100).
+        @keyword minCount: Smallest number of latencies needed for the percentile to be meaningful.
+        @return: Latency in seconds, or None if fewer than minCount latencies have been recorded.
+        """
+        self._lock.acquire()
+        try:
+            if len(self._latencies) < max(minCount,1):
+                return None
+            latencies = sorted(self._latencies)
+        finally:
+            self._lock.release()
+        idx = int(round(percentile/100.0*(len(latencies)-1)))
+        return latencies[min(max(idx,0),len(latencies)-1)]
+
+class SessionResponse(object):
+    """
+    File-like wrapper around an HTTP response, which gives the underlying connection back to its
+    Session when it is closed.
+
+    Responses sent with gzip Content-Encoding are decompressed as they are read, a chunk at a time,
+    so callers always see the original document.
+    """
+    def __init__(self,session,key,conn,response,url):
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self._decoder = None
+        self._buffer = ''
+        encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        if encoding in ['gzip','x-gzip']:
+            #wbits of 16+MAX_WBITS tells zlib to expect a gzip header and trailer
+            self._decoder = zlib.decompressobj(16+zlib.MAX_WBITS)
+
+    def read(self,amt=None):
+        if self._response is None:
+            return ''
+        if self._decoder is None:
+            if amt is None:
+                data = self._response.read()
+            else:
+                data = self._response.read(amt)
+            self._session._count(len(data),len(data))
+            return data
+        #keep decompressing chunks until we have enough (or everything)
+        received = 0
+        while amt is None or len(self._buffer) < amt:
+            chunk = self._response.read(CHUNKSIZE)
+            if not chunk:
+                self._buffer += self._decoder.flush()
+                break
+            received += len(chunk)
+            self._buffer += self._decoder.decompress(chunk)
+        if amt is None:
+            data = self._buffer
+            self._buffer = ''
+        else:
+            data = self._buffer[0:amt]
+            self._buffer = self._buffer[amt:]
+        self._session._count(received,len(data))
+        return data
+
+    def readline(self):
+        #httplib responses have no usable readline(), so read one byte at a time
+        chars = []
+        while True:
+            char = self.read(1)
+            if not char:
+                break
+            chars.append(char)
+            if char == '\n':
+                break
+        return ''.join(chars)
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self._url
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        if self._response is None:
+            return
+        #a connection can only be re-used once its response has been completely consumed
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._session._release(self._key,self._conn,reusable)
+        self._response = None
+        self._conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+class Session(object):
+    """
+    Pool of persistent (keep-alive) HTTP connections, shared between threads.
+
+    Unless turned off, every request asks for gzip-compressed transfer (GeoJSON and QuakeML
+    compress very well), and compressed responses are decompressed transparently.
+
+    Requests that fail with a transient error (connection failures and timeouts, and status codes in
+    RETRYCODES) are retried after a randomized, exponentially growing wait, or the wait the server asks
+    for with a Retry-After header.  All requests go through a shared RateLimiter, so that adding threads
+    increases throughput only up to the rate the server is willing to accept.
+
+    Requests made with hedge=True (event details and content files) can be hedged: if the response
+    takes longer than a given percentile of the latencies seen so far, a duplicate request is sent,
+    and whichever response arrives first is used.  This trims the slow tail of a long run of requests
+    at the cost of a few extra ones.
+
+    The session's controller (a pool.AIMDController) hears about every response - its latency, or the
+    server asking us to slow down - and so can adapt how many detail and content requests libcomcat
+    makes at once (see comcat.getEventData(), comcat.getPhaseData() and comcat.getContents()).
+    """
+    def __init__(self,maxPerHost=MAXPERHOST,userAgent=USERAGENT,compress=True,
+                 maxRetries=MAXRETRIES,backoff=BACKOFF,maxBackoff=MAXBACKOFF,rate=RATE,burst=BURST,
+                 connectTimeout=CONNECTTIMEOUT,readTimeout=READTIMEOUT,hedgePercentile=None,controller=None,
+                 proxies=None):
+        """
+        Create a Session object.
+        @keyword maxPerHost: Maximum number of simultaneous connections to any one host.  Requests
+                 beyond this limit wait until a connection to that host is released.
+        @keyword userAgent: User-Agent header sent with every request.
+        @keyword compress: Boolean indicating whether to ask servers for gzip-compressed responses.
+        @keyword maxRetries: Number of times a request that fails with a transient error is tried again.
+        @keyword backoff: Seconds to wait before the first retry (doubled for each retry after that, and randomized).
+        @keyword maxBackoff: Longest wait (seconds) between retries, unless the server asks for more with Retry-After.
+        @keyword rate: Maximum sustained number of requests per second, across all threads (None for no limit).
+        @keyword burst: Maximum number of requests that can be made at once before the rate limit applies.
+        @keyword connectTimeout: Seconds to wait for a connection to be established (None to wait forever).
+        @keyword readTimeout: Seconds to wait for the server to send anything - the response headers, or the
+                 next part of the body (None to wait forever).
+        @keyword hedgePercentile: Percentile (95, say) of the latencies seen so far after which a hedged request
+                 is sent again, or None to never hedge.
+        @keyword controller: pool.AIMDController told about every response (a new one is created by default).
+        @keyword proxies: Dictionary of proxy URLs keyed by scheme ({'http':'http://proxy:3128'}), as taken by
+                 urllib2.ProxyHandler, or None to use the proxies set in the environment (http_proxy, https_proxy
+                 and no_proxy), as urllib2 does.  https requests are tunnelled through the proxy with CONNECT.
+        """
+        self.maxPerHost = maxPerHost
+        self.userAgent = userAgent
+        self.compress = compress
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.limiter = RateLimiter(rate=rate,burst=burst)
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.hedgePercentile = hedgePercentile
+        self.latency = LatencyTracker()
+        if controller is None:
+            controller = pool.AIMDController()
+        self.controller = controller
+        if proxies is None:
+            proxies = urllib.getproxies()
+        self.proxies = proxies
+        self._lock = threading.Lock()
+        self._idle = {} #(scheme,host,port) => list of idle connections
+        self._slots = {} #(scheme,host,port) => semaphore limiting active connections
+        self._stats = {'requests':0,'connections':0,'reused':0,'received':0,'decoded':0,
+                       'retries':0,'waited':0.0,'hedged':0,'hedgewins':0}
+
+    def get(self,url,headers=None,hedge=False):
+        """
+        Perform an HTTP GET request, re-using an idle connection to the same host if one is available.
+        @param url: URL to open.
+        @keyword headers: Dictionary of extra request headers.
+        @keyword hedge: Boolean indicating whether a duplicate request may be sent if this one is slow
+                        (only if the session has a hedgePercentile).  Only use this for idempotent requests.
+        @return: File-like SessionResponse object.  Callers must close() it to return the connection to the pool.
+        @raise urllib2.HTTPError: When the server returns an error status (after any retries).
+        @raise urllib2.URLError: When the server cannot be reached (after any retries).
+        """
+        if hedge and self.hedgePercentile is not None:
+            delay = self.latency.getPercentile(self.hedgePercentile)
+            if delay is not None:
+                return self._getHedged(url,headers,delay)
+        return self._getRetried(url,headers)
+
+    def _getHedged(self,url,headers,delay):
+        #send the request, and send it again if no response has arrived after delay seconds
+        results = Queue.Queue()
+        def attempt(hedged):
+            try:
+                results.put((True,hedged,self._getRetried(url,headers)))
+            except:
+                results.put((False,hedged,sys.exc_info()))
+        def start(hedged):
+            t = threading.Thread(target=attempt,args=(hedged,))
+            t.daemon = True
+            t.start()
+        start(False)
+        nstarted = 1
+        try:
+            result = results.get(True,delay)
+        except Queue.Empty:
+            self._lock.acquire()
+            try:
+                self._stats['hedged'] += 1
+            finally:
+                self._lock.release()
+            start(True)
+            nstarted = 2
+            result = results.get()
+            #if the first one back failed, the other may still succeed
+            if not result[0]:
+                result = results.get()
+                nstarted = 1
+        success,hedged,value = result
+        #whichever request loses is closed whenever it finishes
+        def discard(count):
+            for i in range(0,count):
+                ok,h,response = results.get()
+                if ok:
+                    response.close()
+        if nstarted == 2:
+            t = threading.Thread(target=discard,args=(1,))
+            t.daemon = True
+            t.start()
+        if not success:
+            raise value[0],value[1],value[2]
+        if hedged:
+            self._lock.acquire()
+            try:
+                self._stats['hedgewins'] += 1
+            finally:
+                self._lock.release()
+        return value
+
+    def _getRetried(self,url,headers):
+        attempt = 0
+        while True:
+            try:
+                return self._get(url,headers)
+            except urllib2.HTTPError,error:
+                if error.code not in RETRYCODES or attempt >= self.maxRetries:
+                    raise
+                delay = self._getDelay(attempt,error.info())
+            except urllib2.URLError,error:
+                if isinstance(error.reason,socket.timeout):
+                    self.controller.onThrottle()
+                if attempt >= self.maxRetries:
+                    raise
+                delay = self._getDelay(attempt,None)
+            self._lock.acquire()
+            try:
+                self._stats['retries'] += 1
+            finally:
+                self._lock.release()
+            time.sleep(delay)
+            attempt += 1
+
+    def _get(self,url,headers):
+        #one attempt at a request, following any redirects
+        for i in range(0,MAXREDIRECTS+1):
+            response = self._request(url,headers)
+            if response.code not in REDIRECTS:
+                break
+            location = response.info().getheader('Location')
+            response.read()
+            response.close()
+            if location is None:
+                raise urllib2.HTTPError(url,response.code,'Redirect with no location',response.info(),None)
+            url = urlparse.urljoin(url,location)
+        else:
+            raise urllib2.HTTPError(url,response.code,'Too many redirects',response.info(),None)
+        if response.code >= 400:
+            data = response.read()
+            response.close()
+            raise urllib2.HTTPError(url,response.code,response.msg,response.info(),StringIO(data))
+        return response
+
+    def stats(self):
+        """
+        Return a dictionary of connection statistics.
+        @return: Dictionary with fields:
+                 - requests Number of HTTP requests made.
+                 - connections Number of new connections opened.
+                 - reused Number of requests that re-used an existing connection.
+                 - idle Number of idle connections currently held in the pool.
+                 - received Number of response body bytes read from the network.
+                 - decoded Number of response body bytes after decompression.
+                 - saved Number of bytes compression kept off the network (decoded - received).
+                 - retries Number of requests tried again after a transient error.
+                 - waited Total seconds requests spent waiting for the rate limiter.
+                 - hedged Number of duplicate requests sent because the first was slow.
+                 - hedgewins Number of times the duplicate request answered first.
+                 - latency The median latency (seconds to the response headers) of recent requests, or None.
+                 - concurrency The controller's current limit on the number of detail and content requests at once.
+        """
+        self._lock.acquire()
+        try:
+            stats = self._stats.copy()
+            stats['idle'] = sum([len(conns) for conns in self._idle.values()])
+            stats['saved'] = stats['decoded'] - stats['received']
+        finally:
+            self._lock.release()
+        stats['latency'] = self.latency.getPercentile(50,minCount=1)
+        stats['concurrency'] = self.controller.stats()['limit']
+        return stats
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        self._lock.acquire()
+        try:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+    def _getDelay(self,attempt,headers):
+        return getRetryDelay(attempt,headers,backoff=self.backoff,maxBackoff=self.maxBackoff)
+
+    def _request(self,url,headers):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ['http','https']:
+            raise urllib2.URLError('Unsupported URL scheme "%s"' % parts.scheme)
+        port = parts.port
+        if port is None:
+            port = {'http':80,'https':443}[scheme]
+        key = (scheme,parts.hostname,port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        reqheaders = {'User-Agent':self.userAgent}
+        proxy = self._getProxy(scheme,parts.hostname)
+        if proxy is not None and scheme == 'http':
+            #plain http goes to the proxy, asking for the whole URL
+            path = urlparse.urlunsplit((scheme,parts.netloc,parts.path or '/',parts.query,''))
+            if proxy[2] is not None:
+                reqheaders['Proxy-Authorization'] = proxy[2]
+        if self.compress:
+            reqheaders['Accept-Encoding'] = 'gzip'
+        if headers is not None:
+            reqheaders.update(headers)
+
+        waited = self.limiter.acquire()
+        if waited:
+            self._lock.acquire()
+            try:
+                self._stats['waited'] += waited
+            finally:
+                self._lock.release()
+        self._getSlot(key).acquire()
+        try:
+            #an idle connection may have been dropped by the server since we last used it,
+            #so if a re-used connection fails, try once more on a brand new one.
+            while True:
+                conn,reused = self._getConnection(key,proxy)
+                try:
+                    start = time.time()
+                    if conn.sock is None:
+                        #connect with one timeout, then wait for data with another
+                        conn.connect()
+                        conn.sock.settimeout(self.readTimeout)
+                    conn.request('GET',path,headers=reqheaders)
+                    response = conn.getresponse()
+                    latency = time.time() - start
+                    self.latency.record(latency)
+                    if response.status in THROTTLECODES:
+                        self.controller.onThrottle()
+                    else:
+                        self.controller.onSuccess(latency)
+                    break
+                except (httplib.HTTPException,socket.error),msg:
+                    conn.close()
+                    if not reused:
+                        raise urllib2.URLError(msg)
+        except:
+            self._getSlot(key).release()
+            raise
+        self._lock.acquire()
+        try:
+            self._stats['requests'] += 1
+            if reused:
+                self._stats['reused'] += 1
+        finally:
+            self._lock.release()
+        return SessionResponse(self,key,conn,response,url)
+
+    def _count(self,received,decoded):
+        self._lock.acquire()
+        try:
+            self._stats['received'] += received
+            self._stats['decoded'] += decoded
+        finally:
+            self._lock.release()
+
+    def _getSlot(self,key):
+        self._lock.acquire()
+        try:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.maxPerHost)
+            return self._slots[key]
+        finally:
+            self._lock.release()
+
+    def _getProxy(self,scheme,host):
+        #return (host,port,Proxy-Authorization header or None) of the proxy to use for a host, or None
+        proxyurl = self.proxies.get(scheme)
+        if not proxyurl or urllib.proxy_bypass(host):
+            return None
+        if '://' not in proxyurl:
+            proxyurl = 'http://' + proxyurl
+        parts = urlparse.urlsplit(proxyurl)
+        auth = None
+        if parts.username is not None:
+            userpass = '%s:%s' % (urllib.unquote(parts.username),urllib.unquote(parts.password or ''))
+            auth = 'Basic ' + base64.b64encode(userpass)
+        return (parts.hostname,parts.port or 80,auth)
+
+    def _getConnection(self,key,proxy=None):
+        self._lock.acquire()
+        try:
+            conns = self._idle.get(key,[])
+            if len(conns):
+                return (conns.pop(),True)
+            self._stats['connections'] += 1
+        finally:
+            self._lock.release()
+        scheme,host,port = key
+        if proxy is not None:
+            #connections are still pooled by destination, since each one is tied to it (by CONNECT for https)
+            proxyhost,proxyport,auth = proxy
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(proxyhost,proxyport,timeout=self.connectTimeout)
+                tunnelheaders = {}
+                if auth is not None:
+                    tunnelheaders['Proxy-Authorization'] = auth
+                conn.set_tunnel(host,port,tunnelheaders)
+            else:
+                conn = httplib.HTTPConnection(proxyhost,proxyport,timeout=self.connectTimeout)
+        elif scheme == 'https':
+            conn = httplib.HTTPSConnection(host,port,timeout=self.connectTimeout)
+        else:
+            conn = httplib.HTTPConnection(host,port,timeout=self.connectTimeout)
+        return (conn,False)
+
+    def _release(self,key,conn,reusable):
+        self._lock.acquire()
+        try:
+            if reusable:
+                self._idle.setdefault(key,[]).append(conn)
+            else:
+                conn.close()
+        finally:
+            self._lock.release()
+        self._getSlot(key).release()
+
+def getCanonicalURL(url):
+    """
+    Return a canonical form of a URL, so that different spellings of the same request compare equal.
+
+    The scheme and host are lower-cased, default ports and fragments are dropped, and the query
+    parameters are sorted.
+    @param url: URL.
+    @return: Canonical URL.
+    """
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != {'http':80,'https':443}.get(scheme):
+        netloc += ':%i' % parts.port
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query,keep_blank_values=True)))
+    return urlparse.urlunsplit((scheme,netloc,parts.path or '/',query,''))
+
+def getRetryDelay(attempt,headers=None,backoff=BACKOFF,maxBackoff=MAXBACKOFF):
+    """
+    Return the number of seconds to wait before trying a failed request again.
+    @param attempt: Number of retries already made (0 for the first retry).
+    @keyword headers: mimetools.Message headers of the failed response (for Retry-After), or None.
+    @keyword backoff: Seconds to wait before the first retry (doubled for each retry after that, and randomized).
+    @keyword maxBackoff: Longest wait (seconds) between retries, unless the server asks for more with Retry-After.
+    @return: Seconds to wait.
+    """
+    #honor the server's Retry-After (seconds, or an HTTP date) if it sent one
+    if headers is not None and headers.getheader('Retry-After') is not None:
+        retryafter = headers.getheader('Retry-After').strip()
+        delay = None
+        if retryafter.isdigit():
+            delay = float(retryafter)
+        else:
+            date = email.utils.parsedate_tz(retryafter)
+            if date is not None:
+                delay = email.utils.mktime_tz(date) - time.time()
+        if delay is not None:
+            return min(max(delay,0.0),MAXRETRYAFTER)
+    #"full jitter" - a random wait up to the exponential backoff, so that threads don't retry in lockstep
+    return random.uniform(0,min(maxBackoff,backoff*2**attempt))
+
+SESSION = Session()
+
+def getSession():
+    """
+    Return the Session shared by all of the functions in libcomcat.
+    @return: Session object.
+    """
+    return SESSION
+
+def setSession(sess):
+    """
+    Set the Session shared by all of the functions in libcomcat (to change the number of retries, the rate limit, etc.).
+    @param sess: Session object.
+    """
+    global SESSION
+    SESSION = sess
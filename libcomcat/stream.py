@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import json
+import re
+import urlparse
+from json.decoder import scanstring
+from xml.etree import cElementTree
+
+CHUNKSIZE = 64*1024 #number of bytes to read from the network at a time
+WHITESPACE = ' \t\n\r'
+STRINGPATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"') #a complete JSON string
+#anything up to the next brace or bracket outside a string, along with any objects or arrays nested no more than
+#FILLERDEPTH deep (runs of other characters are matched whole, so the regular expression can't backtrack exponentially)
+FILLERDEPTH = 3
+FILLERATOM = r'[^"{}\[\]]+(?![^"{}\[\]])|"[^"\\]*(?:\\.[^"\\]*)*"'
+FILLER = '(?:%s)*' % FILLERATOM
+for i in range(0,FILLERDEPTH):
+    FILLER = r'(?:%s|\{%s\}|\[%s\])*' % (FILLERATOM,FILLER,FILLER)
+FILLERPATTERN = re.compile(FILLER)
+SCALARPATTERN = re.compile(r'[^,:{}\[\]\s]+') #a JSON number, true, false or null
+SPACEPATTERN = re.compile(r'\s*')
+
+class FeatureReader(object):
+    """
+    Incremental reader for GeoJSON FeatureCollection documents (like the ComCat search feed).
+
+    Features are decoded and yielded one at a time as the document is read from a file-like
+    object, so only one feature (plus a chunk of unparsed text) is held in memory at once, and
+    processing of early features can proceed while later ones are still being downloaded.
+    Top level members other than "features" (i.e., "metadata") are stored in the members dictionary
+    as they are encountered.
+    """
+    def __init__(self,fh,chunksize=CHUNKSIZE):
+        """
+        Create a FeatureReader object.
+        @param fh: File-like object (i.e., from comcat.getURLHandle()) containing a GeoJSON FeatureCollection.
+        @keyword chunksize: Number of bytes to read from fh at a time.
+        """
+        self.members = {}
+        self._fh = fh
+        self._chunksize = chunksize
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+
+    @property
+    def metadata(self):
+        """
+        Return the FeatureCollection metadata dictionary (empty if it has not been read yet).
+        """
+        return self.members.get('metadata',{})
+
+    def __iter__(self):
+        if self._started:
+            raise ValueError('FeatureReader objects can only be iterated over once.')
+        self._started = True
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            if key == 'features':
+                for feature in self._iterArray():
+                    yield feature
+            else:
+                self.members[key] = self._decode()
+            char = self._next()
+            if char == '}':
+                break
+            if char != ',':
+                raise ValueError('Expected "," or "}" in FeatureCollection, found "%s".' % char)
+
+    def _iterArray(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            char = self._next()
+            if char == ']':
+                break
+            if char != ',':
+                raise ValueError('Expected "," or "]" in features array, found "%s".' % char)
+
+    def _fill(self):
+        #read another chunk, discarding the part of the buffer we've already parsed
+        if self._eof:
+            return False
+        chunk = self._fh.read(self._chunksize)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _skip(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def _peek(self):
+        self._skip()
+        if self._pos >= len(self._buffer):
+            raise ValueError('Unexpected end of GeoJSON document.')
+        return self._buffer[self._pos]
+
+    def _next(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self,expected):
+        char = self._next()
+        if char != expected:
+            raise ValueError('Expected "%s" in GeoJSON document, found "%s".' % (expected,char))
+
+    def _decode(self):
+        #decode one complete JSON value, reading more data until one is available
+        self._skip()
+        while True:
+            try:
+                value,end = self._decoder.raw_decode(self._buffer,self._pos)
+                #a number at the very end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            if not self._fill():
+                value,self._pos = self._decoder.raw_decode(self._buffer,self._pos)
+                return value
+
+class MagnitudeReader(object):
+    """
+    Incremental reader for the magnitudes in a QuakeML document (like a ComCat search with format=quakeml).
+
+    The document is parsed as it is read from a file-like object, and each event's magnitudes are
+    yielded as soon as the event element is complete, after which the element is discarded, so
+    only one event is held in memory at once, however many events the document contains.
+    """
+    def __init__(self,fh):
+        """
+        Create a MagnitudeReader object.
+        @param fh: File-like object (i.e., from comcat.getURLHandle()) containing a QuakeML document.
+        """
+        self._fh = fh
+        self._started = False
+
+    def __iter__(self):
+        """
+        Yield a tuple of (event id,list of magnitudes,list of magnitude types,list of magnitude sources) for each event.
+        """
+        if self._started:
+            raise ValueError('MagnitudeReader objects can only be iterated over once.')
+        self._started = True
+        parent = None
+        for action,element in cElementTree.iterparse(self._fh,events=('start','end')):
+            tag = _getLocalName(element.tag)
+            if action == 'start':
+                if tag == 'eventParameters':
+                    parent = element
+                continue
+            if tag != 'event':
+                continue
+            mags = []
+            magtypes = []
+            magsources = []
+            for child in element:
+                if _getLocalName(child.tag) != 'magnitude':
+                    continue
+                magval,magtype,magsrc = _getMagnitude(child)
+                if magval is None:
+                    continue
+                mags.append(magval)
+                magtypes.append(magtype)
+                magsources.append(magsrc)
+            eventid = _getEventID(element.attrib)
+            element.clear()
+            if parent is not None:
+                parent.remove(element)
+            yield (eventid,mags,magtypes,magsources)
+
+def _getLocalName(name):
+    #strip the {namespace} from an element tag or attribute name
+    return name.split('}')[-1]
+
+def _getChild(element,path):
+    for name in path:
+        if element is None:
+            return None
+        found = None
+        for child in element:
+            if _getLocalName(child.tag) == name:
+                found = child
+                break
+        element = found
+    return element
+
+def _getMagnitude(element):
+    value = _getChild(element,['mag','value'])
+    if value is None or value.text is None:
+        return (None,None,None)
+    magtype = _getChild(element,['type'])
+    if magtype is None or magtype.text is None:
+        magtype = 'NA'
+    else:
+        magtype = magtype.text
+    magsrc = _getChild(element,['creationInfo','agencyID'])
+    if magsrc is None or magsrc.text is None:
+        magsrc = 'NA'
+    else:
+        magsrc = magsrc.text
+    return (float(value.text),magtype,magsrc)
+
+def _getEventID(attrib):
+    #ComCat puts the event source and code in catalog:eventsource and catalog:eventid attributes,
+    #which make up the event id used in the GeoJSON feeds
+    attrs = dict([(_getLocalName(key),value) for key,value in attrib.items()])
+    if attrs.has_key('eventsource') and attrs.has_key('eventid'):
+        return attrs['eventsource'] + attrs['eventid']
+    publicid = attrs.get('publicID','')
+    query = urlparse.parse_qs(urlparse.urlparse(publicid).query)
+    if query.has_key('eventid'):
+        return query['eventid'][0]
+    return publicid.split('/')[-1]
+
+def extractPaths(data,paths):
+    """
+    Decode only the parts of a JSON document found at a set of key paths.
+
+    Everything outside those paths is scanned over without being decoded, so a few small members
+    can be read out of a large document (like the products of interest from an event detail
+    document with hundreds of products) without the time and memory it takes to decode all of it.
+    @param data: String containing a JSON document whose top level is an object.
+    @param paths: Sequence of key paths, each a sequence of object member names (i.e.,
+                  ('properties','products','moment-tensor')).
+    @return: Dictionary holding the (fully decoded) value at each path found in the document, inside
+             the objects leading to it.  Objects along a path are present even if nothing under
+             them was wanted, other members are left out.
+    """
+    paths = set([tuple(path) for path in paths])
+    prefixes = set([path[0:i] for path in paths for i in range(0,len(path))])
+    pos = SPACEPATTERN.match(data).end()
+    if data[pos:pos+1] != '{':
+        raise ValueError('Expected "{" at the start of JSON document.')
+    value,pos = _extractObject(data,pos,(),paths,prefixes)
+    return value
+
+def _extractObject(data,pos,path,paths,prefixes):
+    #pos is at the opening brace of an object on one of the key paths
+    decoder = json.JSONDecoder()
+    obj = {}
+    pos = SPACEPATTERN.match(data,pos+1).end()
+    if data[pos:pos+1] == '}':
+        return (obj,pos+1)
+    while True:
+        pos = SPACEPATTERN.match(data,pos).end()
+        if data[pos:pos+1] != '"':
+            raise ValueError('Expected object member name at position %i of JSON document.' % pos)
+        key,pos = scanstring(data,pos+1)
+        pos = SPACEPATTERN.match(data,pos).end()
+        if data[pos:pos+1] != ':':
+            raise ValueError('Expected ":" at position %i of JSON document.' % pos)
+        pos = SPACEPATTERN.match(data,pos+1).end()
+        keypath = path + (key,)
+        if keypath in paths:
+            obj[key],pos = decoder.raw_decode(data,pos)
+        elif keypath in prefixes and data[pos:pos+1] == '{':
+            obj[key],pos = _extractObject(data,pos,keypath,paths,prefixes)
+        else:
+            pos = _skipValue(data,pos)
+        pos = SPACEPATTERN.match(data,pos).end()
+        char = data[pos:pos+1]
+        pos += 1
+        if char == '}':
+            return (obj,pos)
+        if char != ',':
+            raise ValueError('Expected "," or "}" at position %i of JSON document.' % (pos-1))
+
+def _skipValue(data,pos):
+    #return the position just past the JSON value starting at pos, without decoding it
+    char = data[pos:pos+1]
+    if char == '"':
+        match = STRINGPATTERN.match(data,pos)
+        if match is None:
+            raise ValueError('Unterminated string at position %i of JSON document.' % pos)
+        return match.end()
+    if char not in ('{','['):
+        match = SCALARPATTERN.match(data,pos)
+        if match is None:
+            raise ValueError('Expected JSON value at position %i of JSON document.' % pos)
+        return match.end()
+    depth = 0
+    while True:
+        char = data[pos:pos+1]
+        if char in ('{','['):
+            depth += 1
+        elif char in ('}',']'):
+            depth -= 1
+            if depth == 0:
+                return pos+1
+        else:
+            raise ValueError('Unexpected end of JSON document.')
+        pos = FILLERPATTERN.match(data,pos+1).end()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import re
+import calendar
+from collections import OrderedDict
+
+#third party imports
+import numpy
+
+CAPACITY = 16 #initial number of rows allocated in a new table (doubled as rows are added)
+BATCHSIZE = 1000 #number of rows formatted and written at a time by TableWriter
+FLOATTYPE = 'f8'
+STRINGTYPE = 'O' #python strings, since numpy's fixed width strings would silently truncate long ids or sources
+TIMETYPE = 'M8[ms]'
+#column types for fields which aren't simply floats or strings
+COLUMNTYPES = {'id':STRINGTYPE,
+               'time':TIMETYPE,
+               'event-type':STRINGTYPE,
+               'type':STRINGTYPE}
+MAGPATTERN = re.compile(r'^mag(\d+)(-source|-type)?$')
+MAGTYPES = {None:FLOATTYPE,'-source':STRINGTYPE,'-type':STRINGTYPE}
+
+def getColumnType(name,fmt):
+    """
+    Return the numpy type used to store a column of event data.
+    @param name: Column name (i.e., 'lat', 'mag2-type').
+    @param fmt: Format string for the column (i.e., '%.4f').
+    @return: numpy type string.
+    """
+    if name in COLUMNTYPES:
+        return COLUMNTYPES[name]
+    match = MAGPATTERN.match(name)
+    if match is not None:
+        return MAGTYPES[match.group(2)]
+    if fmt == '%s':
+        return STRINGTYPE
+    return FLOATTYPE
+
+class EventTable(object):
+    """
+    Columnar table of event data, stored as a numpy structured array.
+
+    The schema (column names, numpy types and format strings) is held once for the whole table,
+    rather than once per event.  Columns are accessed by name (table['mag'] returns a numpy array),
+    and rows can be selected with integers, slices, index arrays or boolean masks
+    (table[table['mag'] > 5.0] returns a new EventTable).  Times are stored as numpy datetime64
+    values (milliseconds), missing numbers as NaN and missing strings as 'NA'.
+    """
+    def __init__(self,columns,data=None):
+        """
+        Create an EventTable.
+        @param columns: Sequence of (name,fmt) tuples describing the columns, in order.
+        @keyword data: numpy structured array holding the rows (with a field for each column), or None for an empty table.
+        """
+        self.columns = OrderedDict(columns)
+        self._dtype = numpy.dtype([(name,getColumnType(name,fmt)) for name,fmt in self.columns.iteritems()])
+        if data is None:
+            self._data = self._allocate(CAPACITY)
+            self._nrows = 0
+        else:
+            self._data = data.astype(self._dtype)
+            self._nrows = len(data)
+
+    @classmethod
+    def fromEvents(cls,events):
+        """
+        Create an EventTable from a sequence of event dictionaries.
+        @param events: Sequence of event OrderedDicts, as returned by comcat.getEventData() or comcat.iterEventData().
+        @return: EventTable, which will be empty (with no columns) if there are no events.
+        """
+        table = None
+        for event in events:
+            if table is None:
+                table = cls([(key,value[1]) for key,value in event.iteritems()])
+            table.append(event)
+        if table is None:
+            table = cls([])
+        return table
+
+    @property
+    def names(self):
+        """
+        Return the list of column names.
+        """
+        return self.columns.keys()
+
+    @property
+    def data(self):
+        """
+        Return the numpy structured array holding the rows of the table.
+        """
+        return self._data[0:self._nrows]
+
+    def getMagnitudeCount(self):
+        """
+        Return the number of magnitude columns (mag1, mag2, etc.) in the table.
+        @return: Number of magnitude columns.
+        """
+        nmags = 0
+        while 'mag%i' % (nmags+1) in self.columns:
+            nmags += 1
+        return nmags
+
+    def getFormat(self,name):
+        """
+        Return the format string for a column.
+        @param name: Column name.
+        @return: Format string (i.e., '%.4f').
+        """
+        return self.columns[name]
+
+    def __len__(self):
+        return self._nrows
+
+    def __getstate__(self):
+        #only pickle the rows in use, not the spare capacity
+        state = self.__dict__.copy()
+        state['_data'] = self._data[0:self._nrows].copy()
+        return state
+
+    def __getitem__(self,key):
+        if isinstance(key,basestring):
+            return self._data[key][0:self._nrows]
+        rows = self._data[0:self._nrows][key]
+        if isinstance(rows,numpy.void):
+            rows = numpy.array([rows],dtype=self._dtype)
+        return EventTable(self.columns.items(),rows)
+
+    def append(self,event):
+        """
+        Add an event to the end of the table.
+
+        Any fields of the event without a matching column (usually magnitudes beyond the number
+        already in the table) are added as new columns.
+        @param event: Event OrderedDict, as returned by comcat.getEventData() or comcat.iterEventData().
+        """
+        newcolumns = [key for key in event.iterkeys() if key not in self.columns]
+        if len(newcolumns):
+            self._addColumns(event,newcolumns)
+        if self._nrows == len(self._data):
+            self._resize(max(2*len(self._data),CAPACITY))
+        row = self._data[self._nrows]
+        for key,(value,fmt) in event.iteritems():
+            row[key] = self._convert(key,value)
+        self._nrows += 1
+
+    def extend(self,table):
+        """
+        Add the rows of another EventTable to the end of this one.
+        @param table: EventTable object.
+        """
+        newcolumns = [name for name in table.names if name not in self.columns]
+        if len(newcolumns):
+            self._addColumns(table.columns,newcolumns)
+        if self._nrows + len(table) > len(self._data):
+            self._resize(max(2*len(self._data),self._nrows + len(table)))
+        for name in table.names:
+            self._data[name][self._nrows:self._nrows+len(table)] = table[name]
+        self._nrows += len(table)
+
+    def getEvent(self,index):
+        """
+        Return one row of the table as an event dictionary.
+        @param index: Row number.
+        @return: Event OrderedDict, as returned by comcat.getEventData().
+        """
+        #this import is deferred because comcat imports this module
+        import comcat
+        row = self._data[0:self._nrows][index]
+        event = OrderedDict()
+        for name,fmt in self.columns.iteritems():
+            value = row[name]
+            if name == 'time':
+                value = comcat.getUTCTimeStamp(value.astype('int64'))
+            elif isinstance(value,numpy.floating):
+                value = float(value)
+            else:
+                value = str(value)
+            event[name] = [value,fmt]
+        return event
+
+    def _allocate(self,nrows):
+        data = numpy.zeros(nrows,dtype=self._dtype)
+        for name in self._dtype.names:
+            data[name] = self._getMissing(self._dtype.fields[name][0])
+        return data
+
+    def _getMissing(self,dtype):
+        if dtype.kind == 'f':
+            return numpy.nan
+        if dtype.kind == 'M':
+            return numpy.datetime64('NaT')
+        return 'NA'
+
+    def _resize(self,nrows):
+        data = self._allocate(nrows)
+        data[0:self._nrows] = self._data[0:self._nrows]
+        self._data = data
+
+    def _addColumns(self,source,newcolumns):
+        #insert each new column after the column that precedes it in the source (so mag3 goes after mag2-type)
+        keys = list(source.keys())
+        columns = self.columns.items()
+        names = [name for name,fmt in columns]
+        for name in newcolumns:
+            fmt = source[name]
+            if isinstance(fmt,list):
+                fmt = fmt[1]
+            idx = keys.index(name)
+            if idx == 0 or keys[idx-1] not in names:
+                pos = len(columns)
+            else:
+                pos = names.index(keys[idx-1]) + 1
+            columns.insert(pos,(name,fmt))
+            names.insert(pos,name)
+        olddata = self._data
+        self.columns = OrderedDict(columns)
+        self._dtype = numpy.dtype([(name,getColumnType(name,fmt)) for name,fmt in columns])
+        self._data = self._allocate(len(olddata))
+        for name in olddata.dtype.names:
+            self._data[name] = olddata[name]
+
+    def _convert(self,key,value):
+        if key == 'time':
+            #input times are ShakeDateTime objects, which can be before 1900
+            msecs = calendar.timegm(value.timetuple())*1000 + value.microsecond//1000
+            return numpy.datetime64(msecs,'ms')
+        if isinstance(value,unicode):
+            return value.encode('utf-8')
+        if value is None:
+            return self._getMissing(self._dtype.fields[key][0])
+        return value
+
+class TableWriter(object):
+    """
+    Writer of EventTables as delimited (csv, tab, etc.) text.
+
+    The output schema (including the number of magnitude columns) is fixed when the writer is
+    created, and compiled into a single format string, so that every table written afterwards is
+    formatted a batch of rows at a time.  Tables with fewer magnitude columns are padded with
+    missing values, and tables with more have the extra magnitudes dropped.
+    """
+    def __init__(self,fh,columns,maxmags=0,sep=',',batchsize=BATCHSIZE):
+        """
+        Create a TableWriter.
+        @param fh: File-like object to write to.
+        @param columns: Sequence of (name,fmt) tuples (i.e., EventTable.columns.items()) describing the
+                        columns to write.  Any magnitude columns are ignored in favor of maxmags.
+        @keyword maxmags: Number of (mag,source,type) magnitude column groups to write.
+        @keyword sep: Column separator.
+        @keyword batchsize: Number of rows formatted and written at a time.
+        """
+        self.fh = fh
+        self.sep = sep
+        self.batchsize = batchsize
+        schema = []
+        magpos = None
+        for name,fmt in columns:
+            if MAGPATTERN.match(name) is not None:
+                continue
+            schema.append((name,fmt))
+            if name == 'event-type':
+                magpos = len(schema)
+        if magpos is None:
+            magpos = len(schema)
+        magcolumns = []
+        for i in range(1,maxmags+1):
+            magcolumns += [('mag%i' % i,'%.1f'),('mag%i-source' % i,'%s'),('mag%i-type' % i,'%s')]
+        self.schema = schema[0:magpos] + magcolumns + schema[magpos:]
+        self._fmt = sep.join([fmt for name,fmt in self.schema]) + '\n'
+
+    def writeHeader(self):
+        """
+        Write the row of column names.
+        """
+        self.fh.write(self.sep.join([name for name,fmt in self.schema]) + '\n')
+
+    def write(self,table):
+        """
+        Write the rows of an EventTable.
+        @param table: EventTable object.
+        """
+        nrows = len(table)
+        columns = []
+        for name,fmt in self.schema:
+            if name not in table.columns:
+                columns.append([self._getMissing(name,fmt)]*nrows)
+            elif name == 'time':
+                columns.append(numpy.datetime_as_string(table[name],unit='ms').tolist())
+            else:
+                columns.append(table[name].tolist())
+        fmt = self._fmt
+        rows = zip(*columns)
+        for i in range(0,nrows,self.batchsize):
+            self.fh.write(''.join([fmt % row for row in rows[i:i+self.batchsize]]))
+
+    def _getMissing(self,name,fmt):
+        if getColumnType(name,fmt) == FLOATTYPE:
+            return numpy.nan
+        return 'NA'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+#stdlib
+import argparse
+import sys
+
+#third party
+from libcomcat import comcat
+from libcomcat.mirror import Mirror
+
+TIMEFMT1 = '%Y-%m-%dT%H:%M:%S'
+TIMEFMT2 = '%Y-%m-%dT%H:%M:%S.%f'
+DATEFMT = '%Y-%m-%d'
+
+def maketime(timestring):
+    outtime = None
+    try:
+        outtime = comcat.ShakeDateTime.strptime(timestring,TIMEFMT1)
+    except:
+        try:
+            outtime = comcat.ShakeDateTime.strptime(timestring,TIMEFMT2)
+        except:
+            try:
+                outtime = comcat.ShakeDateTime.strptime(timestring,DATEFMT)
+            except:
+                raise Exception,'Could not parse time or date from %s' % timestring
+    return outtime
+
+def main(args):
+    mirror = Mirror(args.folder)
+    if mirror.isPartial() and not args.reload:
+        print 'Loading of the mirror in %s did not finish.  Use -z (with the search options) to load it again.' % args.folder
+        sys.exit(1)
+    if mirror.isLoaded() and not args.reload:
+        nchanged,nremoved = mirror.sync(maxWorkers=args.maxWorkers,maxSegments=args.maxSegments,
+                                        verbose=args.verbose)
+        sys.stderr.write('%i events added or changed, %i removed.  Mirror now holds %i events.\n' % (nchanged,nremoved,
+                                                                                                      mirror.getCount()))
+    else:
+        nevents = mirror.load(starttime=args.startTime,endtime=args.endTime,bounds=args.bounds,radius=args.radius,
+                              magrange=args.magRange,catalog=args.catalog,contributor=args.contributor,
+                              getComponents=args.getComponents,getAngles=args.getAngles,getAllMags=args.getAllMags,
+                              limitType=args.limitType,devServer=args.debug,maxWorkers=args.maxWorkers,
+                              maxSegments=args.maxSegments,verbose=args.verbose)
+        sys.stderr.write('Mirror loaded with %i events.\n' % nevents)
+    mirror.close()
+
+if __name__ == '__main__':
+    desc = '''Keep a local copy of the ComCat events matching a search.
+
+    The first time this is run for a given directory, every event matching the search is downloaded into
+    a database in that directory.  To mirror all events of magnitude 4 and above since 2000, with moment tensor
+    components and focal mechanism angles:
+
+    syncmirror.py mymirror -s 2000-01-01 -m 4.0 10.0 -o -a
+
+    Every later run with the same directory (no other options are needed) downloads only the events which
+    were added, changed or deleted in ComCat since the previous run:
+
+    syncmirror.py mymirror
+
+    If no end time is given, new events are added to the mirror as they occur.  Use -z to discard the mirror
+    and load it again (with new search options, if desired).
+    '''
+    parser = argparse.ArgumentParser(description=desc,formatter_class=argparse.RawDescriptionHelpFormatter)
+    #positional arguments
+    parser.add_argument('folder',
+                        help='Directory holding the mirror (created if necessary)')
+    #optional arguments
+    parser.add_argument('-b','--bounds', metavar=('lonmin','lonmax','latmin','latmax'),
+                        dest='bounds', type=float, nargs=4,
+                        help='Bounds to constrain event search [lonmin lonmax latmin latmax]')
+    parser.add_argument('-r','--radius', dest='radius', metavar=('lat','lon','rmax'),type=float,
+                        nargs=3,help='Search radius in KM (use instead of bounding box)')
+    parser.add_argument('-s','--start-time', dest='startTime', type=maketime,
+                        help='Start time for mirror (defaults to 1900-01-01).  YYYY-mm-dd, YYYY-mm-ddTHH:MM:SS, or YYYY-mm-ddTHH:MM:SS.s')
+    parser.add_argument('-e','--end-time', dest='endTime', type=maketime,
+                        help='End time for mirror (defaults to none - new events are added as they occur).  YYYY-mm-dd, YYYY-mm-ddTHH:MM:SS, or YYYY-mm-ddTHH:MM:SS.s')
+    parser.add_argument('-m','--mag-range', metavar=('minmag','maxmag'),dest='magRange', type=float,nargs=2,
+                        help='Min/max (authoritative) magnitude to restrict search.')
+    parser.add_argument('-c','--catalog', dest='catalog',
+                        help='Source catalog from which products derive (atlas, centennial, etc.)')
+    parser.add_argument('-n','--contributor', dest='contributor',
+                        help='Source contributor (who loaded product) (us, nc, etc.)')
+    parser.add_argument('-o','--get-moment-components', dest='getComponents', action='store_true',
+                        help='Also store moment-tensor components (including type and derived hypocenter) where available.')
+    parser.add_argument('-l','--limit-type', dest='limitType', default=None,
+                        choices=comcat.MTYPES, type=str,
+                        help='Only store moment-tensor components from given type.')
+    parser.add_argument('-a','--get-focal-angles', dest='getAngles', action='store_true',
+                        help='Also store focal-mechanism angles (strike,dip,rake) where available.')
+    parser.add_argument('-g','--get-all-magnitudes', dest='getAllMags', action='store_true',
+                        help='Store all magnitudes (with sources),authoritative listed first.')
+    parser.add_argument('-z','--reload', dest='reload', action='store_true',
+                        help='Discard the mirror and load it again, instead of syncing it.')
+    parser.add_argument('-v','--verbose', dest='verbose', action='store_true',
+                        help='Print progress')
+    parser.add_argument('-d','--debug', dest='debug', action='store_true',
+                        help='Check the USGS development server (only valid inside USGS network).')
+    parser.add_argument('-w','--workers', dest='maxWorkers', type=int, default=None,
+                        help='Number of event details to download at the same time (with -o, -a or -g).  By default this adapts to how well ComCat is keeping up.')
+    parser.add_argument('-p','--parallel-segments', dest='maxSegments', type=int, default=comcat.SEGMENTWORKERS,
+                        help='Number of time segments to search at the same time.')
+
+    pargs = parser.parse_args()
+
+    main(pargs)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import BaseHTTPServer
+import SocketServer
+import threading
+import socket
+import time
+import json
+import urlparse
+import calendar
+from datetime import datetime
+
+T0 = 1400000000000 #origin time (milliseconds since the epoch) of the first fake event (2014-05-13)
+SPACING = 60000 #milliseconds between fake events
+URLPATH = '/fdsnws/event/1/'
+TIMEFMT = '%Y-%m-%dT%H:%M:%S'
+#comcat module variables pointing at the ComCat server, and the fake server paths that replace them
+URLNAMES = {'URLBASE':URLPATH+'query?%s',
+            'COUNTBASE':URLPATH+'count?%s',
+            'CHECKBASE':URLPATH+'%s',
+            'EVENTURL':URLPATH+'query?eventid=[EVENTID]&format=geojson',
+            'ALLPRODURL':URLPATH+'query?format=geojson&includesuperseded=true&eventid=[EVENTID]'}
+
+def getTimeStamp(timestring):
+    """
+    Return a ComCat query time string as milliseconds since the epoch.
+    @param timestring: Time string (YYYY-mm-ddTHH:MM:SS, with optional fractional seconds).
+    @return: Milliseconds since the epoch.
+    """
+    dtime = datetime.strptime(timestring.split('.')[0],TIMEFMT)
+    return calendar.timegm(dtime.timetuple())*1000
+
+class FakeComCat(object):
+    """
+    Minimal ComCat server, running in a background thread, for testing searches, counts and syncs.
+
+    The server holds a list of GeoJSON features (self.events) which tests can change between requests.
+    Searches honor starttime, endtime and updatedafter, and, like ComCat, searches matching more than
+    maxAllowed events are refused with HTTP 400.  Every request path is recorded in self.requests.
+    """
+    def __init__(self,nevents=50,maxAllowed=20000):
+        """
+        Create a fake ComCat server (call start() to run it).
+        @keyword nevents: Number of fake events, one every SPACING milliseconds from T0.
+        @keyword maxAllowed: Maximum number of events returned by one search.
+        """
+        self.maxAllowed = maxAllowed
+        self.events = [self.makeFeature(i) for i in range(0,nevents)]
+        self.requests = []
+        #function(path,query) returning an HTTP error status for requests that should fail, or None
+        self.fail = None
+        self.base = None
+        self._server = None
+        self._saved = {}
+
+    def makeFeature(self,i):
+        """
+        Return the GeoJSON search feature of a fake event.
+        @param i: Event number.
+        @return: GeoJSON feature dictionary.
+        """
+        eventid = 'us%08i' % i
+        properties = {'time':T0 + i*SPACING,'updated':T0 + i,'mag':3.0 + (i % 5)*0.1,'place':'Fake place %i' % i,
+                      'type':'earthquake','types':',origin,','ids':',%s,' % eventid,'sources':',us,',
+                      'url':'http://localhost/earthquakes/eventpage/%s' % eventid,'status':'reviewed',
+                      'alert':None,'sig':100}
+        return {'type':'Feature','id':eventid,'properties':properties,
+                'geometry':{'type':'Point','coordinates':[-120.0 + i*0.01,35.0,10.0]}}
+
+    def updateEvent(self,i,**properties):
+        """
+        Change the properties of a fake event, and set its update time to now.
+        @param i: Event number.
+        @param properties: Feature properties to change (i.e., mag=5.0).
+        """
+        feature = self.events[i]
+        feature['properties'].update(properties)
+        feature['properties']['updated'] = int(time.time()*1000)
+
+    def start(self):
+        """
+        Start serving requests on a free local port.
+        @return: Base URL of the server (i.e., 'http://127.0.0.1:12345').
+        """
+        self._server = FakeServer(('127.0.0.1',0),FakeHandler)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base = 'http://127.0.0.1:%i' % self._server.server_address[1]
+        return self.base
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self._server.stop()
+
+    def patch(self,comcat):
+        """
+        Point the comcat module at this server (undo with unpatch()).
+        @param comcat: libcomcat.comcat module.
+        """
+        for name,path in URLNAMES.iteritems():
+            self._saved[name] = getattr(comcat,name)
+            setattr(comcat,name,self.base + path)
+
+    def unpatch(self,comcat):
+        """
+        Point the comcat module back at ComCat.
+        @param comcat: libcomcat.comcat module.
+        """
+        for name,url in self._saved.iteritems():
+            setattr(comcat,name,url)
+        self._saved = {}
+
+    def search(self,query):
+        """
+        Return the fake events matching a search.
+        @param query: Dictionary of ComCat query parameters.
+        @return: List of GeoJSON features.
+        """
+        features = self.events
+        if 'eventid' in query:
+            return [feature for feature in features if feature['id'] == query['eventid']]
+        if 'starttime' in query:
+            stime = getTimeStamp(query['starttime'])
+            features = [feature for feature in features if feature['properties']['time'] >= stime]
+        if 'endtime' in query:
+            etime = getTimeStamp(query['endtime'])
+            features = [feature for feature in features if feature['properties']['time'] <= etime]
+        if 'updatedafter' in query:
+            utime = getTimeStamp(query['updatedafter'])
+            features = [feature for feature in features if feature['properties']['updated'] > utime]
+        return features
+
+class FakeServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self,address,handler):
+        BaseHTTPServer.HTTPServer.__init__(self,address,handler)
+        self.connections = []
+
+    def process_request(self,request,client_address):
+        self.connections.append(request)
+        SocketServer.ThreadingMixIn.process_request(self,request,client_address)
+
+    def handle_error(self,request,client_address):
+        #clients dropping pooled connections are not errors here
+        pass
+
+    def stop(self):
+        """
+        Stop serving, and close the (keep-alive) connections still open, so their threads finish.
+        """
+        self.shutdown()
+        for conn in self.connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.server_close()
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.requests.append(self.path)
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if fake.fail is not None:
+            status = fake.fail(url.path,query)
+            if status is not None:
+                self._send(status,'Error %i' % status)
+                return
+        features = fake.search(query)
+        if url.path.endswith('/count'):
+            self._send(200,json.dumps({'count':len(features),'maxAllowed':fake.maxAllowed}))
+        elif not url.path.endswith('/query'):
+            self._send(404,'Not found')
+        elif 'eventid' in query:
+            if not len(features):
+                self._send(404,'Not found')
+                return
+            detail = json.loads(json.dumps(features[0]))
+            detail['properties']['products'] = {}
+            self._send(200,json.dumps(detail))
+        elif len(features) > fake.maxAllowed:
+            self._send(400,'Error 400: %i matching events exceeds search limit of %i.' % (len(features),fake.maxAllowed))
+        else:
+            self._send(200,json.dumps({'type':'FeatureCollection','metadata':{'count':len(features)},
+                                       'features':features}))
+
+    def log_message(self,*args):
+        pass
+
+    def _send(self,status,body):
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import unittest
+import os.path
+import sys
+import shutil
+import tempfile
+import argparse
+import urlparse
+
+#make the libcomcat package and the scripts in the parent directory importable
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#local imports
+from libcomcat.table import EventTable
+from libcomcat.checkpoint import Checkpoint,SEGMENTFILE
+from test_table import makeEvent
+import fakecomcat
+try:
+    from libcomcat import comcat,cache
+    import getcsv
+except ImportError:
+    comcat = None
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_resume(self):
+        query = {'magRange':[5.0,9.9]}
+        checkpoint = Checkpoint(self.folder)
+        self.assertFalse(checkpoint.exists())
+        checkpoint.create(query,[(0,10),(10,20),(20,30)])
+        checkpoint.save(0,EventTable.fromEvents([makeEvent(i,nmags=1) for i in range(0,3)]))
+        checkpoint.save(2,EventTable.fromEvents([makeEvent(i) for i in range(6,9)]))
+
+        checkpoint = Checkpoint(self.folder)
+        self.assertTrue(checkpoint.exists())
+        self.assertEqual(checkpoint.load(query),[(0,10),(10,20),(20,30)])
+        self.assertEqual(checkpoint.getPending(),[1])
+        self.assertEqual(checkpoint.getMagnitudeCount(),1)
+        #adjacent segments share a boundary, so an event can be found by both
+        checkpoint.save(1,EventTable.fromEvents([makeEvent(i,nmags=2) for i in range(2,7)]))
+        self.assertEqual(checkpoint.getPending(),[])
+        self.assertEqual(checkpoint.getMagnitudeCount(),2)
+        ids = []
+        for table in checkpoint.iterTables():
+            ids += table['id'].tolist()
+        self.assertEqual(ids,['us%08i' % i for i in range(0,9)])
+
+    def test_query_mismatch(self):
+        checkpoint = Checkpoint(self.folder)
+        checkpoint.create({'magRange':[5.0,9.9]},[(0,10)])
+        self.assertRaises(Exception,Checkpoint(self.folder).load,{'magRange':[4.0,9.9]})
+
+    def test_missing_segment(self):
+        checkpoint = Checkpoint(self.folder)
+        checkpoint.create({},[(0,10),(10,20)])
+        checkpoint.save(0,EventTable.fromEvents([makeEvent(0)]))
+        checkpoint.save(1,EventTable.fromEvents([makeEvent(1)]))
+        os.remove(os.path.join(self.folder,SEGMENTFILE % 1))
+        checkpoint = Checkpoint(self.folder)
+        checkpoint.load()
+        self.assertEqual(checkpoint.getPending(),[1])
+
+@unittest.skipIf(comcat is None,'libcomcat.comcat dependencies (neicmap, neicio) are not installed')
+class CheckpointSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        #20 events per search means the 50 fake events are searched in several segments
+        self.fake = fakecomcat.FakeComCat(nevents=50,maxAllowed=20)
+        self.fake.start()
+        self.fake.patch(comcat)
+        cache.setMemo(cache.Memo())
+        cache.setDetailCache(None)
+
+    def tearDown(self):
+        self.fake.unpatch(comcat)
+        self.fake.stop()
+        shutil.rmtree(self.folder)
+
+    def getArgs(self,resume):
+        return argparse.Namespace(checkpoint=self.folder,resume=resume,bounds=None,radius=None,magRange=None,
+                                  catalog=None,contributor=None,getComponents=False,getAngles=False,
+                                  getAllMags=False,maxMags=None,limitType=None,debug=False,
+                                  startTime=comcat.ShakeDateTime(2014,1,1),endTime=comcat.ShakeDateTime(2015,1,1),
+                                  maxSegments=comcat.SEGMENTWORKERS,maxWorkers=None,verbose=False)
+
+    def getCheckpointTables(self,args):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull,'w')
+        try:
+            tables,maxmags = getcsv.getCheckpointTables(args,args.startTime,args.endTime)
+            return list(tables)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+    def test_resume_after_failure(self):
+        #searches of the second half of the events fail
+        failtime = fakecomcat.T0 + 30*fakecomcat.SPACING
+        def fail(path,query):
+            if path.endswith('/query') and fakecomcat.getTimeStamp(query['starttime']) >= failtime:
+                return 400
+            return None
+        self.fake.fail = fail
+        self.assertRaises(Exception,self.getCheckpointTables,self.getArgs(False))
+
+        checkpoint = Checkpoint(self.folder)
+        segments = checkpoint.load()
+        pending = checkpoint.getPending()
+        self.assertTrue(len(segments) > 2)
+        self.assertTrue(0 < len(pending) < len(segments))
+        self.assertEqual(pending,range(len(segments)-len(pending),len(segments)))
+
+        #only the unfinished segments are searched again
+        self.fake.fail = None
+        nrequests = len(self.fake.requests)
+        tables = self.getCheckpointTables(self.getArgs(True))
+        firsttime = segments[pending[0]][0]//1000*1000
+        for path in self.fake.requests[nrequests:]:
+            url = urlparse.urlparse(path)
+            if url.path.endswith('/query'):
+                query = dict(urlparse.parse_qsl(url.query))
+                self.assertTrue(fakecomcat.getTimeStamp(query['starttime']) >= firsttime)
+        ids = []
+        for table in tables:
+            ids += table['id'].tolist()
+        self.assertEqual(ids,[feature['id'] for feature in self.fake.events])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import unittest
+import os.path
+import sys
+import shutil
+import tempfile
+
+#make the libcomcat package in the parent directory importable
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#local imports
+import fakecomcat
+try:
+    from libcomcat import comcat,cache
+    from libcomcat.mirror import Mirror
+except ImportError:
+    comcat = None
+
+@unittest.skipIf(comcat is None,'libcomcat.comcat dependencies (neicmap, neicio) are not installed')
+class MirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        #20 events per search means the 50 fake events are loaded in several segments
+        self.fake = fakecomcat.FakeComCat(nevents=50,maxAllowed=20)
+        self.fake.start()
+        self.fake.patch(comcat)
+        cache.setMemo(cache.Memo())
+        cache.setDetailCache(None)
+        self.stime = comcat.ShakeDateTime(2014,1,1)
+        self.etime = comcat.ShakeDateTime(2015,1,1)
+        self.mirror = Mirror(self.folder)
+
+    def tearDown(self):
+        self.mirror.close()
+        self.fake.unpatch(comcat)
+        self.fake.stop()
+        shutil.rmtree(self.folder)
+
+    def getMagnitudes(self):
+        features = self.mirror.getFeatures(starttime=self.stime,endtime=self.etime)
+        return dict([(feature['id'],feature['properties']['mag']) for feature in features])
+
+    def test_load_failure(self):
+        #searches of the second half of the events fail
+        failtime = fakecomcat.T0 + 30*fakecomcat.SPACING
+        def fail(path,query):
+            if path.endswith('/query') and fakecomcat.getTimeStamp(query['starttime']) >= failtime:
+                return 500
+            return None
+        self.fake.fail = fail
+        self.assertRaises(Exception,self.mirror.load,starttime=self.stime,endtime=self.etime)
+        self.assertFalse(self.mirror.isLoaded())
+        self.assertTrue(self.mirror.isPartial())
+        self.assertRaises(Exception,self.mirror.sync)
+
+        #a mirror reopened after the failed load is still not loaded
+        self.mirror.close()
+        self.mirror = Mirror(self.folder)
+        self.assertFalse(self.mirror.isLoaded())
+        self.assertTrue(self.mirror.isPartial())
+
+        self.fake.fail = None
+        self.assertEqual(self.mirror.load(starttime=self.stime,endtime=self.etime),50)
+        self.assertTrue(self.mirror.isLoaded())
+        self.assertFalse(self.mirror.isPartial())
+        self.fake.updateEvent(3,mag=6.5)
+        self.fake.updateEvent(40,mag=7.5)
+        self.assertEqual(self.mirror.sync(),(2,0))
+        mags = self.getMagnitudes()
+        self.assertEqual(len(mags),50)
+        self.assertEqual(mags['us00000003'],6.5)
+        self.assertEqual(mags['us00000040'],7.5)
+
+    def test_sync_split(self):
+        self.mirror.load(starttime=self.stime,endtime=self.etime)
+        #more changed events than ComCat will return from one search
+        for i in range(0,len(self.fake.events)):
+            self.fake.updateEvent(i,mag=5.0)
+        self.assertEqual(self.mirror.sync(),(50,0))
+        self.assertEqual(set(self.getMagnitudes().values()),set([5.0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import unittest
+import os.path
+import sys
+import threading
+import BaseHTTPServer
+import httplib
+import urlparse
+import base64
+import json
+
+#make the libcomcat package in the parent directory importable
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#local imports
+from libcomcat import session
+import fakecomcat
+
+PROXYVARS = ['http_proxy','https_proxy','no_proxy','HTTP_PROXY','HTTPS_PROXY','NO_PROXY']
+
+class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #forwarding http proxy which records the request line and Proxy-Authorization header of each request
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path,self.headers.getheader('Proxy-Authorization')))
+        url = urlparse.urlsplit(self.path)
+        conn = httplib.HTTPConnection(url.hostname,url.port)
+        conn.request('GET',url.path + '?' + url.query)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        self.send_response(response.status)
+        self.send_header('Content-Type',response.getheader('Content-Type'))
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        #proxy settings in the environment running the tests must not get in the way
+        self.environ = dict([(name,os.environ.pop(name)) for name in PROXYVARS if name in os.environ])
+        self.fake = fakecomcat.FakeComCat(nevents=5)
+        self.fake.start()
+        self.proxy = fakecomcat.FakeServer(('127.0.0.1',0),ProxyHandler)
+        self.proxy.requests = []
+        thread = threading.Thread(target=self.proxy.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.proxyurl = 'http://127.0.0.1:%i' % self.proxy.server_address[1]
+        self.url = self.fake.base + fakecomcat.URLPATH + 'count?starttime=2014-01-01T00:00:00'
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.fake.stop()
+        for name in PROXYVARS:
+            os.environ.pop(name,None)
+        os.environ.update(self.environ)
+
+    def getCount(self,proxysession):
+        fh = proxysession.get(self.url)
+        try:
+            return json.loads(fh.read())['count']
+        finally:
+            fh.close()
+
+    def test_proxy(self):
+        proxyurl = self.proxyurl.replace('http://','http://user:p%40ss@')
+        proxysession = session.Session(proxies={'http':proxyurl})
+        for i in range(0,3):
+            self.assertEqual(self.getCount(proxysession),5)
+        #requests through a proxy give the whole URL
+        auth = 'Basic ' + base64.b64encode('user:p@ss')
+        self.assertEqual(self.proxy.requests,[(self.url,auth)]*3)
+        self.assertEqual(len(self.fake.requests),3)
+
+    def test_environment(self):
+        os.environ['http_proxy'] = self.proxyurl
+        self.assertEqual(self.getCount(session.Session()),5)
+        self.assertEqual(self.proxy.requests,[(self.url,None)])
+
+    def test_bypass(self):
+        os.environ['http_proxy'] = self.proxyurl
+        os.environ['no_proxy'] = '127.0.0.1'
+        self.assertEqual(self.getCount(session.Session()),5)
+        self.assertEqual(self.proxy.requests,[])
+        self.assertEqual(len(self.fake.requests),1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import unittest
+import re
+import cPickle
+from StringIO import StringIO
+from collections import OrderedDict
+from datetime import datetime,timedelta
+
+#third party imports
+import numpy
+
+#local imports
+from libcomcat.table import EventTable,TableWriter,CAPACITY
+
+TIMEFMT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def makeEvent(i,nmags=0,eventid=None):
+    """
+    Return an event dictionary laid out like those returned by comcat.getEventData().
+    @param i: Event number.
+    @keyword nmags: Number of (mag,source,type) magnitude column groups.
+    @keyword eventid: Event ID, or None for one made from the event number.
+    @return: Event OrderedDict.
+    """
+    if eventid is None:
+        eventid = 'us%08i' % i
+    event = OrderedDict()
+    event['id'] = [eventid,'%s']
+    event['time'] = [datetime(2014,5,13,16,53,20,123000) + timedelta(seconds=61*i),'%s']
+    event['lat'] = [35.0 + i*0.01,'%.4f']
+    event['lon'] = [-120.0 - i*0.01,'%.4f']
+    event['depth'] = [10.0 + i,'%.1f']
+    event['mag'] = [3.0 + (i % 5)*0.1,'%g']
+    event['event-type'] = ['earthquake','%s']
+    for j in range(1,nmags+1):
+        event['mag%i' % j] = [3.0 + j*0.2,'%.1f']
+        event['mag%i-source' % j] = ['us','%s']
+        event['mag%i-type' % j] = ['m%i' % j,'%s']
+    return event
+
+def getBaselineText(events,maxmags):
+    #the csv layout getcsv.py wrote before events were collected into EventTables
+    text = ''
+    for k,event in enumerate(events):
+        keys = event.keys()
+        values = [tuple(value) for value in event.values()]
+        idx = len(keys)
+        bigmag = 0
+        for key in keys:
+            if re.search('mag[0-9]*-type',key):
+                idx = keys.index(key) + 1
+                bigmag = int(re.findall('\d+',key)[0])
+        for i in range(bigmag+1,maxmags+1):
+            keys[idx:idx] = ['mag%i' % i,'mag%i-source' % i,'mag%i-type' % i]
+            values[idx:idx] = [(float('nan'),'%.1f'),('NA','%s'),('NA','%s')]
+            idx += 3
+        if k == 0:
+            text += ','.join(keys) + '\n'
+        values[1] = (values[1][0].strftime(TIMEFMT)[0:-3],'%s')
+        text += ','.join([fmt for value,fmt in values]) % tuple([value for value,fmt in values]) + '\n'
+    return text
+
+class EventTableTest(unittest.TestCase):
+    def test_append(self):
+        events = [makeEvent(i) for i in range(0,3*CAPACITY+1)]
+        table = EventTable.fromEvents(events)
+        self.assertEqual(len(table),len(events))
+        self.assertEqual(table.names,events[0].keys())
+        self.assertEqual(table['id'].tolist(),[event['id'][0] for event in events])
+        self.assertEqual(table['depth'].tolist(),[event['depth'][0] for event in events])
+        self.assertEqual(str(table['time'][1]),'2014-05-13T16:54:21.123')
+
+    def test_append_magnitudes(self):
+        table = EventTable.fromEvents([makeEvent(0,nmags=1),makeEvent(1,nmags=2),makeEvent(2)])
+        self.assertEqual(table.getMagnitudeCount(),2)
+        self.assertEqual(table.names[7:],['mag1','mag1-source','mag1-type','mag2','mag2-source','mag2-type'])
+        self.assertTrue(numpy.isnan(table['mag2'][0]))
+        self.assertEqual(table['mag2-type'].tolist(),['NA','m2','NA'])
+        self.assertEqual(table['mag1-source'].tolist(),['us','us','NA'])
+
+    def test_extend(self):
+        table = EventTable.fromEvents([makeEvent(i,nmags=1) for i in range(0,CAPACITY)])
+        other = EventTable.fromEvents([makeEvent(i,nmags=3) for i in range(CAPACITY,CAPACITY+5)])
+        table.extend(other)
+        self.assertEqual(len(table),CAPACITY+5)
+        self.assertEqual(table.getMagnitudeCount(),3)
+        self.assertEqual(table['id'].tolist(),['us%08i' % i for i in range(0,CAPACITY+5)])
+        self.assertEqual(table['mag3-type'].tolist(),['NA']*CAPACITY + ['m3']*5)
+        self.assertEqual(table['mag1'].tolist(),[3.2]*(CAPACITY+5))
+
+    def test_select(self):
+        table = EventTable.fromEvents([makeEvent(i) for i in range(0,10)])
+        big = table[table['mag'] > 3.25]
+        self.assertEqual(big['id'].tolist(),['us%08i' % i for i in [3,4,8,9]])
+        self.assertEqual(len(table[2]),1)
+        self.assertEqual(table[2]['id'].tolist(),['us00000002'])
+
+    def test_pickle(self):
+        table = EventTable.fromEvents([makeEvent(i,nmags=1) for i in range(0,CAPACITY+1)])
+        copy = cPickle.loads(cPickle.dumps(table,cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(len(copy),len(table))
+        self.assertEqual(copy.columns,table.columns)
+        self.assertEqual(copy['id'].tolist(),table['id'].tolist())
+        self.assertEqual(copy['time'].tolist(),table['time'].tolist())
+        #only the rows in use are pickled, not the spare capacity
+        self.assertEqual(len(copy.data),len(table))
+        self.assertEqual(len(copy._data),len(table))
+        copy.append(makeEvent(99,nmags=1))
+        self.assertEqual(copy['id'].tolist()[-1],'us00000099')
+
+    def test_long_strings(self):
+        eventid = 'ak' + 'x'*200
+        table = EventTable.fromEvents([makeEvent(0),makeEvent(1,eventid=eventid)])
+        table.append(makeEvent(2,eventid=eventid+'y'))
+        copy = cPickle.loads(cPickle.dumps(table,cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy['id'].tolist(),['us00000000',eventid,eventid+'y'])
+
+class TableWriterTest(unittest.TestCase):
+    def getText(self,tables,maxmags,sep=','):
+        fh = StringIO()
+        writer = TableWriter(fh,tables[0].columns.items(),maxmags=maxmags,sep=sep,batchsize=4)
+        writer.writeHeader()
+        for table in tables:
+            writer.write(table)
+        return fh.getvalue()
+
+    def test_baseline(self):
+        events = [makeEvent(i) for i in range(0,10)]
+        self.assertEqual(self.getText([EventTable.fromEvents(events)],0),getBaselineText(events,0))
+
+    def test_baseline_magnitudes(self):
+        events = [makeEvent(i,nmags=i % 4) for i in range(1,12)]
+        tables = [EventTable.fromEvents(events[0:5]),EventTable.fromEvents(events[5:])]
+        self.assertEqual(self.getText(tables,3),getBaselineText(events,3))
+        self.assertEqual(self.getText(tables,4),getBaselineText(events,4))
+
+    def test_separator(self):
+        events = [makeEvent(i,nmags=1) for i in range(0,3)]
+        text = self.getText([EventTable.fromEvents(events)],1,sep='\t')
+        self.assertEqual(text,getBaselineText(events,1).replace(',','\t'))
+
+    def test_extra_magnitudes(self):
+        events = [makeEvent(i,nmags=3) for i in range(0,3)]
+        lines = self.getText([EventTable.fromEvents(events)],1).splitlines()
+        self.assertEqual(lines[0],'id,time,lat,lon,depth,mag,event-type,mag1,mag1-source,mag1-type')
+        self.assertEqual(lines[1],'us00000000,2014-05-13T16:53:20.123,35.0000,-120.0000,10.0,3,earthquake,3.2,us,m1')
+
+if __name__ == '__main__':
+    unittest.main()